@@ -0,0 +1,262 @@
+"""
+Offline benchmark of the overhead the agent harness itself adds per turn.
+
+Drives the agent engine and `FunctionCallHandler` against a scripted local stand-in for the
+Messages API (see `fake_messages_api`), with trivial tools, so any time or memory measured is
+spent in our code (and the SDK), not the model or the tools.
+
+Reports:
+  - harness overhead per tool use iteration (streaming, compaction, cache planning, events, etc)
+  - tool dispatch overhead per call, compared to calling the function directly
+  - memory growth per iteration over a long conversation
+
+Fails (exit code 1) if any metric regresses past the stored baseline by more than `--tolerance`.
+
+Example:
+
+    python -m benchmarks.benchmark_agent_loop
+
+    # after an intentional change
+    python -m benchmarks.benchmark_agent_loop --update-baseline
+
+"""
+
+from typing import Any
+import argparse
+import json
+import pathlib
+import sys
+import time
+import tracemalloc
+
+import anthropic
+import httpx
+
+from local_claude.libs import agent_engine
+from local_claude.libs import directory_utils
+from local_claude.libs.function_call_handler import FunctionCallHandler
+
+from benchmarks import fake_messages_api
+
+
+DEFAULT_BASELINE_FILEPATH = pathlib.Path(__file__).parent / "baseline.json"
+
+# allowed fractional increase over the baseline before failing, generous since timings are noisy
+DEFAULT_TOLERANCE = 0.5
+
+
+def echo_payload(size: int) -> str:
+    """
+    Return a payload of the given size.
+
+    Args:
+        size (int): Number of characters to return.
+
+    """
+
+    return "x" * size
+
+
+def _make_script(
+    iterations_per_turn: int,
+    payload_size: int,
+) -> fake_messages_api.ScriptedMessagesApi:
+    """Fake model which calls `echo_payload` until `iterations_per_turn`, then answers."""
+
+    def script(request_json: dict[str, Any]) -> fake_messages_api.MessageJson:
+
+        # user message, then an (assistant, tool result) pair per iteration
+        iteration_index = (len(request_json["messages"]) - 1) // 2
+
+        if iteration_index >= iterations_per_turn - 1:
+            return fake_messages_api.make_text_message_json("All done.")
+
+        return fake_messages_api.make_tool_use_message_json(
+            tool_use_id=f"toolu_{iteration_index}",
+            name="echo_payload",
+            tool_input={"size": payload_size},
+            text="Calling the tool again.",
+        )
+
+    return fake_messages_api.ScriptedMessagesApi(script=script)
+
+
+def _run_turn(
+    iterations_per_turn: int,
+    payload_size: int,
+) -> None:
+    """Run a single turn on a fresh engine, polling events like the page does."""
+
+    fake_api = _make_script(
+        iterations_per_turn=iterations_per_turn,
+        payload_size=payload_size,
+    )
+
+    engine = agent_engine.AgentEngine(
+        client=anthropic.AsyncAnthropic(
+            api_key="fake_api_key",
+            http_client=httpx.AsyncClient(transport=fake_api.get_transport()),
+        )
+    )
+
+    future = engine.start_turn(
+        conversation_id="benchmark",
+        messages=[{"role": "user", "content": "Call the tool repeatedly."}],
+        function_call_handler=FunctionCallHandler(functions=[echo_payload]),
+        config=agent_engine.AgentTurnConfig(
+            model="claude-3-5-sonnet-20240620",
+            max_tokens=1024,
+            system="You are a helpful assistant",
+            max_iterations=iterations_per_turn,
+            context_token_budget=50_000,
+        ),
+    )
+
+    events: list[agent_engine.AgentEvent] = []
+
+    while not future.done():
+        events.extend(engine.poll_events("benchmark"))
+        time.sleep(0.001)
+
+    events.extend(engine.poll_events("benchmark"))
+
+    engine.shutdown()
+
+    assert isinstance(events[-1], agent_engine.TurnFinishedEvent)
+    assert events[-1].reason == "end_turn", events[-1].error_traceback
+
+
+def measure_harness_overhead_per_iteration_ms(
+    num_turns: int = 5,
+    iterations_per_turn: int = 20,
+) -> float:
+
+    # warm up imports, pydantic model building, etc
+    _run_turn(iterations_per_turn=2, payload_size=100)
+
+    start_time = time.perf_counter()
+
+    for _ in range(num_turns):
+        _run_turn(iterations_per_turn=iterations_per_turn, payload_size=100)
+
+    elapsed_seconds = time.perf_counter() - start_time
+
+    return elapsed_seconds * 1000.0 / (num_turns * iterations_per_turn)
+
+
+def measure_tool_dispatch_overhead_us(num_calls: int = 2000) -> float:
+
+    function_call_handler = FunctionCallHandler(functions=[echo_payload])
+
+    tool_call = anthropic.types.ToolUseBlock(
+        type="tool_use",
+        id="toolu_fake",
+        name="echo_payload",
+        input={"size": 100},
+    )
+
+    start_time = time.perf_counter()
+
+    for _ in range(num_calls):
+        echo_payload(size=100)
+
+    direct_seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+
+    for _ in range(num_calls):
+        function_call_handler.resolve_many(tool_calls=[tool_call])
+
+    dispatch_seconds = time.perf_counter() - start_time
+
+    return (dispatch_seconds - direct_seconds) * 1_000_000.0 / num_calls
+
+
+def measure_memory_growth_kib_per_iteration(
+    iterations_per_turn: int = 50,
+    payload_size: int = 8_000,
+) -> float:
+
+    # note: long enough that the conversation goes over the context token budget, so this
+    #       includes compaction (under `tracemalloc` each iteration is slow, so not longer)
+
+    tracemalloc.start()
+
+    try:
+        start_bytes, _ = tracemalloc.get_traced_memory()
+
+        _run_turn(iterations_per_turn=iterations_per_turn, payload_size=payload_size)
+
+        _, peak_bytes = tracemalloc.get_traced_memory()
+
+    finally:
+        tracemalloc.stop()
+
+    return (peak_bytes - start_bytes) / 1024.0 / iterations_per_turn
+
+
+def run_benchmarks() -> dict[str, float]:
+
+    # tools and compaction write to the workspace, so keep it out of the repo
+    with directory_utils.temporary_working_directory():
+
+        return {
+            "harness_overhead_per_iteration_ms": measure_harness_overhead_per_iteration_ms(),
+            "tool_dispatch_overhead_us": measure_tool_dispatch_overhead_us(),
+            "memory_growth_kib_per_iteration": measure_memory_growth_kib_per_iteration(),
+        }
+
+
+def main() -> None:
+
+    parser = argparse.ArgumentParser(description=__doc__)
+
+    parser.add_argument("--baseline", type=pathlib.Path, default=DEFAULT_BASELINE_FILEPATH)
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="Write the results as the new baseline instead of comparing against it",
+    )
+
+    args = parser.parse_args()
+
+    results = run_benchmarks()
+
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"Wrote baseline to {args.baseline}: {json.dumps(results, indent=2)}")
+        return None
+
+    baseline: dict[str, float] = json.loads(args.baseline.read_text())
+
+    regressions: list[str] = []
+
+    for name, value in results.items():
+
+        baseline_value = baseline.get(name)
+
+        if baseline_value is None:
+            print(f"{name}: {value:.2f} (no baseline)")
+            continue
+
+        max_allowed_value = baseline_value * (1.0 + args.tolerance)
+        is_regression = value > max_allowed_value
+
+        print(
+            f"{name}: {value:.2f} (baseline: {baseline_value:.2f}, "
+            f"max allowed: {max_allowed_value:.2f}){' REGRESSION' if is_regression else ''}"
+        )
+
+        if is_regression:
+            regressions.append(name)
+
+    if regressions:
+        print(f"Regressions in: {regressions}")
+        sys.exit(1)
+
+    return None
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Benchmark of how long `run_claude.py` takes to render, on a cold start and on each rerun.
+
+Every streamlit interaction reruns the whole script, so rerun time is paid on every click, while
+cold start time (mostly imports) is paid by the first session after the server starts.
+
+Each sample runs the page with streamlit's `AppTest` in a fresh process (so nothing is already
+imported), from the same temporary working directory, after one unmeasured warm up run (so on disk
+caches, ex: `.pyc` files and tool schemas, are as they'd be on a restart of the server).
+
+Reports:
+  - cold start, the first run of the page in a new process
+  - rerun, each later run of the page in the same process
+
+Example:
+
+    python -m benchmarks.benchmark_page_startup
+
+"""
+
+import argparse
+import json
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import tempfile
+import textwrap
+
+
+REPO_DIRECTORY = pathlib.Path(__file__).parent.parent
+
+DEFAULT_NUM_PROCESSES = 5
+
+DEFAULT_NUM_RERUNS = 20
+
+# run in the child, prints the timings as JSON
+_MEASURE_SCRIPT = textwrap.dedent(
+    """
+    import json
+    import sys
+    import time
+
+    from streamlit.testing.v1 import AppTest
+
+    num_reruns = int(sys.argv[1])
+
+    app_test = AppTest.from_file("run_claude.py", default_timeout=60.0)
+
+    start_time = time.perf_counter()
+    app_test.run()
+    cold_start_seconds = time.perf_counter() - start_time
+
+    assert not app_test.exception, app_test.exception
+
+    rerun_seconds = []
+
+    for _ in range(num_reruns):
+        start_time = time.perf_counter()
+        app_test.run()
+        rerun_seconds.append(time.perf_counter() - start_time)
+
+    print(json.dumps({"cold_start_seconds": cold_start_seconds, "rerun_seconds": rerun_seconds}))
+    """
+)
+
+
+def _measure_in_new_process(
+    working_directory: pathlib.Path,
+    num_reruns: int,
+) -> dict[str, float | list[float]]:
+
+    completed_process = subprocess.run(
+        [sys.executable, "-c", _MEASURE_SCRIPT, str(num_reruns)],
+        cwd=working_directory,
+        capture_output=True,
+        text=True,
+        check=True,
+        # note: the page doesn't make requests until a message is sent, so any key works
+        env={"ANTHROPIC_API_KEY": "fake_api_key", **os.environ},
+    )
+
+    timings: dict[str, float | list[float]] = json.loads(
+        completed_process.stdout.strip().splitlines()[-1]
+    )
+
+    return timings
+
+
+def main() -> None:
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--num-processes", type=int, default=DEFAULT_NUM_PROCESSES)
+    parser.add_argument("--num-reruns", type=int, default=DEFAULT_NUM_RERUNS)
+    args = parser.parse_args()
+
+    cold_start_seconds: list[float] = []
+    rerun_seconds: list[float] = []
+
+    with tempfile.TemporaryDirectory() as temporary_directory:
+
+        working_directory = pathlib.Path(temporary_directory)
+
+        # note: the page imports `local_claude` and reads / writes relative to the working directory
+        (working_directory / "local_claude").symlink_to(REPO_DIRECTORY / "local_claude")
+        (working_directory / "run_claude.py").symlink_to(REPO_DIRECTORY / "run_claude.py")
+
+        # warm up
+        _measure_in_new_process(working_directory, num_reruns=1)
+
+        for _ in range(args.num_processes):
+
+            timings = _measure_in_new_process(working_directory, args.num_reruns)
+
+            cold_start_seconds.append(timings["cold_start_seconds"])  # type: ignore[arg-type]
+            rerun_seconds.extend(timings["rerun_seconds"])  # type: ignore[arg-type]
+
+    print(f"cold_start_ms: {statistics.median(cold_start_seconds) * 1000:.1f} (median)")
+    print(f"rerun_ms: {statistics.median(rerun_seconds) * 1000:.1f} (median)")
+
+
+if __name__ == "__main__":
+    main()
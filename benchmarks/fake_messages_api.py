@@ -0,0 +1,215 @@
+"""
+Scripted local stand-in for the Messages API, for exercising the agent loop without network or API costs
+(in benchmarks and tests).
+
+Each request is answered by a `script` function given the request's json body, which returns the
+json of the `Message` to respond with. Streaming requests get the same message replayed as
+server sent events, split into small deltas like the real API.
+
+Example:
+
+    fake_api = ScriptedMessagesApi(script=lambda request_json: make_text_message_json("Hello"))
+
+    client = anthropic.AsyncAnthropic(
+        api_key="fake_api_key",
+        http_client=httpx.AsyncClient(transport=fake_api.get_transport()),
+    )
+
+"""
+
+from typing import Any, Callable
+import json
+import threading
+
+import httpx
+
+
+type MessageJson = dict[str, Any]
+
+# characters per text / json delta when replaying a message as a stream
+_STREAM_DELTA_CHARACTERS = 16
+
+
+def make_message_json(
+    content: list[dict[str, Any]],
+    stop_reason: str,
+    input_tokens: int = 10,
+    output_tokens: int = 5,
+) -> MessageJson:
+
+    return {
+        "id": "msg_fake",
+        "type": "message",
+        "role": "assistant",
+        "model": "claude-3-5-sonnet-20240620",
+        "content": content,
+        "stop_reason": stop_reason,
+        "stop_sequence": None,
+        "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens},
+    }
+
+
+def make_text_message_json(text: str) -> MessageJson:
+    return make_message_json(
+        content=[{"type": "text", "text": text}],
+        stop_reason="end_turn",
+    )
+
+
+def make_tool_use_message_json(
+    tool_use_id: str,
+    name: str,
+    tool_input: dict[str, Any],
+    text: str | None = None,
+) -> MessageJson:
+
+    content: list[dict[str, Any]] = [{"type": "text", "text": text}] if text else []
+
+    content.append(
+        {"type": "tool_use", "id": tool_use_id, "name": name, "input": tool_input}
+    )
+
+    return make_message_json(content=content, stop_reason="tool_use")
+
+
+def make_tool_turn_messages(
+    tool_use_id: str,
+    tool_result_content: str,
+    name: str = "open_url",
+    tool_input: dict[str, Any] | None = None,
+    text: str | None = None,
+) -> list[dict[str, Any]]:
+    """A tool use and its result, as the two messages they'd be stored as in a conversation."""
+
+    tool_use_message_json = make_tool_use_message_json(
+        tool_use_id=tool_use_id,
+        name=name,
+        tool_input=tool_input or {"url": f"https://example.com/{tool_use_id}"},
+        text=text,
+    )
+
+    return [
+        {"role": "assistant", "content": tool_use_message_json["content"]},
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "tool_result",
+                    "tool_use_id": tool_use_id,
+                    "content": tool_result_content,
+                    "is_error": False,
+                }
+            ],
+        },
+    ]
+
+
+def message_json_to_stream_events(message_json: MessageJson) -> list[dict[str, Any]]:
+    """Split a complete message into the raw events the API would stream for it."""
+
+    events: list[dict[str, Any]] = [
+        {
+            "type": "message_start",
+            "message": {
+                **message_json,
+                "content": [],
+                "stop_reason": None,
+                "stop_sequence": None,
+                "usage": {**message_json["usage"], "output_tokens": 1},
+            },
+        }
+    ]
+
+    for index, content_block in enumerate(message_json["content"]):
+
+        start_block: dict[str, Any]
+
+        if content_block["type"] == "text":
+            start_block = {"type": "text", "text": ""}
+            delta_type, delta_key = "text_delta", "text"
+            full_delta = content_block["text"]
+        else:
+            start_block = {**content_block, "input": {}}
+            delta_type, delta_key = "input_json_delta", "partial_json"
+            full_delta = json.dumps(content_block["input"])
+
+        events.append(
+            {"type": "content_block_start", "index": index, "content_block": start_block}
+        )
+
+        for i in range(0, len(full_delta), _STREAM_DELTA_CHARACTERS):
+            events.append(
+                {
+                    "type": "content_block_delta",
+                    "index": index,
+                    "delta": {
+                        "type": delta_type,
+                        delta_key: full_delta[i : i + _STREAM_DELTA_CHARACTERS],
+                    },
+                }
+            )
+
+        events.append({"type": "content_block_stop", "index": index})
+
+    events.append(
+        {
+            "type": "message_delta",
+            "delta": {
+                "stop_reason": message_json["stop_reason"],
+                "stop_sequence": message_json["stop_sequence"],
+            },
+            "usage": {"output_tokens": message_json["usage"]["output_tokens"]},
+        }
+    )
+    events.append({"type": "message_stop"})
+
+    return events
+
+
+def _to_server_sent_events(events: list[dict[str, Any]]) -> bytes:
+    return "".join(
+        f"event: {x['type']}\ndata: {json.dumps(x)}\n\n" for x in events
+    ).encode("utf-8")
+
+
+class ScriptedMessagesApi:
+    """
+    Answers Messages API requests using `script`, recording what was requested.
+
+    Safe to use from multiple threads and event loops at once.
+
+    """
+
+    def __init__(self, script: Callable[[dict[str, Any]], MessageJson]) -> None:
+
+        self._script = script
+
+        self._lock = threading.Lock()
+        self.num_requests = 0
+        self.num_request_bytes = 0
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+
+        request_json = json.loads(request.content)
+
+        with self._lock:
+            self.num_requests += 1
+            self.num_request_bytes += len(request.content)
+
+        message_json = self._script(request_json)
+
+        if request_json.get("stream"):
+            return httpx.Response(
+                200,
+                headers={"content-type": "text/event-stream"},
+                content=_to_server_sent_events(
+                    message_json_to_stream_events(message_json)
+                ),
+            )
+
+        return httpx.Response(200, json=message_json)
+
+    def get_transport(self) -> httpx.MockTransport:
+        """Transport for either `httpx.Client` or `httpx.AsyncClient`."""
+
+        return httpx.MockTransport(self.handle_request)
@@ -0,0 +1,114 @@
+"""
+Report the token cost of each default tool schema (under each `ToolSchemaVariant`) and of each
+section of the default system prompt, all of which are sent with every request.
+
+Optionally also compares variants in recorded telemetry, where `tool_schema_variant` is set on
+each model call, to see whether the compact variant actually lowered input tokens and latency.
+
+Example:
+
+    python -m benchmarks.profile_prompt_tokens
+
+    # after using both variants in the page for a while
+    python -m benchmarks.profile_prompt_tokens --telemetry-filepath telemetry/calls.jsonl
+
+"""
+
+from typing import Any
+import argparse
+import collections
+import pathlib
+import statistics
+
+from local_claude.libs import prompt_token_profiler
+from local_claude.libs import telemetry
+from local_claude.libs import tool_registry
+from local_claude.libs import tool_schema_variants
+from local_claude.libs.agent_defaults import AgentDefaults
+from local_claude.libs.tools import default_tools
+
+
+def _format_telemetry_comparison(records: list[dict[str, Any]]) -> str:
+
+    model_call_records_by_variant: dict[str, list[dict[str, Any]]] = (
+        collections.defaultdict(list)
+    )
+
+    for record in records:
+        if record["kind"] == "model_call":
+            variant = record.get("tool_schema_variant") or "unknown"
+            model_call_records_by_variant[variant].append(record)
+
+    lines = [f"{'calls':>8} {'input tokens':>14} {'latency':>9} {'ttft':>9}  variant (means)"]
+
+    for variant, variant_records in sorted(model_call_records_by_variant.items()):
+
+        times_to_first_token = [
+            x["time_to_first_token_seconds"]
+            for x in variant_records
+            if x["time_to_first_token_seconds"] is not None
+        ]
+
+        mean_time_to_first_token = (
+            f"{statistics.mean(times_to_first_token):.2f}s" if times_to_first_token else "-"
+        )
+
+        # note: cached input still counts, since the whole point is sending less
+        mean_input_tokens = statistics.mean(
+            x["input_tokens"] + x["cache_read_input_tokens"] + x["cache_creation_input_tokens"]
+            for x in variant_records
+        )
+
+        lines.append(
+            f"{len(variant_records):>8} {mean_input_tokens:>14,.0f} "
+            f"{statistics.mean(x['latency_seconds'] for x in variant_records):>8.2f}s "
+            f"{mean_time_to_first_token:>9}  {variant}"
+        )
+
+    return "\n".join(lines)
+
+
+def main() -> None:
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--telemetry-filepath", type=pathlib.Path, default=None)
+    args = parser.parse_args()
+
+    tool_schemas = [
+        tool_registry.get_tool_schema(x)
+        for x in default_tools.get_default_tool_registry().get_tools()
+    ]
+
+    for tool_schema_variant in tool_schema_variants.ToolSchemaVariant:
+
+        tool_schema_token_costs = prompt_token_profiler.profile_tool_schemas(
+            [
+                tool_schema_variants.apply_tool_schema_variant(
+                    x,
+                    tool_schema_variant=tool_schema_variant,
+                    compact_tool_descriptions=default_tools.DEFAULT_COMPACT_TOOL_DESCRIPTIONS,
+                )
+                for x in tool_schemas
+            ]
+        )
+
+        print(f"=== {tool_schema_variant.value} tool descriptions ===\n")
+        print(prompt_token_profiler.format_tool_schema_token_costs(tool_schema_token_costs))
+        print()
+
+    print("=== system prompt ===\n")
+    print(
+        prompt_token_profiler.format_system_prompt_token_profile(
+            prompt_token_profiler.profile_system_prompt(AgentDefaults.SYSTEM_PROMPT)
+        )
+    )
+    print()
+
+    if args.telemetry_filepath is not None:
+
+        print("=== recorded model calls by tool schema variant ===\n")
+        print(_format_telemetry_comparison(telemetry.read_telemetry_file(args.telemetry_filepath)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,638 @@
+"""
+Runs the agent tool use loop on a background asyncio event loop, decoupled from the Streamlit script run.
+
+Streamlit reruns the whole script on every widget interaction, which would abandon a loop running
+inside the script thread. Instead the page starts a turn with `AgentEngine.start_turn`, and then
+polls `AgentEngine.poll_events` to render progress. A turn keeps running across reruns, and turns
+for different conversations run concurrently.
+
+Note:
+  - the engine keeps its own copy of each conversation's messages while a turn runs, and saves
+    every message it adds with the turn's `message_sink` (ex: `ConversationStore.append_message`)
+    before emitting its `MessageAddedEvent`, so a turn is saved even if nothing polls for events
+    (ex: the page was rerun mid render, or the session went away)
+  - events are only for display, each conversation's are kept until they're polled or its next
+    turn starts, and a finished turn's state is dropped once its events are polled
+  - consecutive text deltas are collapsed into a single pending event, so a long response that
+    isn't polled doesn't keep a snapshot per delta
+
+"""
+
+from typing import Any, Callable, Iterable
+import asyncio
+import concurrent.futures
+import contextlib
+import dataclasses
+import pathlib
+import threading
+import time
+import traceback
+
+import anthropic
+
+from local_claude.libs import api_clients
+from local_claude.libs import context_compaction
+from local_claude.libs import directory_utils
+from local_claude.libs import message_streaming
+from local_claude.libs import prompt_caching
+from local_claude.libs import telemetry
+from local_claude.libs import token_accounting
+from local_claude.libs import tracing
+from local_claude.libs.function_call_handler import FunctionCallHandler
+
+
+@dataclasses.dataclass(frozen=True)
+class AgentTurnConfig:
+    model: str
+    max_tokens: int
+    system: str
+    max_iterations: int
+    context_token_budget: int
+    # requests estimated not to fit (after compaction) are refused instead of sent
+    context_window_tokens: int = token_accounting.DEFAULT_CONTEXT_WINDOW_TOKENS
+    is_streaming_enabled: bool = True
+    # start side effect safe tool calls as soon as their input has streamed, instead of once the
+    # whole response has (see `ToolOptions.is_side_effect_safe`), only applies when streaming
+    is_speculative_tool_execution_enabled: bool = False
+    # isolated model workspace for the turn's tools, otherwise the default one is used
+    workspace_directory: pathlib.Path | None = None
+    # if set, the turn is traced (see `tracing`) and written here as `<conversation id>_<timestamp>.json`
+    trace_directory: pathlib.Path | None = None
+    # if set, a cProfile of each (in process, synchronous) tool call is written here, except calls
+    # running alongside one being profiled (see `tracing.profile`)
+    profile_directory: pathlib.Path | None = None
+
+
+@dataclasses.dataclass(frozen=True)
+class TextDeltaEvent:
+    conversation_id: str
+    # all text streamed since the last poll
+    text: str
+    # all text streamed so far for the current message, so a page that missed earlier deltas (ex: due
+    # to a rerun) can still render the whole thing
+    snapshot: str
+
+
+@dataclasses.dataclass(frozen=True)
+class MessageAddedEvent:
+    conversation_id: str
+    message: anthropic.types.MessageParam
+    # index in the conversation (the turn's initial messages followed by those it added), so a page
+    # which already rendered the message from its store can skip it
+    message_index: int
+
+
+@dataclasses.dataclass(frozen=True)
+class ToolStartedEvent:
+    conversation_id: str
+    tool_call: anthropic.types.ToolUseBlock
+
+
+@dataclasses.dataclass(frozen=True)
+class ToolFinishedEvent:
+    conversation_id: str
+    tool_call: anthropic.types.ToolUseBlock
+    tool_result: anthropic.types.ToolResultBlockParam
+
+
+@dataclasses.dataclass(frozen=True)
+class UsageEvent:
+    conversation_id: str
+    model_call_record: telemetry.ModelCallRecord
+
+
+@dataclasses.dataclass(frozen=True)
+class ContextUsageEvent:
+    """Estimated size of a request, emitted before it's sent."""
+
+    conversation_id: str
+    request_token_count: token_accounting.RequestTokenCount
+    context_window_tokens: int
+
+
+@dataclasses.dataclass(frozen=True)
+class TurnFinishedEvent:
+    conversation_id: str
+    # one of `end_turn`, `max_iterations`, or `error`
+    reason: str
+    error_traceback: str | None = None
+
+
+type AgentEvent = (
+    TextDeltaEvent
+    | MessageAddedEvent
+    | ToolStartedEvent
+    | ToolFinishedEvent
+    | UsageEvent
+    | ContextUsageEvent
+    | TurnFinishedEvent
+)
+
+
+# called with each message a turn adds, along with the conversation id
+type MessageSink = Callable[[str, anthropic.types.MessageParam], None]
+
+
+@dataclasses.dataclass
+class _ConversationRunState:
+    is_running: bool = False
+    pending_events: list[AgentEvent] = dataclasses.field(default_factory=list)
+
+
+class AgentEngine:
+    """
+    Process wide engine running agent turns on a background event loop.
+
+    Example:
+
+        engine = AgentEngine()
+
+        engine.start_turn(
+            conversation_id,
+            messages,
+            function_call_handler,
+            config,
+            message_sink=store.append_message,
+        )
+
+        while engine.is_running(conversation_id):
+            for event in engine.poll_events(conversation_id):
+                ...
+
+        # once done with the engine (ex: at the end of a script)
+        engine.shutdown()
+
+    """
+
+    def __init__(
+        self,
+        client: anthropic.AsyncAnthropic | None = None,
+    ) -> None:
+
+        # note: defaults to the shared client for the engine's loop, created lazily since
+        #       the client's connections are bound to the event loop they're first used on
+        self._client = client
+
+        self._lock = threading.Lock()
+        self._run_state_by_conversation_id: dict[str, _ConversationRunState] = {}
+
+        # kept across turns (counts by message index, one int per message), so messages from
+        # earlier turns aren't counted again
+        self._token_counter_by_conversation_id: dict[str, token_accounting.TokenCounter] = {}
+
+        self._loop = asyncio.new_event_loop()
+
+        # daemon, so the process can exit without calling `shutdown` (ex: the Streamlit page)
+        self._thread = threading.Thread(
+            target=self._loop.run_forever,
+            name="agent-engine",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def shutdown(self) -> None:
+        """Stop the background loop and its thread, cancelling any turns still running."""
+
+        if self._loop.is_closed():
+            return None
+
+        asyncio.run_coroutine_threadsafe(self._cancel_running_tasks(), self._loop).result()
+
+        # note: the shared client is cached per loop, so it'd otherwise keep its connections open
+        asyncio.run_coroutine_threadsafe(api_clients.aclose_async_clients(), self._loop).result()
+
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+        self._loop.run_until_complete(self._loop.shutdown_default_executor())
+        self._loop.close()
+
+    async def _cancel_running_tasks(self) -> None:
+
+        await self._cancel_unfinished_tasks(
+            x for x in asyncio.all_tasks() if x is not asyncio.current_task()
+        )
+
+    def _get_client(self) -> anthropic.AsyncAnthropic:
+
+        if self._client is None:
+            self._client = api_clients.get_async_anthropic_client()
+
+        return self._client
+
+    def _emit(self, event: AgentEvent) -> None:
+
+        with self._lock:
+            run_state = self._run_state_by_conversation_id[event.conversation_id]
+            pending_events = run_state.pending_events
+
+            if (
+                isinstance(event, TextDeltaEvent)
+                and pending_events
+                and isinstance(pending_events[-1], TextDeltaEvent)
+            ):
+                # replace rather than append, the latest snapshot already has the earlier text
+                pending_events[-1] = dataclasses.replace(
+                    event,
+                    text=pending_events[-1].text + event.text,
+                )
+            else:
+                pending_events.append(event)
+
+            if isinstance(event, TurnFinishedEvent):
+                run_state.is_running = False
+
+    def is_running(self, conversation_id: str) -> bool:
+
+        with self._lock:
+            run_state = self._run_state_by_conversation_id.get(conversation_id)
+            return run_state is not None and run_state.is_running
+
+    def poll_events(self, conversation_id: str) -> list[AgentEvent]:
+        """Get (and remove) all events emitted for the conversation since the last poll."""
+
+        with self._lock:
+            run_state = self._run_state_by_conversation_id.get(conversation_id)
+
+            if run_state is None:
+                return []
+
+            events = run_state.pending_events
+            run_state.pending_events = []
+
+            # nothing else will be emitted until the next turn, which starts with a fresh state
+            if not run_state.is_running:
+                del self._run_state_by_conversation_id[conversation_id]
+
+            return events
+
+    def _get_token_counter(self, conversation_id: str) -> token_accounting.TokenCounter:
+
+        with self._lock:
+            return self._token_counter_by_conversation_id.setdefault(
+                conversation_id, token_accounting.TokenCounter()
+            )
+
+    def start_turn(
+        self,
+        conversation_id: str,
+        messages: list[anthropic.types.MessageParam],
+        function_call_handler: FunctionCallHandler,
+        config: AgentTurnConfig,
+        telemetry_recorder: telemetry.TelemetryRecorder | None = None,
+        message_sink: MessageSink | None = None,
+    ) -> concurrent.futures.Future[list[anthropic.types.MessageParam]]:
+        """
+        Start running the tool use loop for `messages`, which should end with the new user message.
+
+        Each message the turn adds is passed to `message_sink` (if given) before it's emitted as an
+        event, which is where it should be stored, rather than by applying events.
+
+        Returns a future with all messages once the turn finishes, though callers will usually poll events instead.
+
+        """
+
+        with self._lock:
+            run_state = self._run_state_by_conversation_id.get(conversation_id)
+
+            if run_state is not None and run_state.is_running:
+                raise RuntimeError(
+                    f"Conversation {conversation_id} already has a turn in progress"
+                )
+
+            # note: replaces the last turn's state, since anything not polled from it is stale
+            #       (its messages were already saved)
+            self._run_state_by_conversation_id[conversation_id] = _ConversationRunState(
+                is_running=True
+            )
+
+        return asyncio.run_coroutine_threadsafe(
+            self._run_turn(
+                conversation_id=conversation_id,
+                # copy, since the caller owns the original list
+                messages=list(messages),
+                function_call_handler=function_call_handler,
+                config=config,
+                telemetry_recorder=telemetry_recorder,
+                message_sink=message_sink,
+            ),
+            self._loop,
+        )
+
+    async def _run_turn(
+        self,
+        conversation_id: str,
+        messages: list[anthropic.types.MessageParam],
+        function_call_handler: FunctionCallHandler,
+        config: AgentTurnConfig,
+        telemetry_recorder: telemetry.TelemetryRecorder | None,
+        message_sink: MessageSink | None,
+    ) -> list[anthropic.types.MessageParam]:
+
+        # note: each task runs in its own context, so this doesn't affect other conversations
+        with contextlib.ExitStack() as exit_stack:
+
+            if config.workspace_directory is not None:
+                exit_stack.enter_context(
+                    directory_utils.model_workspace_directory(config.workspace_directory)
+                )
+
+            if config.profile_directory is not None:
+                exit_stack.enter_context(tracing.profiling_enabled(config.profile_directory))
+
+            tracer: tracing.Tracer | None = None
+
+            if config.trace_directory is not None:
+                tracer = exit_stack.enter_context(tracing.tracing_enabled(tracing.Tracer()))
+
+            with tracing.span("turn", category="agent", conversation_id=conversation_id):
+                await self._run_tool_use_loop(
+                    conversation_id=conversation_id,
+                    messages=messages,
+                    function_call_handler=function_call_handler,
+                    config=config,
+                    telemetry_recorder=telemetry_recorder,
+                    message_sink=message_sink,
+                )
+
+        if tracer is not None and config.trace_directory is not None:
+            tracer.write(config.trace_directory / f"{conversation_id}_{time.time_ns()}.json")
+
+        return messages
+
+    async def _run_tool_use_loop(
+        self,
+        conversation_id: str,
+        messages: list[anthropic.types.MessageParam],
+        function_call_handler: FunctionCallHandler,
+        config: AgentTurnConfig,
+        telemetry_recorder: telemetry.TelemetryRecorder | None,
+        message_sink: MessageSink | None,
+    ) -> None:
+
+        try:
+            for iteration_count in range(config.max_iterations):
+
+                # results of tool calls started while the response was still streaming, by tool use id
+                speculative_tool_results: dict[
+                    str, asyncio.Task[anthropic.types.ToolResultBlockParam]
+                ] = {}
+
+                def start_speculative_tool_call(
+                    tool_call: anthropic.types.ToolUseBlock,
+                ) -> None:
+
+                    if not function_call_handler.is_speculation_safe(tool_call):
+                        return None
+
+                    self._emit(ToolStartedEvent(conversation_id, tool_call))
+
+                    # note: tasks run with a copy of the current context, so tools still see
+                    #       this turn's workspace
+                    speculative_tool_results[tool_call.id] = asyncio.create_task(
+                        function_call_handler.async_resolve(tool_call=tool_call)
+                    )
+
+                try:
+                    with tracing.span("model_call", category="api", model=config.model):
+                        response = await self._create_message(
+                            conversation_id=conversation_id,
+                            messages=messages,
+                            function_call_handler=function_call_handler,
+                            config=config,
+                            telemetry_recorder=telemetry_recorder,
+                            on_tool_use_block=(
+                                start_speculative_tool_call
+                                if config.is_speculative_tool_execution_enabled
+                                else None
+                            ),
+                        )
+
+                    # note: using dict representation for consistency with user_message + it's what API expects
+                    response_message = response.model_dump(include=["role", "content"])
+
+                    await self._add_message(
+                        conversation_id, messages, response_message, message_sink
+                    )
+
+                    tool_calls = [x for x in response.content if x.type == "tool_use"]
+
+                    # if no more tool use, we're done
+                    if not tool_calls:
+                        self._emit(TurnFinishedEvent(conversation_id, reason="end_turn"))
+                        return None
+
+                    tool_results = await self._resolve_tool_calls(
+                        conversation_id=conversation_id,
+                        tool_calls=tool_calls,
+                        function_call_handler=function_call_handler,
+                        speculative_tool_results=speculative_tool_results,
+                    )
+                finally:
+                    # ex: the stream failed after some tool calls had already started
+                    await self._cancel_unfinished_tasks(speculative_tool_results.values())
+
+                for tool_call, tool_result in zip(tool_calls, tool_results):
+                    self._emit(ToolFinishedEvent(conversation_id, tool_call, tool_result))
+
+                # tool results all need to go in a single message
+                tool_result_message: anthropic.types.MessageParam = {
+                    "role": "user",
+                    "content": tool_results,
+                }
+
+                await self._add_message(
+                    conversation_id, messages, tool_result_message, message_sink
+                )
+
+            self._emit(TurnFinishedEvent(conversation_id, reason="max_iterations"))
+
+        except Exception:
+            # surface to the page, since otherwise it'd be lost in the background thread
+            self._emit(
+                TurnFinishedEvent(
+                    conversation_id,
+                    reason="error",
+                    error_traceback=traceback.format_exc(),
+                )
+            )
+
+    async def _add_message(
+        self,
+        conversation_id: str,
+        messages: list[anthropic.types.MessageParam],
+        message: anthropic.types.MessageParam,
+        message_sink: MessageSink | None,
+    ) -> None:
+        """Add a message to the turn, saving it before it's emitted so it's never only in an event."""
+
+        messages.append(message)
+
+        if message_sink is not None:
+            # note: off the loop, since stores write to disk, awaited so messages are saved in order
+            await asyncio.to_thread(message_sink, conversation_id, message)
+
+        self._emit(MessageAddedEvent(conversation_id, message, message_index=len(messages) - 1))
+
+    async def _cancel_unfinished_tasks(self, tasks: Iterable[asyncio.Task[Any]]) -> None:
+        """Cancel any tasks that haven't finished, waiting for them so none outlive the turn."""
+
+        unfinished_tasks = [x for x in tasks if not x.done()]
+
+        for task in unfinished_tasks:
+            task.cancel()
+
+        await asyncio.gather(*unfinished_tasks, return_exceptions=True)
+
+    async def _resolve_tool_calls(
+        self,
+        conversation_id: str,
+        tool_calls: list[anthropic.types.ToolUseBlock],
+        function_call_handler: FunctionCallHandler,
+        speculative_tool_results: dict[
+            str, asyncio.Task[anthropic.types.ToolResultBlockParam]
+        ],
+    ) -> list[anthropic.types.ToolResultBlockParam]:
+        """Resolve any tool calls that weren't already started speculatively, returning all results in block order."""
+
+        remaining_tool_calls = [
+            x for x in tool_calls if x.id not in speculative_tool_results
+        ]
+
+        for tool_call in remaining_tool_calls:
+            self._emit(ToolStartedEvent(conversation_id, tool_call))
+
+        # note: coroutine tools are awaited on the loop, and blocking ones are run off it
+        remaining_tool_results = await function_call_handler.async_resolve_many(
+            tool_calls=remaining_tool_calls,
+        )
+
+        tool_result_by_id = {
+            tool_call.id: tool_result
+            for tool_call, tool_result in zip(remaining_tool_calls, remaining_tool_results)
+        }
+
+        for tool_use_id, task in speculative_tool_results.items():
+            tool_result_by_id[tool_use_id] = await task
+
+        return [tool_result_by_id[x.id] for x in tool_calls]
+
+    async def _create_message(
+        self,
+        conversation_id: str,
+        messages: list[anthropic.types.MessageParam],
+        function_call_handler: FunctionCallHandler,
+        config: AgentTurnConfig,
+        telemetry_recorder: telemetry.TelemetryRecorder | None,
+        on_tool_use_block: (
+            Callable[[anthropic.types.ToolUseBlock], None] | None
+        ) = None,
+    ) -> anthropic.types.Message:
+        """
+        Make a single model call, emitting text deltas (if streaming) and usage.
+
+        If streaming, `on_tool_use_block` is called with each `tool_use` block as soon as its input is complete.
+
+        """
+
+        token_counter = self._get_token_counter(conversation_id)
+
+        # compact stale tool results so input tokens don't grow without bound
+        with tracing.span("compact_messages", category="agent"):
+            compaction_result = context_compaction.compact_messages(
+                messages=messages,
+                token_budget=config.context_token_budget,
+                token_counter=token_counter,
+            )
+
+        request_token_count = token_counter.count_request(
+            system=config.system,
+            tools=function_call_handler.get_schema_for_tools_arg(),
+            messages_tokens=compaction_result.estimated_tokens_after,
+            max_tokens=config.max_tokens,
+        )
+
+        self._emit(
+            ContextUsageEvent(
+                conversation_id,
+                request_token_count=request_token_count,
+                context_window_tokens=config.context_window_tokens,
+            )
+        )
+
+        # refuse before sending, rather than paying for a request the API would reject
+        token_accounting.check_fits_in_context_window(
+            request_token_count,
+            context_window_tokens=config.context_window_tokens,
+        )
+
+        # place cache breakpoints on the system prompt, tools, and newest messages, moving
+        # them forward each iteration so the growing history is read from the cache
+        cache_breakpoint_plan = prompt_caching.plan_cache_breakpoints(
+            system=config.system,
+            tools=function_call_handler.get_schema_for_tools_arg(),
+            messages=compaction_result.messages,
+        )
+
+        create_kwargs: dict[str, Any] = dict(
+            messages=cache_breakpoint_plan.messages,
+            max_tokens=config.max_tokens,
+            model=config.model,
+            system=cache_breakpoint_plan.system,
+            tools=cache_breakpoint_plan.tools,
+            # needed for caching
+            extra_headers=prompt_caching.PROMPT_CACHING_EXTRA_HEADERS,
+        )
+
+        client = self._get_client()
+
+        model_call_start_time = time.perf_counter()
+        time_to_first_token_seconds: float | None = None
+
+        if config.is_streaming_enabled:
+
+            streamed_text = ""
+
+            def on_text_delta(text_delta: str) -> None:
+                nonlocal time_to_first_token_seconds, streamed_text
+
+                if time_to_first_token_seconds is None:
+                    time_to_first_token_seconds = (
+                        time.perf_counter() - model_call_start_time
+                    )
+
+                streamed_text += text_delta
+
+                self._emit(
+                    TextDeltaEvent(
+                        conversation_id,
+                        text=text_delta,
+                        snapshot=streamed_text,
+                    )
+                )
+
+            response = await message_streaming.async_stream_message(
+                client,
+                on_text_delta=on_text_delta,
+                on_tool_use_block=on_tool_use_block,
+                **create_kwargs,
+            )
+
+        else:
+            response = await client.messages.create(**create_kwargs)
+
+        model_call_record = telemetry.ModelCallRecord.from_response(
+            conversation_id=conversation_id,
+            response=response,
+            latency_seconds=time.perf_counter() - model_call_start_time,
+            time_to_first_token_seconds=time_to_first_token_seconds,
+            estimated_tokens_saved_by_compaction=compaction_result.estimated_tokens_saved,
+            tool_schema_variant=function_call_handler.get_tool_schema_variant().value,
+        )
+
+        if telemetry_recorder is not None:
+            telemetry_recorder.record(model_call_record)
+
+        self._emit(UsageEvent(conversation_id, model_call_record))
+
+        return response
@@ -0,0 +1,158 @@
+"""
+Process wide API clients, so every session and turn reuses the same pooled keep-alive connections
+and shares the same rate limit scheduler.
+
+Note:
+  - clients default to getting `ANTHROPIC_API_KEY` / `OPENAI_API_KEY` from the environment
+  - async clients are cached per event loop, since `httpx.AsyncClient` connections are bound to
+    the loop they're first used on, so a loop that doesn't live for the whole process (ex: one
+    from `asyncio.run`) should close its clients with `aclose_async_clients` before it finishes
+
+"""
+
+from typing import TYPE_CHECKING
+import asyncio
+import threading
+import weakref
+
+import anthropic
+import httpx
+
+from local_claude.libs import rate_limiting
+
+# note: only `run_o1.py` needs openai, so we don't require it to be installed
+if TYPE_CHECKING:
+    import openai
+
+
+# note: all connections stay open between turns, so these are generous
+_CONNECTION_LIMITS = httpx.Limits(
+    max_connections=100,
+    max_keepalive_connections=20,
+    keepalive_expiry=60.0,
+)
+
+# long, since model calls can take minutes
+_TIMEOUT = httpx.Timeout(timeout=600.0, connect=5.0)
+
+# shared by every client of the same provider, since rate limits are per organization
+ANTHROPIC_RATE_LIMIT_SCHEDULER = rate_limiting.RateLimitScheduler(
+    rate_limiting.ANTHROPIC_RATE_LIMIT_HEADER_NAMES
+)
+
+OPENAI_RATE_LIMIT_SCHEDULER = rate_limiting.RateLimitScheduler(
+    rate_limiting.OPENAI_RATE_LIMIT_HEADER_NAMES
+)
+
+_lock = threading.Lock()
+
+_anthropic_client: anthropic.Anthropic | None = None
+_openai_client: "openai.OpenAI | None" = None
+
+_async_anthropic_client_by_loop: weakref.WeakKeyDictionary[
+    asyncio.AbstractEventLoop, anthropic.AsyncAnthropic
+] = weakref.WeakKeyDictionary()
+
+_async_openai_client_by_loop: weakref.WeakKeyDictionary[
+    asyncio.AbstractEventLoop, "openai.AsyncOpenAI"
+] = weakref.WeakKeyDictionary()
+
+
+def get_anthropic_client() -> anthropic.Anthropic:
+    """Get the shared sync anthropic client."""
+
+    global _anthropic_client
+
+    with _lock:
+
+        if _anthropic_client is None:
+
+            _anthropic_client = anthropic.Anthropic(
+                http_client=httpx.Client(
+                    limits=_CONNECTION_LIMITS,
+                    timeout=_TIMEOUT,
+                    event_hooks=ANTHROPIC_RATE_LIMIT_SCHEDULER.get_event_hooks(),
+                )
+            )
+
+        return _anthropic_client
+
+
+def get_async_anthropic_client() -> anthropic.AsyncAnthropic:
+    """Get the shared async anthropic client for the running event loop."""
+
+    loop = asyncio.get_running_loop()
+
+    with _lock:
+
+        if loop not in _async_anthropic_client_by_loop:
+
+            _async_anthropic_client_by_loop[loop] = anthropic.AsyncAnthropic(
+                http_client=httpx.AsyncClient(
+                    limits=_CONNECTION_LIMITS,
+                    timeout=_TIMEOUT,
+                    event_hooks=ANTHROPIC_RATE_LIMIT_SCHEDULER.get_async_event_hooks(),
+                )
+            )
+
+        return _async_anthropic_client_by_loop[loop]
+
+
+def get_openai_client() -> "openai.OpenAI":
+    """Get the shared sync openai client."""
+
+    import openai
+
+    global _openai_client
+
+    with _lock:
+
+        if _openai_client is None:
+
+            _openai_client = openai.OpenAI(
+                http_client=httpx.Client(
+                    limits=_CONNECTION_LIMITS,
+                    timeout=_TIMEOUT,
+                    event_hooks=OPENAI_RATE_LIMIT_SCHEDULER.get_event_hooks(),
+                )
+            )
+
+        return _openai_client
+
+
+def get_async_openai_client() -> "openai.AsyncOpenAI":
+    """Get the shared async openai client for the running event loop."""
+
+    import openai
+
+    loop = asyncio.get_running_loop()
+
+    with _lock:
+
+        if loop not in _async_openai_client_by_loop:
+
+            _async_openai_client_by_loop[loop] = openai.AsyncOpenAI(
+                http_client=httpx.AsyncClient(
+                    limits=_CONNECTION_LIMITS,
+                    timeout=_TIMEOUT,
+                    event_hooks=OPENAI_RATE_LIMIT_SCHEDULER.get_async_event_hooks(),
+                )
+            )
+
+        return _async_openai_client_by_loop[loop]
+
+
+async def aclose_async_clients() -> None:
+    """Close the shared async clients for the running event loop, and forget them."""
+
+    loop = asyncio.get_running_loop()
+
+    with _lock:
+        anthropic_client = _async_anthropic_client_by_loop.pop(loop, None)
+        openai_client = _async_openai_client_by_loop.pop(loop, None)
+
+    if anthropic_client is not None:
+        await anthropic_client.close()
+
+    if openai_client is not None:
+        await openai_client.close()
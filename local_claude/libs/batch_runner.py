@@ -0,0 +1,255 @@
+"""
+Runs many prompts through the agent tool use loop concurrently, without the Streamlit page.
+
+Each prompt gets its own conversation and isolated model workspace. Transcripts are appended to
+`transcripts.jsonl` as conversations finish, and per call telemetry to `telemetry.jsonl`, both
+in the output directory.
+
+"""
+
+from typing import Any, Callable, Sequence
+import concurrent.futures
+import dataclasses
+import json
+import pathlib
+import re
+import time
+
+import anthropic
+
+from local_claude.libs import agent_engine
+from local_claude.libs import telemetry
+from local_claude.libs.function_call_handler import FunctionCallHandler
+
+
+# prompt ids name each conversation's workspace directory, so they can't contain path separators
+_PROMPT_ID_PATTERN = re.compile(r"^[\w.-]+$")
+
+
+@dataclasses.dataclass(frozen=True)
+class BatchPrompt:
+    prompt_id: str
+    prompt: str
+
+
+@dataclasses.dataclass(frozen=True)
+class BatchResult:
+    prompt_id: str
+    # one of `end_turn`, `max_iterations`, or `error`
+    finish_reason: str
+    error_traceback: str | None
+    wall_time_seconds: float
+    messages: list[anthropic.types.MessageParam]
+    usage: dict[str, Any]
+
+
+@dataclasses.dataclass(frozen=True)
+class BatchSummary:
+    num_conversations: int
+    num_errors: int
+    wall_time_seconds: float
+
+    def get_conversations_per_minute(self) -> float:
+
+        if not self.wall_time_seconds:
+            return 0.0
+
+        return self.num_conversations / (self.wall_time_seconds / 60.0)
+
+
+def _check_prompt_id(prompt_id: str) -> None:
+
+    if not _PROMPT_ID_PATTERN.match(prompt_id) or prompt_id in (".", ".."):
+        raise ValueError(
+            f"Prompt id {prompt_id!r} must only contain letters, digits, `_`, `.`, or `-`"
+        )
+
+
+def read_batch_prompts(filepath: pathlib.Path) -> list[BatchPrompt]:
+    """
+    Read prompts from a JSONL file, where each line is a dict with a `prompt` and optionally an `id`.
+
+    Ex:
+
+        {"id": "pypi_anthropic", "prompt": "What's the latest version of the anthropic package?"}
+        {"prompt": "What is 2 + 2?"}
+
+    """
+
+    batch_prompts: list[BatchPrompt] = []
+
+    with filepath.open("r", encoding="utf-8") as file:
+
+        for line_index, line in enumerate(file):
+
+            if not line.strip():
+                continue
+
+            line_dict = json.loads(line)
+
+            prompt_id = str(line_dict.get("id", f"prompt_{line_index}"))
+
+            _check_prompt_id(prompt_id)
+
+            batch_prompts.append(BatchPrompt(prompt_id=prompt_id, prompt=line_dict["prompt"]))
+
+    prompt_ids = [x.prompt_id for x in batch_prompts]
+
+    if len(set(prompt_ids)) != len(prompt_ids):
+        raise ValueError(f"Prompt ids in {filepath} must be unique")
+
+    return batch_prompts
+
+
+def run_batch(
+    prompts: list[BatchPrompt],
+    functions: Sequence[Callable[..., Any]],
+    config: agent_engine.AgentTurnConfig,
+    output_dir: pathlib.Path,
+    concurrency: int,
+    engine: agent_engine.AgentEngine | None = None,
+    on_result: Callable[[BatchResult, BatchSummary], None] | None = None,
+) -> BatchSummary:
+    """
+    Run each prompt through the tool use loop, with at most `concurrency` conversations at once.
+
+    `on_result` is called with each result as it finishes, along with a summary so far (ex: for
+    reporting progress).
+
+    If no `engine` is given, one is created and shut down once the batch finishes.
+
+    """
+
+    # note: also checked here, since prompts don't have to come from `read_batch_prompts`
+    for batch_prompt in prompts:
+        _check_prompt_id(batch_prompt.prompt_id)
+
+    if engine is None:
+
+        engine = agent_engine.AgentEngine()
+
+        try:
+            return run_batch(
+                prompts=prompts,
+                functions=functions,
+                config=config,
+                output_dir=output_dir,
+                concurrency=concurrency,
+                engine=engine,
+                on_result=on_result,
+            )
+        finally:
+            engine.shutdown()
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    telemetry_recorder = telemetry.TelemetryRecorder(
+        filepath=output_dir / "telemetry.jsonl"
+    )
+
+    def start_turn(
+        batch_prompt: BatchPrompt,
+    ) -> concurrent.futures.Future[list[anthropic.types.MessageParam]]:
+
+        def on_tool_call_resolved(
+            tool_call: anthropic.types.ToolUseBlock,
+            tool_result: anthropic.types.ToolResultBlockParam,
+            wall_time_seconds: float,
+        ) -> None:
+            telemetry_recorder.record(
+                telemetry.ToolCallRecord.from_tool_result(
+                    conversation_id=batch_prompt.prompt_id,
+                    tool_call=tool_call,
+                    tool_result=tool_result,
+                    wall_time_seconds=wall_time_seconds,
+                )
+            )
+
+        return engine.start_turn(
+            conversation_id=batch_prompt.prompt_id,
+            messages=[{"role": "user", "content": batch_prompt.prompt}],
+            function_call_handler=FunctionCallHandler(
+                functions=functions,
+                on_tool_call_resolved=on_tool_call_resolved,
+            ),
+            config=dataclasses.replace(
+                config,
+                workspace_directory=output_dir / "workspaces" / batch_prompt.prompt_id,
+            ),
+            telemetry_recorder=telemetry_recorder,
+        )
+
+    start_time = time.perf_counter()
+
+    num_conversations = 0
+    num_errors = 0
+
+    in_flight: dict[
+        concurrent.futures.Future[list[anthropic.types.MessageParam]],
+        tuple[BatchPrompt, float],
+    ] = {}
+
+    remaining_prompts = iter(prompts)
+
+    with (output_dir / "transcripts.jsonl").open("a", encoding="utf-8") as file:
+
+        while True:
+
+            # keep `concurrency` conversations running until we run out of prompts
+            while len(in_flight) < concurrency:
+
+                batch_prompt = next(remaining_prompts, None)
+
+                if batch_prompt is None:
+                    break
+
+                in_flight[start_turn(batch_prompt)] = (batch_prompt, time.perf_counter())
+
+            if not in_flight:
+                break
+
+            done, _ = concurrent.futures.wait(
+                in_flight,
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+
+            for future in done:
+
+                batch_prompt, turn_start_time = in_flight.pop(future)
+
+                # the last event is always the turn finishing
+                turn_finished_event = engine.poll_events(batch_prompt.prompt_id)[-1]
+                assert isinstance(turn_finished_event, agent_engine.TurnFinishedEvent)
+
+                result = BatchResult(
+                    prompt_id=batch_prompt.prompt_id,
+                    finish_reason=turn_finished_event.reason,
+                    error_traceback=turn_finished_event.error_traceback,
+                    wall_time_seconds=time.perf_counter() - turn_start_time,
+                    messages=future.result(),
+                    usage=dataclasses.asdict(
+                        telemetry_recorder.get_totals(batch_prompt.prompt_id)
+                    ),
+                )
+
+                file.write(json.dumps(dataclasses.asdict(result)) + "\n")
+                file.flush()
+
+                num_conversations += 1
+                num_errors += int(result.finish_reason == "error")
+
+                if on_result is not None:
+                    on_result(
+                        result,
+                        BatchSummary(
+                            num_conversations=num_conversations,
+                            num_errors=num_errors,
+                            wall_time_seconds=time.perf_counter() - start_time,
+                        ),
+                    )
+
+    return BatchSummary(
+        num_conversations=num_conversations,
+        num_errors=num_errors,
+        wall_time_seconds=time.perf_counter() - start_time,
+    )
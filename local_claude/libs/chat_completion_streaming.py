@@ -0,0 +1,99 @@
+"""Functions around consuming streamed openai chat completions (the equivalent of `message_streaming` for openai)."""
+
+from typing import TYPE_CHECKING, Any, Callable
+import dataclasses
+
+# note: only `run_o1.py` needs openai, so we don't require it to be installed
+if TYPE_CHECKING:
+    import openai
+
+
+@dataclasses.dataclass(frozen=True)
+class ChatCompletionUsage:
+    input_tokens: int = 0
+    # note: includes reasoning tokens
+    output_tokens: int = 0
+    # hidden reasoning tokens, which are billed as output tokens (o1 models only)
+    reasoning_tokens: int = 0
+
+    @classmethod
+    def from_usage(cls, usage: "openai.types.CompletionUsage | None") -> "ChatCompletionUsage":
+
+        if usage is None:
+            return cls()
+
+        details = usage.completion_tokens_details
+
+        return cls(
+            input_tokens=usage.prompt_tokens,
+            output_tokens=usage.completion_tokens,
+            reasoning_tokens=(details.reasoning_tokens or 0) if details else 0,
+        )
+
+
+class ChatCompletionAccumulator:
+    """
+    Accumulates streamed chat completion chunks into the completion's text and usage.
+
+    Note:
+      - streams only include usage (in a final chunk with no choices) when requested with
+        `stream_options={"include_usage": True}`
+
+    """
+
+    def __init__(self) -> None:
+
+        self._text_deltas: list[str] = []
+
+        self.usage = ChatCompletionUsage()
+
+    def add_chunk(self, chunk: "openai.types.chat.ChatCompletionChunk") -> str | None:
+        """Add a chunk, returning its text delta if there was one."""
+
+        if chunk.usage is not None:
+            self.usage = ChatCompletionUsage.from_usage(chunk.usage)
+
+        if not chunk.choices or not chunk.choices[0].delta.content:
+            return None
+
+        text_delta = chunk.choices[0].delta.content
+
+        self._text_deltas.append(text_delta)
+
+        return text_delta
+
+    def get_text(self) -> str:
+        return "".join(self._text_deltas)
+
+
+# kwargs needed for a stream to include usage
+STREAM_WITH_USAGE_KWARGS: dict[str, Any] = {
+    "stream": True,
+    "stream_options": {"include_usage": True},
+}
+
+
+def stream_chat_completion(
+    client: "openai.OpenAI",
+    on_text_delta: Callable[[str], None],
+    **kwargs: Any,
+) -> ChatCompletionAccumulator:
+    """
+    Equivalent to `client.chat.completions.create(**kwargs)`, but calls `on_text_delta` with text as it arrives.
+
+    Example:
+
+        accumulator = stream_chat_completion(client, on_text_delta=print, messages=messages, ...)
+
+        print(accumulator.get_text(), accumulator.usage)
+
+    """
+
+    accumulator = ChatCompletionAccumulator()
+
+    for chunk in client.chat.completions.create(**kwargs, **STREAM_WITH_USAGE_KWARGS):
+
+        if text_delta := accumulator.add_chunk(chunk):
+            on_text_delta(text_delta)
+
+    return accumulator
@@ -0,0 +1,176 @@
+"""
+Functions around keeping the messages sent to the model within a token budget.
+
+Tool results (ex: entire HTML pages) dominate the size of tool heavy conversations, but are
+rarely needed in full once the model has moved on. We compact a conversation by replacing the
+content of stale tool results with a short preview plus a pointer to a workspace file holding
+the full content, so the model can still read it with `read_file_from_persistent_workspace`.
+
+Note:
+  - only the content of `tool_result` blocks is changed, so every `tool_use` still has its
+    matching `tool_result`
+  - the oldest tool results are compacted first, so as a conversation grows the compacted
+    prefix stays the same between calls (which keeps prompt caching effective)
+
+"""
+
+from typing import Any, cast
+import dataclasses
+
+import anthropic
+
+from local_claude.libs import directory_utils
+from local_claude.libs import telemetry
+from local_claude.libs import token_accounting
+from local_claude.libs.tools.save_to_workspace_file import (
+    save_content_to_persistent_file_in_workspace,
+)
+
+
+# number of most recent messages that are never compacted
+DEFAULT_KEEP_RECENT_MESSAGES = 6
+
+# tool results smaller than this aren't worth compacting
+DEFAULT_MIN_TOKENS_TO_COMPACT = 256
+
+# number of characters of the original content to keep as a preview
+DEFAULT_PREVIEW_CHARACTERS = 500
+
+
+@dataclasses.dataclass(frozen=True)
+class CompactionResult:
+    messages: list[anthropic.types.MessageParam]
+    estimated_tokens_before: int
+    estimated_tokens_after: int
+    compacted_tool_use_ids: list[str]
+
+    @property
+    def estimated_tokens_saved(self) -> int:
+        return self.estimated_tokens_before - self.estimated_tokens_after
+
+
+def _get_text(content: Any) -> str:
+    """Get the text of message or tool result content, which can either be a string or list of blocks."""
+
+    if isinstance(content, str):
+        return content
+
+    return "".join(
+        str(x.get("text") or x.get("input") or _get_text(x.get("content", "")))
+        for x in content
+        if isinstance(x, dict)
+    )
+
+
+def _get_elided_content_filename(tool_use_id: str) -> str:
+    return f"compacted_tool_result_{tool_use_id}.txt"
+
+
+def _compact_tool_result(
+    tool_result: anthropic.types.ToolResultBlockParam,
+    content: str,
+    preview_characters: int,
+) -> anthropic.types.ToolResultBlockParam:
+    """Copy of the tool result with its content replaced by a preview and a pointer to the full content."""
+
+    filename = _get_elided_content_filename(tool_result["tool_use_id"])
+
+    # only write once, since the same tool result is compacted on every later call
+    filepath = directory_utils.get_current_model_workspace_directory() / filename
+
+    if not filepath.exists():
+        save_content_to_persistent_file_in_workspace(filename=filename, content=content)
+
+    compacted_content = (
+        f"{content[:preview_characters]}\n\n"
+        f"[Compacted: showing the first {preview_characters} of {len(content)} characters. "
+        f"The full content is saved in the workspace file `{filename}`, use "
+        f"`read_file_from_persistent_workspace` if you need it.]"
+    )
+
+    return {**tool_result, "content": compacted_content}
+
+
+def compact_messages(
+    messages: list[anthropic.types.MessageParam],
+    token_budget: int,
+    keep_recent_messages: int = DEFAULT_KEEP_RECENT_MESSAGES,
+    min_tokens_to_compact: int = DEFAULT_MIN_TOKENS_TO_COMPACT,
+    preview_characters: int = DEFAULT_PREVIEW_CHARACTERS,
+    token_counter: token_accounting.TokenCounter | None = None,
+) -> CompactionResult:
+    """
+    Compact the oldest tool results until the estimated size of `messages` is within `token_budget`.
+
+    The given messages are never modified, changed messages are copied instead.
+
+    Note:
+      - the most recent `keep_recent_messages` are always kept intact, so the result can still be
+        over budget
+      - `messages` should be the whole conversation as stored, passing the same `token_counter`
+        on every call for a conversation, so only new (and compacted) messages are counted
+
+    """
+
+    token_counter = token_counter or token_accounting.TokenCounter()
+
+    estimated_tokens_by_index = token_counter.count_conversation_messages(messages)
+
+    estimated_tokens_before = sum(estimated_tokens_by_index)
+    estimated_tokens_after = estimated_tokens_before
+
+    compacted_messages = list(messages)
+    compacted_tool_use_ids: list[str] = []
+
+    for index in range(max(len(messages) - keep_recent_messages, 0)):
+
+        if estimated_tokens_after <= token_budget:
+            break
+
+        message = messages[index]
+
+        if message["role"] != "user" or isinstance(message["content"], str):
+            continue
+
+        content_blocks = list(message["content"])
+        is_changed = False
+
+        for block_index, block in enumerate(content_blocks):
+
+            if not isinstance(block, dict) or block.get("type") != "tool_result":
+                continue
+
+            tool_result = cast(anthropic.types.ToolResultBlockParam, block)
+
+            content = _get_text(tool_result.get("content", ""))
+
+            if telemetry.estimate_token_count(content) < min_tokens_to_compact:
+                continue
+
+            content_blocks[block_index] = _compact_tool_result(
+                tool_result=tool_result,
+                content=content,
+                preview_characters=preview_characters,
+            )
+
+            compacted_tool_use_ids.append(tool_result["tool_use_id"])
+            is_changed = True
+
+        if not is_changed:
+            continue
+
+        compacted_messages[index] = {**message, "content": content_blocks}
+
+        # update running estimate
+        compacted_message_tokens = token_counter.count_message(compacted_messages[index])
+
+        estimated_tokens_after -= (
+            estimated_tokens_by_index[index] - compacted_message_tokens
+        )
+
+    return CompactionResult(
+        messages=compacted_messages,
+        estimated_tokens_before=estimated_tokens_before,
+        estimated_tokens_after=estimated_tokens_after,
+        compacted_tool_use_ids=compacted_tool_use_ids,
+    )
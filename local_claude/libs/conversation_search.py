@@ -0,0 +1,288 @@
+"""
+Full text search over stored conversations, including tool inputs and results.
+
+Messages are indexed as they're appended (see each app's `ConversationManager`), in a SQLite FTS5
+index shared by both apps, so finding an old conversation doesn't mean opening them one by one.
+
+Example:
+
+    search_index = ConversationSearchIndex(DEFAULT_SEARCH_INDEX_FILEPATH)
+
+    search_index.index_message("claude", conversation_id, message_index, message)
+
+    for result in search_index.search("pypi anthropic"):
+        print(result.conversation_id, result.snippet)
+
+"""
+
+from typing import Any
+import dataclasses
+import json
+import pathlib
+import sqlite3
+import threading
+
+from local_claude.libs import conversation_store
+
+
+DEFAULT_SEARCH_INDEX_FILEPATH = pathlib.Path("conversations") / "search_index.sqlite3"
+
+# marks matched terms in snippets, as markdown bold
+_SNIPPET_HIGHLIGHT_START = "**"
+_SNIPPET_HIGHLIGHT_END = "**"
+
+# approximate number of tokens of context around matches in snippets
+_SNIPPET_NUM_TOKENS = 16
+
+
+@dataclasses.dataclass(frozen=True)
+class SearchResult:
+    # which app the conversation belongs to (ex: `claude`, `o1`)
+    source: str
+    conversation_id: str
+    message_index: int
+    role: str
+    snippet: str
+
+
+def _get_content_block_text(content_block: dict[str, Any]) -> str:
+
+    match content_block.get("type"):
+        case "text":
+            return str(content_block["text"])
+        case "tool_use":
+            # note: includes inputs, since that's often what's remembered (ex: a url)
+            return f"{content_block['name']} {json.dumps(content_block['input'])}"
+        case "tool_result":
+            return _get_message_content_text(content_block.get("content", ""))
+        case _:
+            # ex: images
+            return ""
+
+
+def _get_message_content_text(content: Any) -> str:
+
+    if isinstance(content, str):
+        return content
+
+    if isinstance(content, list):
+        return "\n".join(
+            _get_content_block_text(x) for x in content if isinstance(x, dict)
+        )
+
+    return ""
+
+
+def get_searchable_text(message: dict[str, Any]) -> str:
+    """Text of a message to index, from text, tool use, and tool result blocks (or plain string content)."""
+
+    return _get_message_content_text(message.get("content"))
+
+
+def _to_match_expression(query: str) -> str:
+    """Convert a user's query into an FTS5 match expression, matching all of its words (in any order)."""
+
+    # note: quoting each word so characters like `-`, `.` or `:` aren't parsed as FTS5 syntax
+    return " ".join('"' + x.replace('"', '""') + '"' for x in query.split())
+
+
+class ConversationSearchIndex:
+    """
+    Incremental SQLite FTS5 index of messages, from any number of apps.
+
+    Safe to use from multiple threads, and from multiple processes using the same file.
+
+    Note:
+      - messages are stored in a regular table, which the FTS5 table indexes (an "external
+        content" table), kept in sync by triggers, so one conversation can be re-indexed by
+        deleting just its rows
+
+    """
+
+    def __init__(self, filepath: pathlib.Path) -> None:
+
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+
+        # note: access is serialized by `_lock`, so sharing the connection across threads is fine
+        self._connection = sqlite3.connect(filepath, check_same_thread=False)
+
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS indexed_messages (
+                    id INTEGER PRIMARY KEY,
+                    source TEXT NOT NULL,
+                    conversation_id TEXT NOT NULL,
+                    message_index INTEGER NOT NULL,
+                    role TEXT NOT NULL,
+                    text TEXT NOT NULL,
+                    UNIQUE (source, conversation_id, message_index)
+                );
+
+                CREATE VIRTUAL TABLE IF NOT EXISTS indexed_messages_fts USING fts5(
+                    text,
+                    content='indexed_messages',
+                    content_rowid='id'
+                );
+
+                CREATE TRIGGER IF NOT EXISTS indexed_messages_after_insert
+                AFTER INSERT ON indexed_messages BEGIN
+                    INSERT INTO indexed_messages_fts (rowid, text) VALUES (new.id, new.text);
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS indexed_messages_after_delete
+                AFTER DELETE ON indexed_messages BEGIN
+                    INSERT INTO indexed_messages_fts (indexed_messages_fts, rowid, text)
+                    VALUES ('delete', old.id, old.text);
+                END;
+                """
+            )
+
+    def index_message(
+        self,
+        source: str,
+        conversation_id: str,
+        message_index: int,
+        message: dict[str, Any],
+    ) -> None:
+        """Add a message to the index, replacing whatever was indexed at the same position."""
+
+        with self._lock, self._connection:
+            self._insert_message(source, conversation_id, message_index, message)
+
+    def _insert_message(
+        self,
+        source: str,
+        conversation_id: str,
+        message_index: int,
+        message: dict[str, Any],
+    ) -> None:
+
+        # note: `REPLACE` deletes the existing row, which fires the delete trigger
+        self._connection.execute(
+            "INSERT OR REPLACE INTO indexed_messages "
+            "(source, conversation_id, message_index, role, text) VALUES (?, ?, ?, ?, ?)",
+            (
+                source,
+                conversation_id,
+                message_index,
+                message["role"],
+                get_searchable_text(message),
+            ),
+        )
+
+    def reindex_conversation(
+        self,
+        source: str,
+        conversation_id: str,
+        messages: list[dict[str, Any]],
+    ) -> None:
+        """Replace everything indexed for a single conversation."""
+
+        with self._lock, self._connection:
+
+            self._connection.execute(
+                "DELETE FROM indexed_messages WHERE source = ? AND conversation_id = ?",
+                (source, conversation_id),
+            )
+
+            for message_index, message in enumerate(messages):
+                self._insert_message(source, conversation_id, message_index, message)
+
+    def get_num_indexed_messages_by_conversation_id(self, source: str) -> dict[str, int]:
+
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT conversation_id, COUNT(*) FROM indexed_messages "
+                "WHERE source = ? GROUP BY conversation_id",
+                (source,),
+            ).fetchall()
+
+        return {str(x[0]): int(x[1]) for x in rows}
+
+    def search(
+        self,
+        query: str,
+        limit: int = 20,
+        source: str | None = None,
+    ) -> list[SearchResult]:
+        """Messages matching all words in `query`, best match first (by BM25)."""
+
+        match_expression = _to_match_expression(query)
+
+        if not match_expression:
+            return []
+
+        sql = (
+            "SELECT m.source, m.conversation_id, m.message_index, m.role, "
+            "snippet(indexed_messages_fts, 0, ?, ?, '...', ?) "
+            "FROM indexed_messages_fts "
+            "JOIN indexed_messages AS m ON m.id = indexed_messages_fts.rowid "
+            "WHERE indexed_messages_fts MATCH ? "
+        )
+        params: list[Any] = [
+            _SNIPPET_HIGHLIGHT_START,
+            _SNIPPET_HIGHLIGHT_END,
+            _SNIPPET_NUM_TOKENS,
+            match_expression,
+        ]
+
+        if source is not None:
+            sql += "AND m.source = ? "
+            params.append(source)
+
+        sql += "ORDER BY indexed_messages_fts.rank LIMIT ?"
+        params.append(limit)
+
+        with self._lock:
+            rows = self._connection.execute(sql, params).fetchall()
+
+        return [
+            SearchResult(
+                source=str(x[0]),
+                conversation_id=str(x[1]),
+                message_index=int(x[2]),
+                role=str(x[3]),
+                snippet=str(x[4]),
+            )
+            for x in rows
+        ]
+
+
+def sync_search_index(
+    search_index: ConversationSearchIndex,
+    store: conversation_store.ConversationStore,
+    source: str,
+) -> list[str]:
+    """
+    Re-index any conversations in `store` whose indexed message count doesn't match (ex: from before indexing existed).
+
+    Returns the ids of conversations that were re-indexed.
+
+    """
+
+    num_indexed_messages_by_conversation_id = (
+        search_index.get_num_indexed_messages_by_conversation_id(source)
+    )
+
+    reindexed_conversation_ids: list[str] = []
+
+    for conversation_id in store.get_conversation_ids():
+
+        num_messages = store.get_num_messages(conversation_id)
+
+        if num_indexed_messages_by_conversation_id.get(conversation_id, 0) == num_messages:
+            continue
+
+        search_index.reindex_conversation(
+            source,
+            conversation_id,
+            [dict(x) for x in store.get_messages(conversation_id)],
+        )
+
+        reindexed_conversation_ids.append(conversation_id)
+
+    return reindexed_conversation_ids
@@ -0,0 +1,541 @@
+"""
+Storage backends for conversation message histories.
+
+`SqliteConversationStore` is durable and can be shared between server processes, with messages
+loaded only when (and as much as) they're asked for. `JsonlConversationStore` is the same but as
+plain append only files, one per conversation, which are easy to inspect and copy around.
+`InMemoryConversationStore` keeps everything in a dict, for when nothing should outlive the
+process (ex: tests).
+
+Example:
+
+    store = SqliteConversationStore(DEFAULT_CONVERSATION_STORE_FILEPATH)
+
+    store.create_conversation(conversation_id)
+    store.append_message(conversation_id, {"role": "user", "content": "Hello"})
+
+    # ex: only the newest 20 messages
+    num_messages = store.get_num_messages(conversation_id)
+    messages = store.get_messages(conversation_id, offset=max(num_messages - 20, 0))
+
+"""
+
+from typing import Any
+import abc
+import copy
+import dataclasses
+import json
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+
+import anthropic
+import filelock
+
+
+DEFAULT_CONVERSATION_STORE_FILEPATH = pathlib.Path("conversations") / "conversations.sqlite3"
+
+
+class ConversationStore(abc.ABC):
+    """Append only storage of conversations, listed in the order they were created."""
+
+    @abc.abstractmethod
+    def get_conversation_ids(self) -> list[str]:
+        """All conversation ids, oldest first, without loading any messages."""
+
+    @abc.abstractmethod
+    def create_conversation(self, conversation_id: str) -> None:
+        pass
+
+    @abc.abstractmethod
+    def append_message(
+        self,
+        conversation_id: str,
+        message: anthropic.types.MessageParam,
+    ) -> None:
+        pass
+
+    @abc.abstractmethod
+    def get_num_messages(self, conversation_id: str) -> int:
+        pass
+
+    @abc.abstractmethod
+    def get_messages(
+        self,
+        conversation_id: str,
+        offset: int = 0,
+        limit: int | None = None,
+    ) -> list[anthropic.types.MessageParam]:
+        """Messages starting at `offset`, up to `limit` of them (or all remaining if `None`)."""
+
+
+class InMemoryConversationStore(ConversationStore):
+
+    def __init__(self) -> None:
+
+        self._lock = threading.Lock()
+        self._messages_by_conversation_id: dict[str, list[anthropic.types.MessageParam]] = {}
+
+    def get_conversation_ids(self) -> list[str]:
+
+        with self._lock:
+            return list(self._messages_by_conversation_id)
+
+    def create_conversation(self, conversation_id: str) -> None:
+
+        with self._lock:
+            self._messages_by_conversation_id.setdefault(conversation_id, [])
+
+    def append_message(
+        self,
+        conversation_id: str,
+        message: anthropic.types.MessageParam,
+    ) -> None:
+
+        with self._lock:
+            self._messages_by_conversation_id[conversation_id].append(message)
+
+    def get_num_messages(self, conversation_id: str) -> int:
+
+        with self._lock:
+            return len(self._messages_by_conversation_id[conversation_id])
+
+    def get_messages(
+        self,
+        conversation_id: str,
+        offset: int = 0,
+        limit: int | None = None,
+    ) -> list[anthropic.types.MessageParam]:
+
+        with self._lock:
+            messages = self._messages_by_conversation_id[conversation_id]
+
+            end = None if limit is None else offset + limit
+
+            return messages[offset:end]
+
+
+class SqliteConversationStore(ConversationStore):
+    """
+    Conversations in a SQLite database in WAL mode, so readers don't block the writer.
+
+    Safe to use from multiple threads, and from multiple processes using the same file.
+
+    Note:
+      - appends only touch the conversation's row and one new message row, so are O(1) in the
+        length of the conversation
+      - a conversation's message count is kept on its row, so paging from the end doesn't need
+        to scan its messages
+
+    """
+
+    def __init__(self, filepath: pathlib.Path) -> None:
+
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+
+        # note: access is serialized by `_lock`, so sharing the connection across threads is fine
+        self._connection = sqlite3.connect(filepath, check_same_thread=False)
+
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS conversations ("
+                "conversation_id TEXT PRIMARY KEY, "
+                "created_at REAL NOT NULL, "
+                "num_messages INTEGER NOT NULL DEFAULT 0)"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "conversation_id TEXT NOT NULL, "
+                "position INTEGER NOT NULL, "
+                "message_json TEXT NOT NULL, "
+                "PRIMARY KEY (conversation_id, position))"
+            )
+
+    def get_conversation_ids(self) -> list[str]:
+
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT conversation_id FROM conversations ORDER BY created_at, rowid"
+            ).fetchall()
+
+        return [str(x[0]) for x in rows]
+
+    def create_conversation(self, conversation_id: str) -> None:
+
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR IGNORE INTO conversations (conversation_id, created_at) VALUES (?, ?)",
+                (conversation_id, time.time()),
+            )
+
+    def append_message(
+        self,
+        conversation_id: str,
+        message: anthropic.types.MessageParam,
+    ) -> None:
+
+        message_json = json.dumps(message)
+
+        with self._lock, self._connection:
+
+            # note: `RETURNING` gives the new count in the same statement, so concurrent
+            #       writers from other processes can't be given the same position
+            row = self._connection.execute(
+                "UPDATE conversations SET num_messages = num_messages + 1 "
+                "WHERE conversation_id = ? RETURNING num_messages",
+                (conversation_id,),
+            ).fetchone()
+
+            if row is None:
+                raise KeyError(f"Conversation {conversation_id} not found")
+
+            self._connection.execute(
+                "INSERT INTO messages (conversation_id, position, message_json) VALUES (?, ?, ?)",
+                (conversation_id, int(row[0]) - 1, message_json),
+            )
+
+    def get_num_messages(self, conversation_id: str) -> int:
+
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT num_messages FROM conversations WHERE conversation_id = ?",
+                (conversation_id,),
+            ).fetchone()
+
+        if row is None:
+            raise KeyError(f"Conversation {conversation_id} not found")
+
+        return int(row[0])
+
+    def get_messages(
+        self,
+        conversation_id: str,
+        offset: int = 0,
+        limit: int | None = None,
+    ) -> list[anthropic.types.MessageParam]:
+
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT message_json FROM messages "
+                "WHERE conversation_id = ? AND position >= ? "
+                "ORDER BY position LIMIT ?",
+                # note: a negative limit means no limit in SQLite
+                (conversation_id, offset, -1 if limit is None else limit),
+            ).fetchall()
+
+        return [json.loads(x[0]) for x in rows]
+
+
+@dataclasses.dataclass
+class _ParsedJsonlFile:
+    # replaced files (ex: the index, by migration) get a new inode, so must be parsed from the start
+    inode: int
+    # note: keyed on both mtime and size, since mtime resolution can be coarser than back to
+    #       back appends
+    mtime_ns: int
+    # bytes of the file parsed so far, which always ends at a newline
+    num_bytes_parsed: int
+    records: list[dict[str, Any]]
+
+
+class _JsonlFileCache:
+    """
+    Parsed contents of append only JSONL files, re-parsing only what was appended since the last read.
+
+    Note:
+      - a partially written last line (ex: another process is mid append) is left for the next read
+
+    """
+
+    def __init__(self) -> None:
+
+        self._lock = threading.Lock()
+        self._parsed_file_by_filepath: dict[pathlib.Path, _ParsedJsonlFile] = {}
+
+    def read(self, filepath: pathlib.Path) -> list[dict[str, Any]]:
+        """All records in the file, as a list shared by every reader which must not be modified."""
+
+        stat_result = filepath.stat()
+
+        # note: parsed under the lock, so concurrent reads can't both add the same appended lines
+        with self._lock:
+            parsed_file = self._parsed_file_by_filepath.get(filepath)
+
+            if parsed_file is not None and (
+                parsed_file.inode == stat_result.st_ino
+                and parsed_file.mtime_ns == stat_result.st_mtime_ns
+                and parsed_file.num_bytes_parsed == stat_result.st_size
+            ):
+                return parsed_file.records
+
+            # only appended to, so anything we already parsed is still valid (unless it was replaced)
+            if (
+                parsed_file is None
+                or parsed_file.inode != stat_result.st_ino
+                or stat_result.st_size < parsed_file.num_bytes_parsed
+            ):
+                parsed_file = _ParsedJsonlFile(
+                    inode=stat_result.st_ino,
+                    mtime_ns=0,
+                    num_bytes_parsed=0,
+                    records=[],
+                )
+                self._parsed_file_by_filepath[filepath] = parsed_file
+
+            with filepath.open("rb") as file:
+                file.seek(parsed_file.num_bytes_parsed)
+                appended_bytes = file.read()
+
+            complete_num_bytes = appended_bytes.rfind(b"\n") + 1
+
+            appended_records = [
+                json.loads(line)
+                for line in appended_bytes[:complete_num_bytes].splitlines()
+                if line.strip()
+            ]
+
+            # extended in place, so each read only costs what was appended
+            parsed_file.records.extend(appended_records)
+            parsed_file.mtime_ns = stat_result.st_mtime_ns
+            parsed_file.num_bytes_parsed += complete_num_bytes
+
+            return parsed_file.records
+
+
+class JsonlConversationStore(ConversationStore):
+    """
+    Conversations as append only JSONL files in `directory`, one message per line.
+
+    Each conversation is `<conversation-id>.jsonl`, plus an `index.jsonl` of conversation ids and
+    when they were created, so listing them doesn't touch the conversation files.
+
+    Safe to use from multiple threads, and from multiple processes using the same directory.
+
+    Note:
+      - appends are a single write of one line, under a file lock, so they're atomic across
+        processes and O(1) in the length of the conversation
+      - reads are cached per file, keyed on its mtime and size, so re-reading an unchanged
+        conversation (ex: on every streamlit rerun) doesn't re-parse it
+      - the first time a directory is opened, any conversations in the older
+        `<conversation-id>.json` format are converted, keeping the originals as `.json.bak`
+
+    """
+
+    _INDEX_FILENAME = "index.jsonl"
+
+    # written once conversations in the older format have been converted, so it's only done once
+    _LEGACY_MIGRATION_MARKER_FILENAME = "legacy_json_migrated"
+
+    def __init__(self, directory: pathlib.Path) -> None:
+
+        self._directory = directory
+        self._directory.mkdir(parents=True, exist_ok=True)
+
+        self._index_filepath = self._directory / self._INDEX_FILENAME
+
+        self._file_cache = _JsonlFileCache()
+
+        self._legacy_migration_marker_filepath = (
+            self._directory / self._LEGACY_MIGRATION_MARKER_FILENAME
+        )
+
+        if not self._legacy_migration_marker_filepath.exists():
+            self._migrate_legacy_conversations()
+
+    def get_conversation_filepath(self, conversation_id: str) -> pathlib.Path:
+        return self._directory / f"{conversation_id}.jsonl"
+
+    def _get_lock(self, filepath: pathlib.Path) -> filelock.FileLock:
+        return filelock.FileLock(filepath.with_name(filepath.name + ".lock"))
+
+    def _append_record(self, filepath: pathlib.Path, record: dict[str, Any]) -> None:
+
+        # note: json escapes newlines in strings, so each record is always a single line
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+
+        with self._get_lock(filepath):
+            with filepath.open("ab") as file:
+                file.write(line.encode("utf-8"))
+
+    def _read_index_records(self) -> list[dict[str, Any]]:
+
+        if not self._index_filepath.exists():
+            return []
+
+        return self._file_cache.read(self._index_filepath)
+
+    def _migrate_legacy_conversations(self) -> None:
+        """
+        Convert conversations in the older `<conversation-id>.json` format, and add them to the index.
+
+        Legacy files whose conversation already exists in the new format are left as is.
+
+        """
+
+        with self._get_lock(self._index_filepath):
+
+            # note: checked again under the lock, since another process may have just done it
+            if self._legacy_migration_marker_filepath.exists():
+                return None
+
+            created_at_by_conversation_id: dict[str, float] = {}
+
+            for record in self._read_index_records():
+                created_at_by_conversation_id.setdefault(
+                    record["conversation_id"], record["created_at"]
+                )
+
+            converted_legacy_filepaths: list[pathlib.Path] = []
+
+            for legacy_filepath in sorted(self._directory.glob("*.json")):
+
+                conversation_id = legacy_filepath.stem
+                filepath = self.get_conversation_filepath(conversation_id)
+
+                if filepath.exists():
+                    continue
+
+                with legacy_filepath.open("r", encoding="utf-8") as file:
+                    messages = json.load(file)
+
+                # write to a temporary file first, so a crash can't leave it half converted
+                temporary_filepath = filepath.with_name(filepath.name + ".tmp")
+
+                temporary_filepath.write_text(
+                    "".join(json.dumps(x, ensure_ascii=False) + "\n" for x in messages),
+                    encoding="utf-8",
+                )
+                os.replace(temporary_filepath, filepath)
+
+                created_at_by_conversation_id.setdefault(
+                    conversation_id, legacy_filepath.stat().st_mtime
+                )
+
+                converted_legacy_filepaths.append(legacy_filepath)
+
+            if converted_legacy_filepaths:
+
+                # note: stable sort, so ties stay in the order they were created
+                sorted_index = "".join(
+                    json.dumps({"conversation_id": x, "created_at": created_at}) + "\n"
+                    for x, created_at in sorted(
+                        created_at_by_conversation_id.items(),
+                        key=lambda item: item[1],
+                    )
+                )
+
+                temporary_filepath = self._index_filepath.with_name(
+                    self._index_filepath.name + ".tmp"
+                )
+                temporary_filepath.write_text(sorted_index, encoding="utf-8")
+                os.replace(temporary_filepath, self._index_filepath)
+
+                # only moved aside once the index refers to the converted ones
+                for legacy_filepath in converted_legacy_filepaths:
+                    legacy_filepath.rename(
+                        legacy_filepath.with_name(legacy_filepath.name + ".bak")
+                    )
+
+            self._legacy_migration_marker_filepath.touch()
+
+    def get_conversation_ids(self) -> list[str]:
+
+        conversation_ids = [x["conversation_id"] for x in self._read_index_records()]
+
+        # note: appended in creation order, so only duplicates (ex: from a race between
+        #       processes creating the same conversation) need removing
+        return list(dict.fromkeys(conversation_ids))
+
+    def create_conversation(self, conversation_id: str) -> None:
+
+        filepath = self.get_conversation_filepath(conversation_id)
+
+        if filepath.exists():
+            return None
+
+        filepath.touch()
+
+        self._append_record(
+            self._index_filepath,
+            {"conversation_id": conversation_id, "created_at": time.time()},
+        )
+
+    def append_message(
+        self,
+        conversation_id: str,
+        message: anthropic.types.MessageParam,
+    ) -> None:
+
+        filepath = self.get_conversation_filepath(conversation_id)
+
+        if not filepath.exists():
+            raise KeyError(f"Conversation {conversation_id} not found")
+
+        self._append_record(filepath, dict(message))
+
+    def get_num_messages(self, conversation_id: str) -> int:
+        return len(self._file_cache.read(self.get_conversation_filepath(conversation_id)))
+
+    def get_messages(
+        self,
+        conversation_id: str,
+        offset: int = 0,
+        limit: int | None = None,
+    ) -> list[anthropic.types.MessageParam]:
+
+        records = self._file_cache.read(self.get_conversation_filepath(conversation_id))
+
+        end = None if limit is None else offset + limit
+
+        # note: copied, since the cached records are shared by every caller
+        messages: list[anthropic.types.MessageParam] = copy.deepcopy(
+            records[offset:end]  # type: ignore[arg-type]
+        )
+
+        return messages
+
+    def _get_draft_filepath(self, conversation_id: str) -> pathlib.Path:
+        # note: not ending in `.json`, which would be picked up as a legacy conversation
+        return self._directory / f"{conversation_id}.jsonl.draft"
+
+    def save_draft_message(
+        self,
+        conversation_id: str,
+        message: anthropic.types.MessageParam,
+    ) -> None:
+        """
+        Checkpoint a message that's still being generated (ex: a partially streamed reply).
+
+        Each save replaces the previous draft, so only the latest checkpoint is kept.
+
+        """
+
+        filepath = self._get_draft_filepath(conversation_id)
+
+        # write to a temporary file first, so a crash mid write keeps the previous checkpoint
+        temporary_filepath = filepath.with_name(filepath.name + ".tmp")
+        temporary_filepath.write_text(
+            json.dumps(dict(message), ensure_ascii=False),
+            encoding="utf-8",
+        )
+        os.replace(temporary_filepath, filepath)
+
+    def get_draft_message(self, conversation_id: str) -> anthropic.types.MessageParam | None:
+        """The last checkpointed draft, if the message it belongs to was never finished."""
+
+        filepath = self._get_draft_filepath(conversation_id)
+
+        if not filepath.exists():
+            return None
+
+        message: anthropic.types.MessageParam = json.loads(filepath.read_text(encoding="utf-8"))
+
+        return message
+
+    def clear_draft_message(self, conversation_id: str) -> None:
+        self._get_draft_filepath(conversation_id).unlink(missing_ok=True)
@@ -1,7 +1,9 @@
 import contextlib
+import contextvars
 import tempfile
 import os
 import pathlib
+from typing import Iterator
 
 from local_claude.libs.tools import constants
 
@@ -33,13 +35,43 @@ def temporary_working_directory() -> str:
             os.chdir(current_dir)
 
 
+# note: a context variable instead of changing the working directory, since the working
+#       directory is shared by every thread in the process
+_model_workspace_directory_override: contextvars.ContextVar[pathlib.Path | None] = (
+    contextvars.ContextVar("model_workspace_directory_override", default=None)
+)
+
+
+@contextlib.contextmanager
+def model_workspace_directory(directory: pathlib.Path) -> Iterator[pathlib.Path]:
+    """
+    Use `directory` as the model workspace for tools called within this context.
+
+    This lets multiple conversations run concurrently in the same process, each with an
+    isolated workspace. The override follows the current context, so it applies to asyncio
+    tasks and threads started with a copy of it (ex: `asyncio.to_thread`).
+
+    """
+
+    token = _model_workspace_directory_override.set(directory)
+
+    try:
+        yield directory
+    finally:
+        _model_workspace_directory_override.reset(token)
+
+
 # TODO(bschoen): Consolidate explanation somewhere
-# TODO(bschoen): Make this a context manager?
 def get_current_model_workspace_directory() -> pathlib.Path:
     """Get the current model workspace directory, creating it if it doesn't exist."""
 
-    directory = pathlib.Path(os.getcwd()) / constants.DEFAULT_MODEL_WORKSPACE_DIRECTORY
+    directory = _model_workspace_directory_override.get()
+
+    if directory is None:
+        directory = (
+            pathlib.Path(os.getcwd()) / constants.DEFAULT_MODEL_WORKSPACE_DIRECTORY
+        )
 
-    directory.mkdir(exist_ok=True)
+    directory.mkdir(parents=True, exist_ok=True)
 
     return directory
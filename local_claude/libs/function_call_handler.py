@@ -1,10 +1,21 @@
-from typing import Callable, Any
+from typing import Callable, Any, Sequence
+import asyncio
+import concurrent.futures
+import contextvars
 import json
+import time
 import traceback
 
 import anthropic
 
-from . import schemas
+from . import directory_utils
+from . import tool_execution
+from . import tool_input_validation
+from . import tool_options
+from . import tool_registry
+from . import tool_result_cache
+from . import tool_schema_variants
+from . import tracing
 
 """
 
@@ -24,7 +35,18 @@ Caveats:
 """
 
 
-def _exception_to_json_dict[E: Exception](exception: E) -> dict[str, str]:
+# called with each tool call, its result, and the wall time in seconds it took to resolve
+type OnToolCallResolved = Callable[
+    [anthropic.types.ToolUseBlock, anthropic.types.ToolResultBlockParam, float], None
+]
+
+
+def _exception_to_json_dict[E: Exception](exception: E) -> dict[str, Any]:
+
+    # ex: timeouts, which have their own structure (and a traceback from the handler isn't useful)
+    if isinstance(exception, tool_execution.ToolExecutionError):
+        return exception.to_json_dict()
+
     return {
         "type": type(exception).__name__,
         "message": str(exception),
@@ -42,20 +64,58 @@ class FunctionCallHandler:
 
     """
 
-    def __init__(self, functions: list[Callable[..., Any]]) -> None:
+    # default number of tool calls to execute at once in `resolve_many`
+    DEFAULT_MAX_WORKERS = 4
+
+    def __init__(
+        self,
+        functions: Sequence[Callable[..., Any]],
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        on_tool_call_resolved: OnToolCallResolved | None = None,
+        tool_result_cache: tool_result_cache.ToolResultCache | None = None,
+        tool_schema_variant: tool_schema_variants.ToolSchemaVariant = (
+            tool_schema_variants.ToolSchemaVariant.FULL
+        ),
+        compact_tool_descriptions: (
+            dict[str, tool_schema_variants.CompactToolDescription] | None
+        ) = None,
+    ) -> None:
 
         self._function_name_to_function = {x.__name__: x for x in functions}
 
+        self._max_workers = max_workers
+
+        # note: may be called from multiple threads by `resolve_many`
+        self._on_tool_call_resolved = on_tool_call_resolved
+
+        # memoizes results of tools that declare a `cache_ttl_seconds`, may be shared across handlers
+        self._tool_result_cache = tool_result_cache
+
         # create `tools` arg schema once since used multiple times by calls to `create`
+        # note: `tool_registry.LazyTool`s already know their schema, without importing the tool
         self._schema_for_tools_arg: list[anthropic.types.ToolParam] = [
-            schemas.generate_json_schema_for_function(x) for x in functions
+            tool_schema_variants.apply_tool_schema_variant(
+                tool_registry.get_tool_schema(x),
+                tool_schema_variant=tool_schema_variant,
+                compact_tool_descriptions=compact_tool_descriptions or {},
+            )
+            for x in functions
         ]
 
-    def _resolve_function_call(
+        # recorded with each model call (see `telemetry.ModelCallRecord`), to compare variants
+        self._tool_schema_variant = tool_schema_variant
+
+        # so malformed calls are rejected before the tool does any work
+        self._input_validator_by_function_name = {
+            x["name"]: tool_input_validation.compile_tool_input_validator(x)
+            for x in self._schema_for_tools_arg
+        }
+
+    def _get_function_and_validated_args(
         self,
         tool_call: anthropic.types.ToolUseBlock,
-    ) -> Any:
-        """Resolve and execute the actual function call represented by the tool call."""
+    ) -> tuple[Callable[..., Any], dict[str, Any]]:
+        """Look up the function the tool call is for, and check its arguments."""
 
         function_name = tool_call.name
         function_args = tool_call.input
@@ -65,31 +125,77 @@ class FunctionCallHandler:
                 f"{function_name} not found in {self._function_name_to_function.keys()}"
             )
 
-        func = self._function_name_to_function[function_name]
+        # raises with an error the model can fix, instead of failing somewhere inside the tool
+        # note: structured outputs would be better, since it guarantees the actual generation
+        self._input_validator_by_function_name[function_name](function_args)
 
-        # actually call the function
-        # TODO(bschoen): Would be good to automatically do runtime type validation, structured
-        #                outputs is better because guarantees the actual generation, not just
-        #                failing client side with an error
-        result = func(**function_args)
+        # note: imports the tool on first use, if it's a `tool_registry.LazyTool`, so only once
+        #       a call to it is known to be valid
+        func = tool_registry.load_tool(self._function_name_to_function[function_name])
+
+        return func, function_args  # type: ignore[return-value]
+
+    def _resolve_function_call(
+        self,
+        tool_call: anthropic.types.ToolUseBlock,
+    ) -> Any:
+        """Resolve and execute the actual function call represented by the tool call."""
+
+        func, function_args = self._get_function_and_validated_args(tool_call)
+
+        # actually call the function, in a thread or subprocess if it declared one (see `ToolOptions.execution_mode`)
+        result = tool_execution.run_tool(
+            func,
+            function_args,
+            tool_options.get_tool_options(func),
+        )
 
         return result
 
-    def resolve(
+    async def _async_resolve_function_call(
         self,
         tool_call: anthropic.types.ToolUseBlock,
-    ) -> anthropic.types.ToolResultBlockParam:
-        """Resolve the function call and convert it to a tool result message."""
+    ) -> Any:
+        """Same as `_resolve_function_call`, but coroutine tools are awaited on the running event loop."""
+
+        func, function_args = self._get_function_and_validated_args(tool_call)
 
-        try:
-            function_result = self._resolve_function_call(tool_call=tool_call)
-            function_result = str(function_result)
-            is_error = False
-        except Exception as e:
-            # on exception, convert to string so the model can handle it
-            function_result = _exception_to_json_dict(e)
-            function_result = json.dumps(function_result, indent=2)
-            is_error = True
+        return await tool_execution.async_run_tool(
+            func,
+            function_args,
+            tool_options.get_tool_options(func),
+        )
+
+    def _get_cache_key_and_ttl_seconds(
+        self,
+        tool_call: anthropic.types.ToolUseBlock,
+    ) -> tuple[str | None, float | None]:
+
+        cache_ttl_seconds = self._get_cache_ttl_seconds(tool_call)
+
+        # note: invalid input isn't cached, it's reported once the call is validated
+        if (
+            self._tool_result_cache is None
+            or cache_ttl_seconds is None
+            or not isinstance(tool_call.input, dict)
+        ):
+            return None, None
+
+        cache_key = tool_result_cache.make_cache_key(
+            tool_call.name,
+            tool_call.input,
+            workspace_directory=directory_utils.get_current_model_workspace_directory(),
+        )
+
+        return cache_key, cache_ttl_seconds
+
+    def _to_tool_result(
+        self,
+        tool_call: anthropic.types.ToolUseBlock,
+        function_result: str,
+        is_error: bool,
+        start_time: float,
+    ) -> anthropic.types.ToolResultBlockParam:
 
         # TODO(bschoen): Why does the example include labeled outputs?
         # TODO(bschoen): Handle iterable content blocks
@@ -101,9 +207,235 @@ class FunctionCallHandler:
             "is_error": is_error,
         }
 
+        if self._on_tool_call_resolved is not None:
+            self._on_tool_call_resolved(
+                tool_call, output, time.perf_counter() - start_time
+            )
+
         return output
 
+    def _put_cached_result(
+        self,
+        cache_key: str | None,
+        cache_ttl_seconds: float | None,
+        function_result: str,
+        is_error: bool,
+    ) -> None:
+
+        # note: errors aren't cached, since they're often transient (ex: timeouts)
+        if (
+            self._tool_result_cache is not None
+            and cache_key is not None
+            and cache_ttl_seconds is not None
+            and not is_error
+        ):
+            self._tool_result_cache.put(
+                cache_key,
+                content=function_result,
+                ttl_seconds=cache_ttl_seconds,
+            )
+
+    def resolve(
+        self,
+        tool_call: anthropic.types.ToolUseBlock,
+    ) -> anthropic.types.ToolResultBlockParam:
+        """Resolve the function call and convert it to a tool result message."""
+
+        with tracing.span(
+            f"resolve:{tool_call.name}",
+            category="handler",
+            tool_use_id=tool_call.id,
+        ):
+
+            start_time = time.perf_counter()
+
+            cache_key, cache_ttl_seconds = self._get_cache_key_and_ttl_seconds(tool_call)
+
+            if self._tool_result_cache is not None and cache_key is not None:
+                if (cached_result := self._tool_result_cache.get(cache_key)) is not None:
+                    return self._to_tool_result(tool_call, cached_result, False, start_time)
+
+            try:
+                function_result = str(self._resolve_function_call(tool_call=tool_call))
+                is_error = False
+            except Exception as e:
+                # on exception, convert to string so the model can handle it
+                function_result = json.dumps(_exception_to_json_dict(e), indent=2)
+                is_error = True
+
+            self._put_cached_result(cache_key, cache_ttl_seconds, function_result, is_error)
+
+            return self._to_tool_result(tool_call, function_result, is_error, start_time)
+
+    async def async_resolve(
+        self,
+        tool_call: anthropic.types.ToolUseBlock,
+    ) -> anthropic.types.ToolResultBlockParam:
+        """
+        Same as `resolve`, but for calling from an event loop.
+
+        Coroutine tools are awaited on the loop, and sync tools are run in the loop's default
+        thread pool, so neither blocks it.
+
+        """
+
+        with tracing.span(
+            f"resolve:{tool_call.name}",
+            category="handler",
+            tool_use_id=tool_call.id,
+        ):
+
+            start_time = time.perf_counter()
+
+            cache_key, cache_ttl_seconds = self._get_cache_key_and_ttl_seconds(tool_call)
+
+            if self._tool_result_cache is not None and cache_key is not None:
+                if (cached_result := self._tool_result_cache.get(cache_key)) is not None:
+                    return self._to_tool_result(tool_call, cached_result, False, start_time)
+
+            try:
+                function_result = str(await self._async_resolve_function_call(tool_call=tool_call))
+                is_error = False
+            except Exception as e:
+                # on exception, convert to string so the model can handle it
+                function_result = json.dumps(_exception_to_json_dict(e), indent=2)
+                is_error = True
+
+            self._put_cached_result(cache_key, cache_ttl_seconds, function_result, is_error)
+
+            return self._to_tool_result(tool_call, function_result, is_error, start_time)
+
+    def _get_cache_ttl_seconds(
+        self,
+        tool_call: anthropic.types.ToolUseBlock,
+    ) -> float | None:
+        """How long to cache the tool call's result for, or `None` if it shouldn't be cached."""
+
+        func = self._function_name_to_function.get(tool_call.name)
+
+        if func is None or not isinstance(tool_call.input, dict):
+            return None
+
+        return tool_options.get_tool_options(func).cache_ttl_seconds
+
+    def _is_parallel_safe(self, tool_call: anthropic.types.ToolUseBlock) -> bool:
+
+        func = self._function_name_to_function.get(tool_call.name)
+
+        # unknown functions just resolve to an error, so they're safe to run with anything
+        if func is None:
+            return True
+
+        return tool_options.get_tool_options(func).is_parallel_safe
+
+    def is_speculation_safe(self, tool_call: anthropic.types.ToolUseBlock) -> bool:
+        """Whether the tool call can be resolved before the rest of the model's response is known."""
+
+        func = self._function_name_to_function.get(tool_call.name)
+
+        if func is None:
+            return False
+
+        options = tool_options.get_tool_options(func)
+
+        # note: also requires parallel safe, since it'll run concurrently with whatever else is running
+        return options.is_side_effect_safe and options.is_parallel_safe
+
+    def resolve_many(
+        self,
+        tool_calls: list[anthropic.types.ToolUseBlock],
+    ) -> list[anthropic.types.ToolResultBlockParam]:
+        """
+        Resolve multiple function calls, running independent ones concurrently.
+
+        Results are returned in the same order as `tool_calls`.
+
+        Tools that aren't parallel safe (see `tool_options.ToolOptions`) act as a barrier, they
+        run by themselves after all previous calls finish and before any later ones start. This
+        way any workspace state they share is seen in the same order as the model requested.
+
+        """
+
+        tool_results: list[anthropic.types.ToolResultBlockParam] = []
+
+        # batch of consecutive parallel safe calls, run together once a barrier is hit
+        pending_batch: list[anthropic.types.ToolUseBlock] = []
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self._max_workers
+        ) as executor:
+
+            def flush_pending_batch() -> None:
+
+                # run each call with a copy of the caller's context, since executor threads
+                # don't inherit it (ex: `directory_utils.model_workspace_directory`)
+                futures = [
+                    executor.submit(
+                        contextvars.copy_context().run, self.resolve, tool_call
+                    )
+                    for tool_call in pending_batch
+                ]
+
+                tool_results.extend(x.result() for x in futures)
+                pending_batch.clear()
+
+            for tool_call in tool_calls:
+
+                if self._is_parallel_safe(tool_call):
+                    pending_batch.append(tool_call)
+                    continue
+
+                flush_pending_batch()
+
+                tool_results.append(self.resolve(tool_call=tool_call))
+
+            flush_pending_batch()
+
+        return tool_results
+
+    async def async_resolve_many(
+        self,
+        tool_calls: list[anthropic.types.ToolUseBlock],
+    ) -> list[anthropic.types.ToolResultBlockParam]:
+        """
+        Same as `resolve_many`, but for calling from an event loop (see `async_resolve`).
+
+        Parallel safe calls in the same batch run concurrently, so a batch of network bound
+        coroutine tools takes about as long as the slowest one.
+
+        """
+
+        tool_results: list[anthropic.types.ToolResultBlockParam] = []
+
+        # batch of consecutive parallel safe calls, run together once a barrier is hit
+        pending_batch: list[anthropic.types.ToolUseBlock] = []
+
+        async def flush_pending_batch() -> None:
+
+            # note: `gather` wraps each in a task, which runs with a copy of the current context
+            tool_results.extend(
+                await asyncio.gather(*(self.async_resolve(x) for x in pending_batch))
+            )
+            pending_batch.clear()
+
+        for tool_call in tool_calls:
+
+            if self._is_parallel_safe(tool_call):
+                pending_batch.append(tool_call)
+                continue
+
+            await flush_pending_batch()
+
+            tool_results.append(await self.async_resolve(tool_call=tool_call))
+
+        await flush_pending_batch()
+
+        return tool_results
+
     def get_schema_for_tools_arg(self) -> list[anthropic.types.ToolParam]:
         """Get the argument value needed for the `tools` parameter of the model's client completion call."""
 
         return self._schema_for_tools_arg
+
+    def get_tool_schema_variant(self) -> tool_schema_variants.ToolSchemaVariant:
+        return self._tool_schema_variant
@@ -0,0 +1,228 @@
+"""
+Converts messages into what the page displays, separately from actually displaying them.
+
+Converting is the expensive part (ex: pretty printing tool inputs, parsing tool results, decoding
+images), and past messages never change, so `RenderedMessageCache` keeps the converted form of
+each one and reruns only need to display it.
+
+Also see `get_recent_turns`, for only loading the end of long conversations.
+
+"""
+
+from typing import Any, Literal
+import base64
+import collections
+import dataclasses
+import json
+import threading
+
+import anthropic
+
+from local_claude.libs import conversation_store
+
+
+# characters of non json tool results to show
+TOOL_RESULT_PREVIEW_CHARACTERS = 100
+
+
+@dataclasses.dataclass(frozen=True)
+class RenderedElement:
+    kind: Literal["markdown", "code", "image"]
+    # note: bytes for images, text otherwise
+    body: str | bytes
+
+
+@dataclasses.dataclass(frozen=True)
+class RenderedMessage:
+    role: str
+    elements: tuple[RenderedElement, ...]
+
+
+def _try_load_json_or_default_to_string(json_string: str) -> Any:
+    try:
+        return json.loads(json_string)
+    except json.JSONDecodeError:
+        return json_string
+
+
+def _render_content(message_content: Any) -> list[RenderedElement]:
+
+    if isinstance(message_content, str):
+        return [RenderedElement("markdown", message_content)]
+
+    # recursively handle list
+    if isinstance(message_content, list):
+        return [x for item in message_content for x in _render_content(item)]
+
+    match message_content["type"]:
+        case "text":
+            return [RenderedElement("markdown", message_content["text"])]
+        case "image":
+            # TODO(bschoen): Handle url image sources
+            return [
+                RenderedElement(
+                    "image", base64.b64decode(message_content["source"]["data"])
+                )
+            ]
+        case "tool_use":
+            return [
+                RenderedElement("markdown", f"Tool use: {message_content['id']}"),
+                RenderedElement(
+                    "markdown",
+                    f"```json\n{json.dumps(message_content, indent=2)}\n```",
+                ),
+            ]
+        case "tool_result":
+            elements = [
+                RenderedElement(
+                    "markdown", f"Tool result: {message_content['tool_use_id']}"
+                )
+            ]
+
+            # show details for error
+            if message_content["is_error"]:
+
+                # in this case, we know it should be a JSON dict representing a python exception
+                exception_dict = json.loads(message_content["content"])
+                elements.append(RenderedElement("code", exception_dict["traceback"]))
+
+                return elements
+
+            # if it's a json, show that, otherwise show content up to a limit
+            function_result = _try_load_json_or_default_to_string(
+                message_content["content"]
+            )
+
+            if isinstance(function_result, str):
+                elements.append(
+                    RenderedElement(
+                        "code",
+                        function_result[:TOOL_RESULT_PREVIEW_CHARACTERS].strip()
+                        + f"... (only showing up to first {TOOL_RESULT_PREVIEW_CHARACTERS} characters)",
+                    )
+                )
+                return elements
+
+            elements.append(
+                RenderedElement(
+                    "markdown",
+                    f"```json\n{json.dumps(function_result, indent=2)}\n```",
+                )
+            )
+
+            # TODO(bschoen): How to make this more generic?
+            if isinstance(function_result, dict) and "output" in function_result:
+                elements.append(RenderedElement("code", str(function_result["output"])))
+
+            return elements
+        case "content":
+            return [RenderedElement("markdown", f"Content: {message_content['name']}")]
+        case _:
+            raise ValueError(f"Unexpected item type: {message_content['type']}")
+
+
+def render_message(message: anthropic.types.MessageParam) -> RenderedMessage:
+    return RenderedMessage(
+        role=message["role"],
+        elements=tuple(_render_content(message["content"])),
+    )
+
+
+class RenderedMessageCache:
+    """
+    Size bounded LRU of rendered messages, keyed by conversation id and position.
+
+    Note:
+      - relies on conversations being append only, so the message at a position never changes
+
+    """
+
+    DEFAULT_MAX_ENTRIES = 2048
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES) -> None:
+
+        self._max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._rendered_messages: collections.OrderedDict[
+            tuple[str, int], RenderedMessage
+        ] = collections.OrderedDict()
+
+    def get_rendered_message(
+        self,
+        conversation_id: str,
+        message_index: int,
+        message: anthropic.types.MessageParam,
+    ) -> RenderedMessage:
+
+        key = (conversation_id, message_index)
+
+        with self._lock:
+            if (rendered_message := self._rendered_messages.get(key)) is not None:
+                self._rendered_messages.move_to_end(key)
+                return rendered_message
+
+        rendered_message = render_message(message)
+
+        with self._lock:
+            self._rendered_messages[key] = rendered_message
+
+            while len(self._rendered_messages) > self._max_entries:
+                self._rendered_messages.popitem(last=False)
+
+        return rendered_message
+
+
+def is_turn_start(message: anthropic.types.MessageParam) -> bool:
+    """Whether this is a message the user sent, as opposed to tool results (which are also `user` messages)."""
+
+    if message["role"] != "user":
+        return False
+
+    content = message["content"]
+
+    if isinstance(content, str):
+        return True
+
+    # note: blocks can also be SDK models (ex: a response's content, not yet dumped to dicts)
+    return any(
+        (x.get("type") if isinstance(x, dict) else x.type) != "tool_result" for x in content
+    )
+
+
+def get_recent_turns(
+    store: conversation_store.ConversationStore,
+    conversation_id: str,
+    num_turns: int,
+    page_size: int = 50,
+) -> tuple[int, list[anthropic.types.MessageParam]]:
+    """
+    Load the messages of the last `num_turns` turns, reading pages backwards from the end.
+
+    Returns the index of the first returned message, which is `0` if there are no older turns.
+
+    """
+
+    offset = store.get_num_messages(conversation_id)
+
+    messages: list[anthropic.types.MessageParam] = []
+
+    while offset > 0:
+
+        page_offset = max(offset - page_size, 0)
+
+        messages = (
+            store.get_messages(conversation_id, offset=page_offset, limit=offset - page_offset)
+            + messages
+        )
+        offset = page_offset
+
+        turn_start_indices = [i for i, x in enumerate(messages) if is_turn_start(x)]
+
+        if len(turn_start_indices) >= num_turns:
+
+            window_start = turn_start_indices[-num_turns]
+
+            return offset + window_start, messages[window_start:]
+
+    return 0, messages
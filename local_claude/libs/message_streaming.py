@@ -0,0 +1,151 @@
+"""Functions around consuming streamed model responses."""
+
+from typing import Any, Callable
+import json
+
+import anthropic
+
+
+class StreamedMessageAccumulator:
+    """
+    Accumulates raw message stream events into the same `Message` that `messages.create` would return.
+
+    We build the message ourselves instead of using `MessageStream.get_final_message` since the SDK's
+    snapshot stores its partial json buffer as an extra attribute on `tool_use` blocks, which would
+    then show up when dumping the message into the conversation history.
+
+    Note:
+      - `tool_use` inputs are only parsed once their `content_block_stop` arrives, since partial json
+        isn't meaningful to callers
+      - derived events from `MessageStream` (ex: `text`, `input_json`) are ignored, as we only need the raw ones
+      - `on_tool_use_block` is called with each `tool_use` block as soon as its input is complete, which
+        may be well before the message ends (ex: for starting tool calls early)
+
+    """
+
+    def __init__(
+        self,
+        on_tool_use_block: Callable[[anthropic.types.ToolUseBlock], None] | None = None,
+    ) -> None:
+
+        self._on_tool_use_block = on_tool_use_block
+
+        self._message_snapshot: dict[str, Any] | None = None
+
+        # partial json for each `tool_use` content block index, until its input is complete
+        self._partial_json_by_index: dict[int, str] = {}
+
+    def add_event(self, event: Any) -> str | None:
+        """Add a stream event to the snapshot, returning the text delta if there was one."""
+
+        match event.type:
+            case "message_start":
+                self._message_snapshot = event.message.to_dict()
+            case "content_block_start":
+                content_block = event.content_block.to_dict()
+
+                if content_block["type"] == "tool_use":
+                    self._partial_json_by_index[event.index] = ""
+
+                self._get_message_snapshot()["content"].append(content_block)
+            case "content_block_delta":
+                content_block = self._get_message_snapshot()["content"][event.index]
+
+                if event.delta.type == "text_delta":
+                    content_block["text"] += event.delta.text
+                    return str(event.delta.text)
+
+                if event.delta.type == "input_json_delta":
+                    self._partial_json_by_index[event.index] += event.delta.partial_json
+
+            case "content_block_stop":
+                if event.index in self._partial_json_by_index:
+                    partial_json = self._partial_json_by_index.pop(event.index)
+
+                    # note: an empty buffer means the tool was called without any arguments
+                    content_block = self._get_message_snapshot()["content"][event.index]
+                    content_block["input"] = json.loads(partial_json) if partial_json else {}
+
+                    if self._on_tool_use_block is not None:
+                        self._on_tool_use_block(
+                            anthropic.types.ToolUseBlock.model_validate(content_block)
+                        )
+
+            case "message_delta":
+                message_snapshot = self._get_message_snapshot()
+
+                message_snapshot["stop_reason"] = event.delta.stop_reason
+                message_snapshot["stop_sequence"] = event.delta.stop_sequence
+                message_snapshot["usage"]["output_tokens"] = event.usage.output_tokens
+
+            case _:
+                # ex: `message_stop`, `ping`, or derived events like `text`
+                pass
+
+        return None
+
+    def _get_message_snapshot(self) -> dict[str, Any]:
+
+        if self._message_snapshot is None:
+            raise RuntimeError('Unexpected event order, got event before "message_start"')
+
+        return self._message_snapshot
+
+    def get_final_message(self) -> anthropic.types.Message:
+        """Get the accumulated message, which must be complete."""
+
+        if self._partial_json_by_index:
+            raise RuntimeError(
+                f"Stream ended with incomplete tool use blocks: {list(self._partial_json_by_index)}"
+            )
+
+        return anthropic.types.Message.model_validate(self._get_message_snapshot())
+
+
+def stream_message(
+    client: anthropic.Anthropic,
+    on_text_delta: Callable[[str], None],
+    on_tool_use_block: Callable[[anthropic.types.ToolUseBlock], None] | None = None,
+    **kwargs: Any,
+) -> anthropic.types.Message:
+    """
+    Equivalent to `client.messages.create(**kwargs)`, but calls `on_text_delta` with text as it arrives.
+
+    If given, `on_tool_use_block` is called with each `tool_use` block once its input is complete.
+
+    Example:
+
+        response = stream_message(client, on_text_delta=print, messages=messages, ...)
+
+    """
+
+    accumulator = StreamedMessageAccumulator(on_tool_use_block=on_tool_use_block)
+
+    with client.messages.stream(**kwargs) as stream:
+
+        for event in stream:
+
+            if text_delta := accumulator.add_event(event):
+                on_text_delta(text_delta)
+
+    return accumulator.get_final_message()
+
+
+async def async_stream_message(
+    client: anthropic.AsyncAnthropic,
+    on_text_delta: Callable[[str], None],
+    on_tool_use_block: Callable[[anthropic.types.ToolUseBlock], None] | None = None,
+    **kwargs: Any,
+) -> anthropic.types.Message:
+    """Same as `stream_message`, but for `AsyncAnthropic` clients."""
+
+    accumulator = StreamedMessageAccumulator(on_tool_use_block=on_tool_use_block)
+
+    async with client.messages.stream(**kwargs) as stream:
+
+        async for event in stream:
+
+            if text_delta := accumulator.add_event(event):
+                on_text_delta(text_delta)
+
+    return accumulator.get_final_message()
@@ -0,0 +1,261 @@
+"""
+Sends the same conversation to several models at once, for latency sensitive prompts and for comparing models on our own workload.
+
+Policies:
+  - `FIRST_WINS`: return the fastest complete answer and cancel the rest
+  - `COMPARE`: wait for every model, so answers can be shown side by side
+
+Example:
+
+    race_result = await race_models(
+        {
+            "gpt-4o-mini": lambda: get_openai_answer(openai_client, "gpt-4o-mini", messages),
+            "claude-3-5-sonnet-20240620": lambda: get_anthropic_answer(
+                anthropic_client, "claude-3-5-sonnet-20240620", messages, max_tokens=1024
+            ),
+        },
+        policy=RacePolicy.FIRST_WINS,
+    )
+
+    # or from sync code (ex: a Streamlit script run), on a new event loop
+    race_result = run_race(model_calls, policy=RacePolicy.FIRST_WINS)
+
+"""
+
+from typing import TYPE_CHECKING, Any, Callable, Coroutine, cast
+import asyncio
+import dataclasses
+import enum
+import time
+import traceback
+
+import anthropic
+
+from local_claude.libs import api_clients
+from local_claude.libs import chat_completion_streaming
+from local_claude.libs import message_streaming
+from local_claude.libs import telemetry
+
+# note: only `run_o1.py` needs openai, so we don't require it to be installed
+if TYPE_CHECKING:
+    import openai
+
+
+class RacePolicy(enum.Enum):
+    FIRST_WINS = "first_wins"
+    COMPARE = "compare"
+
+
+@dataclasses.dataclass(frozen=True)
+class ModelAnswer:
+    model: str
+    text: str
+    latency_seconds: float
+    # note: only set for streamed calls
+    time_to_first_token_seconds: float | None
+    input_tokens: int
+    output_tokens: int
+    # note: included in `output_tokens`, only reported by o1 models
+    reasoning_tokens: int = 0
+
+    def to_model_call_record(self, conversation_id: str) -> telemetry.ModelCallRecord:
+        """Telemetry record for the call, so latency per model can be analyzed across conversations."""
+
+        return telemetry.ModelCallRecord(
+            conversation_id=conversation_id,
+            model=self.model,
+            latency_seconds=self.latency_seconds,
+            time_to_first_token_seconds=self.time_to_first_token_seconds,
+            input_tokens=self.input_tokens,
+            output_tokens=self.output_tokens,
+            cache_read_input_tokens=0,
+            cache_creation_input_tokens=0,
+            reasoning_tokens=self.reasoning_tokens,
+        )
+
+
+type ModelCall = Callable[[], Coroutine[Any, Any, ModelAnswer]]
+
+
+@dataclasses.dataclass(frozen=True)
+class RaceResult:
+    # in the order they finished, so the first is the fastest
+    answers: list[ModelAnswer]
+    # traceback for each model that failed
+    error_by_model: dict[str, str]
+    # models still running when the race was decided (only for `FIRST_WINS`)
+    cancelled_models: list[str]
+
+
+async def get_openai_answer(
+    client: "openai.AsyncOpenAI",
+    model: str,
+    messages: list[dict[str, Any]],
+    is_streaming_enabled: bool = True,
+    **kwargs: Any,
+) -> ModelAnswer:
+    """
+    Get a chat completion, streamed (if enabled) so time to first token can be measured.
+
+    Note:
+      - o1 models don't support streaming, so callers should disable it for them
+
+    """
+
+    start_time = time.perf_counter()
+
+    if not is_streaming_enabled:
+
+        response = await client.chat.completions.create(
+            model=model,
+            messages=cast("list[openai.types.chat.ChatCompletionMessageParam]", messages),
+            **kwargs,
+        )
+
+        usage = chat_completion_streaming.ChatCompletionUsage.from_usage(response.usage)
+
+        return ModelAnswer(
+            model=model,
+            text=response.choices[0].message.content or "",
+            latency_seconds=time.perf_counter() - start_time,
+            time_to_first_token_seconds=None,
+            input_tokens=usage.input_tokens,
+            output_tokens=usage.output_tokens,
+            reasoning_tokens=usage.reasoning_tokens,
+        )
+
+    time_to_first_token_seconds: float | None = None
+
+    accumulator = chat_completion_streaming.ChatCompletionAccumulator()
+
+    stream = await client.chat.completions.create(
+        model=model,
+        messages=cast("list[openai.types.chat.ChatCompletionMessageParam]", messages),
+        # note: passed explicitly (rather than as `STREAM_WITH_USAGE_KWARGS`), so the streaming
+        #       overload is used
+        stream=True,
+        stream_options={"include_usage": True},
+        **kwargs,
+    )
+
+    async for chunk in stream:
+
+        if accumulator.add_chunk(chunk) and time_to_first_token_seconds is None:
+            time_to_first_token_seconds = time.perf_counter() - start_time
+
+    return ModelAnswer(
+        model=model,
+        text=accumulator.get_text(),
+        latency_seconds=time.perf_counter() - start_time,
+        time_to_first_token_seconds=time_to_first_token_seconds,
+        input_tokens=accumulator.usage.input_tokens,
+        output_tokens=accumulator.usage.output_tokens,
+        reasoning_tokens=accumulator.usage.reasoning_tokens,
+    )
+
+
+async def get_anthropic_answer(
+    client: anthropic.AsyncAnthropic,
+    model: str,
+    messages: list[anthropic.types.MessageParam],
+    **kwargs: Any,
+) -> ModelAnswer:
+    """Get a streamed message, so time to first token can be measured."""
+
+    start_time = time.perf_counter()
+
+    time_to_first_token_seconds: float | None = None
+
+    def on_text_delta(text_delta: str) -> None:
+        nonlocal time_to_first_token_seconds
+
+        if time_to_first_token_seconds is None:
+            time_to_first_token_seconds = time.perf_counter() - start_time
+
+    response = await message_streaming.async_stream_message(
+        client,
+        on_text_delta=on_text_delta,
+        model=model,
+        messages=messages,
+        **kwargs,
+    )
+
+    return ModelAnswer(
+        model=model,
+        text="".join(x.text for x in response.content if x.type == "text"),
+        latency_seconds=time.perf_counter() - start_time,
+        time_to_first_token_seconds=time_to_first_token_seconds,
+        input_tokens=response.usage.input_tokens,
+        output_tokens=response.usage.output_tokens,
+    )
+
+
+async def race_models(
+    model_calls: dict[str, ModelCall],
+    policy: RacePolicy,
+) -> RaceResult:
+    """
+    Run every model call at once, by model name, and collect answers according to `policy`.
+
+    Failed calls don't end the race, with `FIRST_WINS` the first *successful* answer wins.
+
+    """
+
+    model_by_task: dict[asyncio.Task[ModelAnswer], str] = {
+        asyncio.create_task(model_call()): model for model, model_call in model_calls.items()
+    }
+
+    answers: list[ModelAnswer] = []
+    error_by_model: dict[str, str] = {}
+
+    pending = set(model_by_task)
+
+    while pending:
+
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+        for task in done:
+
+            if (exception := task.exception()) is not None:
+                error_by_model[model_by_task[task]] = "".join(
+                    traceback.format_exception(exception)
+                )
+                continue
+
+            answers.append(task.result())
+
+        if policy == RacePolicy.FIRST_WINS and answers:
+            break
+
+    for task in pending:
+        task.cancel()
+
+    # wait for cancellation to finish, so connections are cleaned up before returning
+    await asyncio.gather(*pending, return_exceptions=True)
+
+    # note: tasks finishing in the same wait are ordered by latency
+    answers.sort(key=lambda x: x.latency_seconds)
+
+    return RaceResult(
+        answers=answers,
+        error_by_model=error_by_model,
+        cancelled_models=[model_by_task[x] for x in pending],
+    )
+
+
+def run_race(model_calls: dict[str, ModelCall], policy: RacePolicy) -> RaceResult:
+    """
+    Run `race_models` on a new event loop, for calling from sync code.
+
+    The shared clients model calls get from `api_clients` are closed before the loop finishes,
+    since they're cached per loop and their connections can't be used from the next one.
+
+    """
+
+    async def race_and_close_clients() -> RaceResult:
+        try:
+            return await race_models(model_calls, policy=policy)
+        finally:
+            await api_clients.aclose_async_clients()
+
+    return asyncio.run(race_and_close_clients())
@@ -0,0 +1,108 @@
+"""
+Process wide pool of worker processes for CPU bound work (ex: parsing HTML), so it runs outside
+the GIL and concurrent sessions can use more than one core.
+
+Workers are started once, on first use, and reused by every session and tool call. Either whole
+tools can run in the pool (see `ExecutionMode.PROCESS_POOL`), or just their CPU heavy stages:
+
+Example:
+
+    # inside a tool, after the I/O bound part
+    page_content = process_pool.run_in_process_pool(_clean_html, page_content)
+
+Note:
+  - functions and their arguments and results are pickled, so functions must be importable
+    module level functions (not lambdas or closures)
+  - workers use the `spawn` start method, since forking a process with other threads running
+    (ex: streamlit's) can deadlock the child
+  - if tracing is enabled (see `tracing`), spans in the worker are sent back with the result and
+    added to the caller's tracer
+
+"""
+
+from typing import Any, Callable, cast
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+
+from local_claude.libs import tracing
+
+
+# leave a core for the UI and event loops
+DEFAULT_MAX_WORKERS = max((os.cpu_count() or 1) - 1, 1)
+
+_lock = threading.Lock()
+
+_process_pool: concurrent.futures.ProcessPoolExecutor | None = None
+
+
+def get_process_pool() -> concurrent.futures.ProcessPoolExecutor:
+    """Get the shared process pool, starting it if needed (or if a worker died and broke it)."""
+
+    global _process_pool
+
+    with _lock:
+
+        # note: a pool whose worker died (ex: killed by the OS) rejects all new work
+        if _process_pool is not None and getattr(_process_pool, "_broken", False):
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+            _process_pool = None
+
+        if _process_pool is None:
+            _process_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=DEFAULT_MAX_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+
+        return _process_pool
+
+
+def run_in_process_pool[
+    R
+](func: Callable[..., R], *args: Any, timeout_seconds: float | None = None, **kwargs: Any) -> R:
+    """
+    Call `func(*args, **kwargs)` in the shared process pool, blocking until it finishes.
+
+    Raises `TimeoutError` if it doesn't finish within `timeout_seconds`, in which case it's
+    cancelled if it hasn't started yet, otherwise its worker stays busy until it finishes.
+
+    """
+
+    tracer = tracing.get_current_tracer()
+
+    future: concurrent.futures.Future[Any]
+
+    if tracer is None:
+        future = get_process_pool().submit(func, *args, **kwargs)
+    else:
+        future = get_process_pool().submit(tracing.call_with_tracing, func, *args, **kwargs)
+
+    # note: the result is wrapped in a `TracedResult` if tracing
+    result: Any
+
+    try:
+        with tracing.span(f"process_pool:{func.__name__}", category="process_pool"):
+            result = future.result(timeout=timeout_seconds)
+    except TimeoutError:
+        future.cancel()
+        raise
+
+    if tracer is None:
+        return cast(R, result)
+
+    tracer.add_events(result.events)
+
+    return cast(R, result.result)
+
+
+def shutdown_process_pool() -> None:
+    """Stop the workers (ex: in tests), the next use starts a new pool."""
+
+    global _process_pool
+
+    with _lock:
+
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=True, cancel_futures=True)
+            _process_pool = None
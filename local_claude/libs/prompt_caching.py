@@ -0,0 +1,202 @@
+"""
+Functions around placing prompt caching breakpoints (`cache_control`) on requests.
+
+The cached prefix of a request is always `tools` -> `system` -> `messages`, and a breakpoint
+caches everything up to and including the block it's placed on.
+
+Since conversations are append only, every request's messages are a prefix of the next
+request's messages. We take advantage of this by rolling the message breakpoints forward
+each call, placing one on the newest message (written for the next call) and keeping ones on
+the newest messages of previous calls (read by this call).
+
+See: https://docs.anthropic.com/en/docs/build-with-claude/prompt-caching
+
+"""
+
+from typing import Any
+import dataclasses
+
+import anthropic
+
+
+# maximum number of `cache_control` blocks allowed in a single request
+MAX_CACHE_BREAKPOINTS = 4
+
+# header needed to enable prompt caching
+PROMPT_CACHING_EXTRA_HEADERS = {"anthropic-beta": "prompt-caching-2024-07-31"}
+
+_CACHE_CONTROL = {"type": "ephemeral"}
+
+# each call adds the model's response and the following user message
+_MESSAGES_ADDED_PER_CALL = 2
+
+
+@dataclasses.dataclass(frozen=True)
+class CacheBreakpointPlan:
+    """Arguments for `messages.create` with `cache_control` breakpoints placed on them."""
+
+    system: list[anthropic.types.TextBlockParam]
+    tools: list[anthropic.types.ToolParam]
+    messages: list[anthropic.types.MessageParam]
+
+
+@dataclasses.dataclass(frozen=True)
+class CacheUsage:
+    """Prompt caching related token counts for a single call."""
+
+    input_tokens: int
+    cache_read_input_tokens: int
+    cache_creation_input_tokens: int
+
+    @classmethod
+    def from_usage(cls, usage: anthropic.types.Usage) -> "CacheUsage":
+
+        # note: these are only returned when the prompt caching beta header is set,
+        #       so aren't declared fields on `Usage`
+        return cls(
+            input_tokens=usage.input_tokens,
+            cache_read_input_tokens=getattr(usage, "cache_read_input_tokens", None)
+            or 0,
+            cache_creation_input_tokens=getattr(
+                usage, "cache_creation_input_tokens", None
+            )
+            or 0,
+        )
+
+    def get_cache_hit_rate(self) -> float:
+        """Fraction of all input tokens that were read from the cache."""
+
+        total_input_tokens = (
+            self.input_tokens
+            + self.cache_read_input_tokens
+            + self.cache_creation_input_tokens
+        )
+
+        return self.cache_read_input_tokens / total_input_tokens if total_input_tokens else 0.0
+
+
+def _get_content_blocks(message: anthropic.types.MessageParam) -> list[Any]:
+
+    content = message["content"]
+
+    if isinstance(content, str):
+        return [{"type": "text", "text": content}]
+
+    return list(content)
+
+
+def _with_cache_control(
+    message: anthropic.types.MessageParam,
+    is_breakpoint: bool,
+) -> anthropic.types.MessageParam:
+    """Copy of the message with only the last block cached if `is_breakpoint`, otherwise without any."""
+
+    content_blocks = _get_content_blocks(message)
+
+    is_already_uncached = not any(
+        isinstance(x, dict) and "cache_control" in x for x in content_blocks
+    )
+
+    # avoid copying the (vast majority of) messages that don't need changes
+    if not is_breakpoint and is_already_uncached:
+        return message
+
+    content_blocks = [
+        {k: v for k, v in x.items() if k != "cache_control"} if isinstance(x, dict) else x
+        for x in content_blocks
+    ]
+
+    if is_breakpoint and content_blocks:
+        content_blocks[-1] = {**content_blocks[-1], "cache_control": _CACHE_CONTROL}
+
+    return {**message, "content": content_blocks}
+
+
+def plan_cache_breakpoints(
+    system: str,
+    tools: list[anthropic.types.ToolParam],
+    messages: list[anthropic.types.MessageParam],
+    max_breakpoints: int = MAX_CACHE_BREAKPOINTS,
+) -> CacheBreakpointPlan:
+    """
+    Place up to `max_breakpoints` breakpoints on the system prompt, tools, and newest messages.
+
+    The given arguments are never modified, changed messages are copied instead.
+
+    Example:
+
+        plan = plan_cache_breakpoints(system=system_prompt, tools=tools, messages=messages)
+
+        response = client.messages.create(
+            system=plan.system,
+            tools=plan.tools,
+            messages=plan.messages,
+            extra_headers=PROMPT_CACHING_EXTRA_HEADERS,
+            ...
+        )
+
+    """
+
+    remaining_breakpoints = max_breakpoints
+
+    planned_tools = list(tools)
+
+    # cache tools separately, so editing the system prompt doesn't invalidate them
+    if planned_tools and remaining_breakpoints > 0:
+        planned_tools[-1] = {**planned_tools[-1], "cache_control": _CACHE_CONTROL}  # type: ignore
+        remaining_breakpoints -= 1
+
+    planned_system: list[anthropic.types.TextBlockParam] = [
+        {"type": "text", "text": system}
+    ]
+
+    if remaining_breakpoints > 0:
+        planned_system[-1]["cache_control"] = _CACHE_CONTROL  # type: ignore
+        remaining_breakpoints -= 1
+
+    # the newest message, then the newest message of each previous call
+    breakpoint_indices = set(
+        range(len(messages) - 1, -1, -_MESSAGES_ADDED_PER_CALL)[:remaining_breakpoints]
+    )
+
+    planned_messages = [
+        _with_cache_control(message, is_breakpoint=index in breakpoint_indices)
+        for index, message in enumerate(messages)
+    ]
+
+    return CacheBreakpointPlan(
+        system=planned_system,
+        tools=planned_tools,
+        messages=planned_messages,
+    )
+
+
+def warm_prompt_cache(
+    client: anthropic.Anthropic,
+    model: str,
+    system: str,
+    tools: list[anthropic.types.ToolParam],
+) -> CacheUsage:
+    """
+    Write the system prompt and tools to the cache, so the first real call of a conversation can read them.
+
+    Uses a single output token, since we only care about the cache write.
+
+    """
+
+    plan = plan_cache_breakpoints(
+        system=system,
+        tools=tools,
+        messages=[],
+    )
+
+    response = client.messages.create(
+        messages=[{"role": "user", "content": "Hi"}],
+        max_tokens=1,
+        model=model,
+        system=plan.system,
+        tools=plan.tools,
+        extra_headers=PROMPT_CACHING_EXTRA_HEADERS,
+    )
+
+    return CacheUsage.from_usage(response.usage)
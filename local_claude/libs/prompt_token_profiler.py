@@ -0,0 +1,211 @@
+"""
+Reports how many tokens each tool schema, and each section of the system prompt, adds to every
+request, so it's clear what's worth trimming (see `tool_schema_variants` for trying shorter tool
+descriptions).
+
+Example:
+
+    tool_schema_token_costs = profile_tool_schemas(function_call_handler.get_schema_for_tools_arg())
+
+    system_prompt_token_profile = profile_system_prompt(system)
+
+    print(format_tool_schema_token_costs(tool_schema_token_costs))
+    print(format_system_prompt_token_profile(system_prompt_token_profile))
+
+Note:
+  - counts come from `token_accounting.TokenCounter`, which estimates by default, so they're for
+    comparing parts of the prompt with each other rather than predicting billed usage exactly
+
+"""
+
+import dataclasses
+import json
+import re
+import textwrap
+
+import anthropic
+
+from local_claude.libs import token_accounting
+
+
+# ex: `<user_info>`, a tagged block is kept together as one section
+_OPENING_TAG_PATTERN = re.compile(r"^<([A-Za-z_][\w-]*)>$")
+
+_MAX_SECTION_TITLE_LENGTH = 60
+
+
+@dataclasses.dataclass(frozen=True)
+class ToolSchemaTokenCost:
+    tool_name: str
+    description_tokens: int
+    # parameter names, types and descriptions
+    input_schema_tokens: int
+    # the whole schema as sent, including the name and JSON structure
+    total_tokens: int
+
+
+@dataclasses.dataclass(frozen=True)
+class SystemPromptSectionTokenCost:
+    # start of the section's first line
+    title: str
+    tokens: int
+
+
+@dataclasses.dataclass(frozen=True)
+class SystemPromptTokenProfile:
+    # in the order they appear
+    section_token_costs: list[SystemPromptSectionTokenCost]
+    # the whole prompt as sent, the difference from the sections is indentation and blank lines
+    total_tokens: int
+
+    def get_whitespace_tokens(self) -> int:
+        return self.total_tokens - sum(x.tokens for x in self.section_token_costs)
+
+
+def profile_tool_schemas(
+    tool_schemas: list[anthropic.types.ToolParam],
+    token_counter: token_accounting.TokenCounter | None = None,
+) -> list[ToolSchemaTokenCost]:
+    """Token cost of each tool schema, most expensive first."""
+
+    token_counter = token_counter or token_accounting.TokenCounter()
+
+    tool_schema_token_costs = [
+        ToolSchemaTokenCost(
+            tool_name=tool_schema["name"],
+            description_tokens=token_counter.count_text(tool_schema.get("description", "")),
+            input_schema_tokens=token_counter.count_text(
+                json.dumps(tool_schema["input_schema"])
+            ),
+            total_tokens=token_counter.count_text(json.dumps(tool_schema)),
+        )
+        for tool_schema in tool_schemas
+    ]
+
+    return sorted(tool_schema_token_costs, key=lambda x: x.total_tokens, reverse=True)
+
+
+def split_system_prompt_into_sections(system: str) -> list[str]:
+    """
+    Split a system prompt into paragraphs, keeping each tagged block together as one section.
+
+    Example:
+
+        Be helpful.          -> section 1
+
+        Be concise.          -> section 2
+
+        <user_info>          -> section 3 (up to and including the closing tag)
+
+        A developer.
+
+        </user_info>
+
+    """
+
+    sections: list[str] = []
+    section_lines: list[str] = []
+
+    # name of the tag whose block we're in, if any
+    open_tag: str | None = None
+
+    def end_section() -> None:
+
+        if section_lines:
+            sections.append("\n".join(section_lines).strip())
+            section_lines.clear()
+
+    for line in textwrap.dedent(system).strip().splitlines():
+
+        stripped_line = line.strip()
+
+        if open_tag is not None:
+
+            section_lines.append(line)
+
+            if stripped_line == f"</{open_tag}>":
+                end_section()
+                open_tag = None
+
+        elif (match := _OPENING_TAG_PATTERN.match(stripped_line)) is not None:
+            end_section()
+            section_lines.append(line)
+            open_tag = match.group(1)
+
+        elif not stripped_line:
+            end_section()
+
+        else:
+            section_lines.append(line)
+
+    end_section()
+
+    return sections
+
+
+def _get_section_title(section: str) -> str:
+
+    first_line = section.splitlines()[0].strip()
+
+    if len(first_line) <= _MAX_SECTION_TITLE_LENGTH:
+        return first_line
+
+    return first_line[: _MAX_SECTION_TITLE_LENGTH - 3] + "..."
+
+
+def profile_system_prompt(
+    system: str,
+    token_counter: token_accounting.TokenCounter | None = None,
+) -> SystemPromptTokenProfile:
+
+    token_counter = token_counter or token_accounting.TokenCounter()
+
+    return SystemPromptTokenProfile(
+        section_token_costs=[
+            SystemPromptSectionTokenCost(
+                title=_get_section_title(section),
+                tokens=token_counter.count_text(section),
+            )
+            for section in split_system_prompt_into_sections(system)
+        ],
+        total_tokens=token_counter.count_text(system),
+    )
+
+
+def format_tool_schema_token_costs(tool_schema_token_costs: list[ToolSchemaTokenCost]) -> str:
+    """Plain text table, for printing."""
+
+    lines = [
+        f"Tool schemas: {sum(x.total_tokens for x in tool_schema_token_costs):,} tokens",
+        "",
+        f"{'tokens':>8} {'description':>12} {'input':>8}  tool",
+    ]
+
+    lines.extend(
+        f"{x.total_tokens:>8,} {x.description_tokens:>12,} {x.input_schema_tokens:>8,}  {x.tool_name}"
+        for x in tool_schema_token_costs
+    )
+
+    return "\n".join(lines)
+
+
+def format_system_prompt_token_profile(
+    system_prompt_token_profile: SystemPromptTokenProfile,
+) -> str:
+    """Plain text table, for printing."""
+
+    lines = [
+        f"System prompt: {system_prompt_token_profile.total_tokens:,} tokens",
+        "",
+        f"{'tokens':>8}  section",
+    ]
+
+    lines.extend(
+        f"{x.tokens:>8,}  {x.title}" for x in system_prompt_token_profile.section_token_costs
+    )
+
+    lines.append(
+        f"{system_prompt_token_profile.get_whitespace_tokens():>8,}  (indentation and blank lines)"
+    )
+
+    return "\n".join(lines)
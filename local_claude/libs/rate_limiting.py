@@ -0,0 +1,318 @@
+"""
+Client side rate limiting, so concurrent sessions share quota smoothly instead of failing with 429s.
+
+The scheduler keeps token buckets for requests and tokens, synced from the rate limit headers
+each API response includes. Before each request it reserves capacity, waiting if the buckets
+are empty (or if the API told us to back off with `retry-after`).
+
+It's attached to an `httpx` client as event hooks, so callers don't need to change how they
+make calls. See `api_clients` for where this is wired up.
+
+See:
+  - https://docs.anthropic.com/en/api/rate-limits#response-headers
+  - https://platform.openai.com/docs/guides/rate-limits/rate-limits-in-headers
+
+"""
+
+from typing import Callable
+import asyncio
+import dataclasses
+import datetime
+import json
+import re
+import threading
+import time
+import weakref
+
+import httpx
+
+from local_claude.libs import telemetry
+
+
+@dataclasses.dataclass(frozen=True)
+class RateLimitHeaderNames:
+    requests_limit: str
+    requests_remaining: str
+    requests_reset: str
+    tokens_limit: str
+    tokens_remaining: str
+    tokens_reset: str
+
+
+ANTHROPIC_RATE_LIMIT_HEADER_NAMES = RateLimitHeaderNames(
+    requests_limit="anthropic-ratelimit-requests-limit",
+    requests_remaining="anthropic-ratelimit-requests-remaining",
+    requests_reset="anthropic-ratelimit-requests-reset",
+    tokens_limit="anthropic-ratelimit-tokens-limit",
+    tokens_remaining="anthropic-ratelimit-tokens-remaining",
+    tokens_reset="anthropic-ratelimit-tokens-reset",
+)
+
+OPENAI_RATE_LIMIT_HEADER_NAMES = RateLimitHeaderNames(
+    requests_limit="x-ratelimit-limit-requests",
+    requests_remaining="x-ratelimit-remaining-requests",
+    requests_reset="x-ratelimit-reset-requests",
+    tokens_limit="x-ratelimit-limit-tokens",
+    tokens_remaining="x-ratelimit-remaining-tokens",
+    tokens_reset="x-ratelimit-reset-tokens",
+)
+
+# limits are per minute for both providers
+_RATE_LIMIT_WINDOW_SECONDS = 60.0
+
+# ex: `6m0s`, `1.5s`, `20ms` (openai's format for reset durations)
+_DURATION_PART_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+_SECONDS_PER_DURATION_UNIT = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_reset_seconds(value: str, now: datetime.datetime) -> float | None:
+    """Parse a reset header, either an RFC 3339 timestamp (anthropic) or a duration (openai), into seconds from `now`."""
+
+    if parts := _DURATION_PART_PATTERN.findall(value):
+        return sum(float(x) * _SECONDS_PER_DURATION_UNIT[unit] for x, unit in parts)
+
+    try:
+        reset_time = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+    return max((reset_time - now).total_seconds(), 0.0)
+
+
+class TokenBucket:
+    """
+    Token bucket where reservations can go into debt, so waiters are served in the order they reserved.
+
+    Note:
+      - until the capacity is known (ex: before the first response), reservations never wait
+
+    """
+
+    def __init__(self) -> None:
+
+        self.capacity: float | None = None
+        self.refill_per_second: float = 0.0
+
+        self._available = 0.0
+        self._last_refill_time: float | None = None
+
+    def _refill(self, now: float) -> None:
+
+        if self.capacity is not None and self._last_refill_time is not None:
+            self._available = min(
+                self.capacity,
+                self._available
+                + (now - self._last_refill_time) * self.refill_per_second,
+            )
+
+        self._last_refill_time = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """Reserve `amount`, returning how many seconds to wait before using it."""
+
+        self._refill(now)
+
+        if self.capacity is None or self.refill_per_second <= 0.0:
+            return 0.0
+
+        self._available -= amount
+
+        if self._available >= 0.0:
+            return 0.0
+
+        return -self._available / self.refill_per_second
+
+    def sync(self, limit: float, remaining: float, now: float, in_flight: float = 0.0) -> None:
+        """Sync with the limits the API reported, given the amount reserved by requests still in flight."""
+
+        self._refill(now)
+
+        self.capacity = limit
+        self.refill_per_second = limit / _RATE_LIMIT_WINDOW_SECONDS
+
+        # the API is the source of truth, except for requests it hasn't answered yet, so those
+        # reservations are kept instead of handed out again
+        self._available = min(remaining - in_flight, limit)
+
+
+class RateLimitScheduler:
+    """
+    Shared request and token buckets for all clients of a single provider.
+
+    Example:
+
+        scheduler = RateLimitScheduler(ANTHROPIC_RATE_LIMIT_HEADER_NAMES)
+
+        http_client = httpx.Client(event_hooks=scheduler.get_event_hooks())
+
+    """
+
+    def __init__(
+        self,
+        header_names: RateLimitHeaderNames,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+
+        self._header_names = header_names
+        self._clock = clock
+
+        self._lock = threading.Lock()
+
+        self._requests_bucket = TokenBucket()
+        self._tokens_bucket = TokenBucket()
+
+        # set when the API tells us to back off
+        self._blocked_until = 0.0
+
+        # estimated tokens of each request sent but not answered yet
+        # note: weak, so a request that failed without a response stops counting once it's gone
+        self._in_flight_tokens_by_request: weakref.WeakKeyDictionary[httpx.Request, int] = (
+            weakref.WeakKeyDictionary()
+        )
+
+    def reserve(self, estimated_tokens: int) -> float:
+        """Reserve a request using `estimated_tokens`, returning how many seconds to wait before sending it."""
+
+        with self._lock:
+            now = self._clock()
+
+            return max(
+                self._blocked_until - now,
+                self._requests_bucket.reserve(1, now),
+                self._tokens_bucket.reserve(estimated_tokens, now),
+                0.0,
+            )
+
+    def update_from_response(self, response: httpx.Response) -> None:
+        """Sync buckets from the rate limit headers, and back off if rate limited."""
+
+        headers = response.headers
+        names = self._header_names
+
+        with self._lock:
+            now = self._clock()
+
+            self._in_flight_tokens_by_request.pop(response.request, None)
+
+            in_flight_requests = len(self._in_flight_tokens_by_request)
+            in_flight_tokens = sum(self._in_flight_tokens_by_request.values())
+
+            for bucket, limit_name, remaining_name, in_flight in [
+                (
+                    self._requests_bucket,
+                    names.requests_limit,
+                    names.requests_remaining,
+                    in_flight_requests,
+                ),
+                (
+                    self._tokens_bucket,
+                    names.tokens_limit,
+                    names.tokens_remaining,
+                    in_flight_tokens,
+                ),
+            ]:
+                if limit_name in headers and remaining_name in headers:
+                    bucket.sync(
+                        limit=float(headers[limit_name]),
+                        remaining=float(headers[remaining_name]),
+                        now=now,
+                        in_flight=in_flight,
+                    )
+
+            if response.status_code == 429:
+
+                retry_after_seconds = _get_retry_after_seconds(response, names)
+
+                self._blocked_until = max(self._blocked_until, now + retry_after_seconds)
+
+    def _reserve_request(self, request: httpx.Request) -> float:
+
+        estimated_tokens = _estimate_request_tokens(request)
+
+        wait_seconds = self.reserve(estimated_tokens)
+
+        with self._lock:
+            self._in_flight_tokens_by_request[request] = estimated_tokens
+
+        return wait_seconds
+
+    def before_request(self, request: httpx.Request) -> None:
+        """`httpx` request hook for sync clients."""
+
+        wait_seconds = self._reserve_request(request)
+
+        if wait_seconds > 0.0:
+            time.sleep(wait_seconds)
+
+    async def async_before_request(self, request: httpx.Request) -> None:
+        """`httpx` request hook for async clients, which waits without blocking the event loop."""
+
+        wait_seconds = self._reserve_request(request)
+
+        if wait_seconds > 0.0:
+            await asyncio.sleep(wait_seconds)
+
+    async def async_update_from_response(self, response: httpx.Response) -> None:
+        """`httpx` response hook for async clients (which require hooks to be async)."""
+
+        self.update_from_response(response)
+
+    def get_event_hooks(self) -> dict[str, list[Callable[..., None]]]:
+        return {
+            "request": [self.before_request],
+            "response": [self.update_from_response],
+        }
+
+    def get_async_event_hooks(self) -> dict[str, list[Callable[..., object]]]:
+        return {
+            "request": [self.async_before_request],
+            "response": [self.async_update_from_response],
+        }
+
+
+# used when the response doesn't say how long to back off for
+_DEFAULT_RETRY_AFTER_SECONDS = 1.0
+
+
+def _get_retry_after_seconds(
+    response: httpx.Response,
+    header_names: RateLimitHeaderNames,
+) -> float:
+
+    if "retry-after" in response.headers:
+        try:
+            return float(response.headers["retry-after"])
+        except ValueError:
+            pass
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+
+    # otherwise wait until whichever limit resets soonest
+    reset_seconds = [
+        parse_reset_seconds(response.headers[x], now=now)
+        for x in [header_names.requests_reset, header_names.tokens_reset]
+        if x in response.headers
+    ]
+
+    return min(
+        [x for x in reset_seconds if x is not None] or [_DEFAULT_RETRY_AFTER_SECONDS]
+    )
+
+
+def _estimate_request_tokens(request: httpx.Request) -> int:
+    """Estimate tokens a request will use against the token limit, its input plus max output."""
+
+    try:
+        body = json.loads(request.content)
+    except (ValueError, httpx.RequestNotRead):
+        return 0
+
+    if not isinstance(body, dict):
+        return 0
+
+    max_output_tokens = body.get("max_tokens") or body.get("max_completion_tokens") or 0
+
+    return telemetry.estimate_token_count(request.content.decode("utf-8")) + int(
+        max_output_tokens
+    )
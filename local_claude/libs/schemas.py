@@ -44,6 +44,9 @@ def generate_json_schema_for_function[
     """
     Generate the JSON schema for a python Callable.
 
+    Coroutine functions (`async def`) are supported the same way, since the schema only depends
+    on the signature and docstring.
+
     Example:
 
         def get_weather(location: str, unit: str = "celsius") -> str:
@@ -0,0 +1,224 @@
+"""
+Per call telemetry for model calls and tool calls, so we can see where the time in a turn goes.
+
+Records are kept in memory per conversation (for showing totals in the UI), and appended to a
+JSONL file (for analyzing across many conversations).
+
+"""
+
+from typing import Any
+import dataclasses
+import datetime
+import json
+import pathlib
+import threading
+
+import anthropic
+
+from local_claude.libs import prompt_caching
+
+
+DEFAULT_TELEMETRY_FILEPATH = pathlib.Path("telemetry") / "calls.jsonl"
+
+# rough average for english text, good enough for seeing which tool results dominate
+_ESTIMATED_BYTES_PER_TOKEN = 4
+
+
+def estimate_token_count(text: str) -> int:
+    """Cheap estimate of the number of tokens in `text`, without calling the API."""
+
+    return len(text.encode("utf-8")) // _ESTIMATED_BYTES_PER_TOKEN
+
+
+def _get_tool_result_text(content: Any) -> str:
+    """Text the model will see for a tool result, ignoring (base64) image data."""
+
+    if isinstance(content, str):
+        return content
+
+    return "".join(
+        block.get("text", "")
+        for block in content or []
+        if isinstance(block, dict) and block.get("type") == "text"
+    )
+
+
+def _get_timestamp() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+@dataclasses.dataclass(frozen=True)
+class ModelCallRecord:
+    conversation_id: str
+    model: str
+    latency_seconds: float
+    # note: only set for streamed calls
+    time_to_first_token_seconds: float | None
+    input_tokens: int
+    output_tokens: int
+    cache_read_input_tokens: int
+    cache_creation_input_tokens: int
+    estimated_tokens_saved_by_compaction: int = 0
+    # note: included in `output_tokens`, only reported by o1 models
+    reasoning_tokens: int = 0
+    # which tool descriptions were sent (see `tool_schema_variants`), for comparing variants
+    tool_schema_variant: str | None = None
+    timestamp: str = dataclasses.field(default_factory=_get_timestamp)
+    kind: str = "model_call"
+
+    @classmethod
+    def from_response(
+        cls,
+        conversation_id: str,
+        response: anthropic.types.Message,
+        latency_seconds: float,
+        time_to_first_token_seconds: float | None = None,
+        estimated_tokens_saved_by_compaction: int = 0,
+        tool_schema_variant: str | None = None,
+    ) -> "ModelCallRecord":
+
+        cache_usage = prompt_caching.CacheUsage.from_usage(response.usage)
+
+        return cls(
+            conversation_id=conversation_id,
+            model=response.model,
+            latency_seconds=latency_seconds,
+            time_to_first_token_seconds=time_to_first_token_seconds,
+            input_tokens=response.usage.input_tokens,
+            output_tokens=response.usage.output_tokens,
+            cache_read_input_tokens=cache_usage.cache_read_input_tokens,
+            cache_creation_input_tokens=cache_usage.cache_creation_input_tokens,
+            estimated_tokens_saved_by_compaction=estimated_tokens_saved_by_compaction,
+            tool_schema_variant=tool_schema_variant,
+        )
+
+
+@dataclasses.dataclass(frozen=True)
+class ToolCallRecord:
+    conversation_id: str
+    tool_name: str
+    tool_use_id: str
+    wall_time_seconds: float
+    is_error: bool
+    result_size_bytes: int
+    estimated_result_tokens: int
+    timestamp: str = dataclasses.field(default_factory=_get_timestamp)
+    kind: str = "tool_call"
+
+    @classmethod
+    def from_tool_result(
+        cls,
+        conversation_id: str,
+        tool_call: anthropic.types.ToolUseBlock,
+        tool_result: anthropic.types.ToolResultBlockParam,
+        wall_time_seconds: float,
+    ) -> "ToolCallRecord":
+
+        content = _get_tool_result_text(tool_result.get("content", ""))
+
+        return cls(
+            conversation_id=conversation_id,
+            tool_name=tool_call.name,
+            tool_use_id=tool_call.id,
+            wall_time_seconds=wall_time_seconds,
+            is_error=bool(tool_result.get("is_error", False)),
+            result_size_bytes=len(content.encode("utf-8")),
+            estimated_result_tokens=estimate_token_count(content),
+        )
+
+
+type TelemetryRecord = ModelCallRecord | ToolCallRecord
+
+
+@dataclasses.dataclass
+class ConversationTelemetryTotals:
+    model_calls: int = 0
+    model_latency_seconds: float = 0.0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    reasoning_tokens: int = 0
+    cache_read_input_tokens: int = 0
+    cache_creation_input_tokens: int = 0
+    estimated_tokens_saved_by_compaction: int = 0
+    tool_calls: int = 0
+    tool_errors: int = 0
+    tool_wall_time_seconds: float = 0.0
+    tool_result_bytes: int = 0
+    estimated_tool_result_tokens: int = 0
+
+
+class TelemetryRecorder:
+    """
+    Records telemetry, safe to use from multiple threads (ex: tools resolved concurrently).
+
+    Note:
+      - `filepath` can be `None` to only keep records in memory
+
+    """
+
+    def __init__(
+        self,
+        filepath: pathlib.Path | None = DEFAULT_TELEMETRY_FILEPATH,
+    ) -> None:
+
+        self._filepath = filepath
+        self._lock = threading.Lock()
+        self._records_by_conversation_id: dict[str, list[TelemetryRecord]] = {}
+
+        if self._filepath is not None:
+            self._filepath.parent.mkdir(parents=True, exist_ok=True)
+
+    def record(self, record: TelemetryRecord) -> None:
+
+        with self._lock:
+
+            self._records_by_conversation_id.setdefault(
+                record.conversation_id, []
+            ).append(record)
+
+            if self._filepath is not None:
+                with self._filepath.open("a", encoding="utf-8") as file:
+                    file.write(json.dumps(dataclasses.asdict(record)) + "\n")
+
+    def get_records(self, conversation_id: str) -> list[TelemetryRecord]:
+
+        with self._lock:
+            return list(self._records_by_conversation_id.get(conversation_id, []))
+
+    def get_totals(self, conversation_id: str) -> ConversationTelemetryTotals:
+
+        totals = ConversationTelemetryTotals()
+
+        for record in self.get_records(conversation_id):
+
+            match record:
+                case ModelCallRecord():
+                    totals.model_calls += 1
+                    totals.model_latency_seconds += record.latency_seconds
+                    totals.input_tokens += record.input_tokens
+                    totals.output_tokens += record.output_tokens
+                    totals.reasoning_tokens += record.reasoning_tokens
+                    totals.cache_read_input_tokens += record.cache_read_input_tokens
+                    totals.cache_creation_input_tokens += (
+                        record.cache_creation_input_tokens
+                    )
+                    totals.estimated_tokens_saved_by_compaction += (
+                        record.estimated_tokens_saved_by_compaction
+                    )
+                case ToolCallRecord():
+                    totals.tool_calls += 1
+                    totals.tool_errors += int(record.is_error)
+                    totals.tool_wall_time_seconds += record.wall_time_seconds
+                    totals.tool_result_bytes += record.result_size_bytes
+                    totals.estimated_tool_result_tokens += (
+                        record.estimated_result_tokens
+                    )
+
+        return totals
+
+
+def read_telemetry_file(filepath: pathlib.Path) -> list[dict[str, Any]]:
+    """Read all records from a telemetry JSONL file, for offline analysis."""
+
+    with filepath.open("r", encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
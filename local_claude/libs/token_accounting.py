@@ -0,0 +1,223 @@
+"""
+Pre-flight token accounting, so the size of a request is known before it's sent.
+
+Counts are estimates (see `telemetry.estimate_token_count`) unless a different text counter is
+given, but are consistent between calls, which is what's needed for budgeting and showing how
+much of the context window a conversation uses.
+
+Example:
+
+    # one per conversation
+    token_counter = TokenCounter()
+
+    messages_tokens = sum(token_counter.count_conversation_messages(messages))
+
+    request_token_count = token_counter.count_request(
+        system=system,
+        tools=function_call_handler.get_schema_for_tools_arg(),
+        messages_tokens=messages_tokens,
+        max_tokens=max_tokens,
+    )
+
+    if request_token_count.get_total_tokens() > DEFAULT_CONTEXT_WINDOW_TOKENS:
+        ...
+
+Note:
+  - counts of a conversation's messages are kept by index, since conversations are append only
+    (changed messages are always copies, see `context_compaction`), so as a conversation grows
+    only new messages are counted, even when its messages are loaded again (ex: from a
+    `ConversationStore` on each turn)
+
+"""
+
+from typing import Any, Callable
+import dataclasses
+import json
+import threading
+
+import anthropic
+
+from local_claude.libs import telemetry
+
+
+# context window of the claude 3 / 3.5 models
+DEFAULT_CONTEXT_WINDOW_TOKENS = 200_000
+
+# images are billed by size, this is roughly the cost of the largest image before it's downscaled
+ESTIMATED_IMAGE_TOKENS = 1_600
+
+# role and separators around each message
+_ESTIMATED_MESSAGE_OVERHEAD_TOKENS = 4
+
+
+class ContextWindowExceededError(Exception):
+    """Raised instead of sending a request which wouldn't fit in the model's context window."""
+
+
+@dataclasses.dataclass(frozen=True)
+class RequestTokenCount:
+    system_tokens: int
+    tools_tokens: int
+    messages_tokens: int
+    # reserved for the response
+    max_output_tokens: int
+
+    def get_input_tokens(self) -> int:
+        return self.system_tokens + self.tools_tokens + self.messages_tokens
+
+    def get_total_tokens(self) -> int:
+        return self.get_input_tokens() + self.max_output_tokens
+
+    def get_context_window_fraction(self, context_window_tokens: int) -> float:
+        """Fraction of the context window used, including what's reserved for the response."""
+
+        return self.get_total_tokens() / context_window_tokens
+
+
+class TokenCounter:
+    """
+    Counts tokens for the parts of a request, for a single conversation.
+
+    Safe to use from multiple threads.
+
+    Note:
+      - only counts (not messages) are kept, one int per message of the conversation
+
+    """
+
+    def __init__(
+        self,
+        count_text_tokens: Callable[[str], int] = telemetry.estimate_token_count,
+    ) -> None:
+
+        self._count_text_tokens = count_text_tokens
+
+        self._lock = threading.Lock()
+
+        # by index, for the conversation's messages counted so far
+        self._conversation_message_counts: list[int] = []
+
+        # the tool schemas are the same list for every call, so only the last one is kept
+        self._last_tools_and_count: tuple[list[anthropic.types.ToolParam], int] | None = None
+
+        # for checking memoization is effective
+        self.num_messages_counted = 0
+
+    def count_text(self, text: str) -> int:
+        return self._count_text_tokens(text)
+
+    def _count_content(self, content: Any) -> int:
+
+        if isinstance(content, str):
+            return self.count_text(content)
+
+        return sum(self._count_content_block(x) for x in content)
+
+    def _count_content_block(self, content_block: Any) -> int:
+
+        if not isinstance(content_block, dict):
+            return self.count_text(str(content_block))
+
+        match content_block.get("type"):
+            case "text":
+                return self.count_text(content_block["text"])
+            case "tool_use":
+                return self.count_text(
+                    content_block["name"] + json.dumps(content_block["input"])
+                )
+            case "tool_result":
+                return self._count_content(content_block.get("content", ""))
+            case "image":
+                # note: not the base64 data, which would wildly overestimate
+                return ESTIMATED_IMAGE_TOKENS
+            case _:
+                return self.count_text(json.dumps(content_block))
+
+    def count_message(self, message: anthropic.types.MessageParam) -> int:
+
+        count = _ESTIMATED_MESSAGE_OVERHEAD_TOKENS + self._count_content(message["content"])
+
+        with self._lock:
+            self.num_messages_counted += 1
+
+        return count
+
+    def count_messages(self, messages: list[anthropic.types.MessageParam]) -> int:
+        return sum(self.count_message(x) for x in messages)
+
+    def count_conversation_messages(
+        self,
+        messages: list[anthropic.types.MessageParam],
+    ) -> list[int]:
+        """
+        Count of each of the conversation's messages (as stored, not compacted copies).
+
+        Only messages past those counted by earlier calls are counted, since earlier messages of a
+        conversation never change.
+
+        """
+
+        with self._lock:
+            counts = self._conversation_message_counts[: len(messages)]
+
+        new_counts = [self.count_message(x) for x in messages[len(counts) :]]
+
+        with self._lock:
+            # note: only extended if no other call did in the meantime
+            if len(self._conversation_message_counts) == len(counts):
+                self._conversation_message_counts.extend(new_counts)
+
+        return counts + new_counts
+
+    def count_tools(self, tools: list[anthropic.types.ToolParam]) -> int:
+
+        with self._lock:
+            if self._last_tools_and_count is not None and self._last_tools_and_count[0] is tools:
+                return self._last_tools_and_count[1]
+
+        count = self.count_text(json.dumps(tools))
+
+        with self._lock:
+            self._last_tools_and_count = (tools, count)
+
+        return count
+
+    def count_request(
+        self,
+        system: str,
+        tools: list[anthropic.types.ToolParam],
+        messages_tokens: int,
+        max_tokens: int,
+    ) -> RequestTokenCount:
+        """
+        Count a request, given the tokens of its messages (ex: `CompactionResult.estimated_tokens_after`).
+
+        Messages are counted by the caller, since what's sent may be compacted copies of the
+        conversation's messages.
+
+        """
+
+        return RequestTokenCount(
+            system_tokens=self.count_text(system),
+            tools_tokens=self.count_tools(tools),
+            messages_tokens=messages_tokens,
+            max_output_tokens=max_tokens,
+        )
+
+
+def check_fits_in_context_window(
+    request_token_count: RequestTokenCount,
+    context_window_tokens: int = DEFAULT_CONTEXT_WINDOW_TOKENS,
+) -> None:
+    """Raise `ContextWindowExceededError` if the request (including its response) won't fit."""
+
+    if request_token_count.get_total_tokens() <= context_window_tokens:
+        return None
+
+    raise ContextWindowExceededError(
+        f"Request would use an estimated {request_token_count.get_total_tokens():,} tokens "
+        f"({request_token_count.get_input_tokens():,} input + "
+        f"{request_token_count.max_output_tokens:,} reserved for the response), which is more "
+        f"than the {context_window_tokens:,} token context window. Start a new conversation, "
+        f"or lower the context token budget so more is compacted."
+    )
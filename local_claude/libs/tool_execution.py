@@ -0,0 +1,361 @@
+"""
+Runs a tool according to its `ToolOptions.execution_mode`, enforcing its `timeout_seconds`.
+
+Example:
+
+    result = run_tool(
+        open_url_with_users_local_browser_and_get_all_content_as_html,
+        {"url": "https://example.com"},
+        tool_options.get_tool_options(open_url_with_users_local_browser_and_get_all_content_as_html),
+    )
+
+Note:
+  - `THREAD` calls get their own thread instead of sharing a pool, so a call that hangs can't
+    take a worker away from later calls
+  - `SUBPROCESS` calls use the `spawn` start method, since forking a process with other threads
+    running (ex: streamlit's) can deadlock the child, and run in their own session so killing
+    them also kills anything they started (ex: `osascript`)
+  - `PROCESS_POOL` calls share the workers started by `process_pool`, so there's no process
+    start up per call
+  - coroutine (`async def`) tools are awaited on the caller's event loop by `async_run_tool`
+    (if `INLINE`), so any number of them can wait on the network at once without holding a
+    thread, elsewhere they're run to completion with their own event loop
+  - each call is recorded as a span (see `tracing`) where the tool actually runs, and, if
+    profiling is enabled, synchronous tools are profiled where they run (so not in `SUBPROCESS`
+    or `PROCESS_POOL` workers, or coroutine tools sharing the caller's event loop), one call at
+    a time per process, so calls running alongside a profiled one aren't profiled (see
+    `tracing.profile`)
+
+"""
+
+from typing import Any, Callable
+import asyncio
+import contextvars
+import inspect
+import multiprocessing
+import multiprocessing.connection
+import os
+import pathlib
+import signal
+import threading
+import traceback
+
+from local_claude.libs import directory_utils
+from local_claude.libs import process_pool
+from local_claude.libs import tool_options
+from local_claude.libs import tracing
+
+
+class ToolExecutionError(Exception):
+    """A tool call that failed outside of the tool itself, reported to the model as structured JSON."""
+
+    def to_json_dict(self) -> dict[str, Any]:
+        return {
+            "type": type(self).__name__,
+            "message": str(self),
+        }
+
+
+class ToolTimeoutError(ToolExecutionError):
+
+    def __init__(
+        self,
+        tool_name: str,
+        timeout_seconds: float,
+        execution_mode: tool_options.ExecutionMode,
+    ) -> None:
+
+        self.tool_name = tool_name
+        self.timeout_seconds = timeout_seconds
+        self.execution_mode = execution_mode
+
+        match execution_mode:
+            case tool_options.ExecutionMode.SUBPROCESS:
+                outcome = "its process was killed"
+            case tool_options.ExecutionMode.PROCESS_POOL:
+                outcome = "it was cancelled (or abandoned, if it had already started)"
+            case _:
+                outcome = "it was abandoned"
+
+        super().__init__(
+            f"`{tool_name}` didn't finish within {timeout_seconds}s, so {outcome}. Retry with "
+            f"a smaller input, or try a different approach."
+        )
+
+    def to_json_dict(self) -> dict[str, Any]:
+        return {
+            **super().to_json_dict(),
+            "tool_name": self.tool_name,
+            "timeout_seconds": self.timeout_seconds,
+            "execution_mode": self.execution_mode.value,
+        }
+
+
+class SubprocessToolError(ToolExecutionError):
+    """Exception raised by a tool in its child process, which can't always be pickled back as is."""
+
+    def __init__(self, error_json_dict: dict[str, Any]) -> None:
+
+        self.error_json_dict = error_json_dict
+
+        super().__init__(f"{error_json_dict['type']}: {error_json_dict['message']}")
+
+    def to_json_dict(self) -> dict[str, Any]:
+        # note: the child's traceback, since that's where the tool actually failed
+        return self.error_json_dict
+
+
+def _get_tool_name(func: Callable[..., Any]) -> str:
+    return getattr(func, "__name__", repr(func))
+
+
+async def _await_tool(
+    func: Callable[..., Any],
+    function_args: dict[str, Any],
+    timeout_seconds: float | None,
+) -> Any:
+
+    try:
+        return await asyncio.wait_for(func(**function_args), timeout_seconds)
+
+    except TimeoutError:
+        raise ToolTimeoutError(
+            _get_tool_name(func),
+            timeout_seconds=timeout_seconds or 0.0,
+            execution_mode=tool_options.ExecutionMode.INLINE,
+        )
+
+
+def _call_tool(
+    func: Callable[..., Any],
+    function_args: dict[str, Any],
+    timeout_seconds: float | None = None,
+) -> Any:
+    """Call a tool from sync code, running it to completion on a new event loop if it's a coroutine function."""
+
+    tool_name = _get_tool_name(func)
+
+    with tracing.span(tool_name, category="tool"):
+
+        if inspect.iscoroutinefunction(func):
+            return asyncio.run(_await_tool(func, function_args, timeout_seconds))
+
+        with tracing.profile(tool_name):
+            return func(**function_args)
+
+
+def _run_in_thread(
+    func: Callable[..., Any],
+    function_args: dict[str, Any],
+    timeout_seconds: float | None,
+) -> Any:
+
+    outcome: dict[str, Any] = {}
+
+    def run() -> None:
+        try:
+            outcome["result"] = _call_tool(func, function_args)
+        except BaseException as e:
+            outcome["exception"] = e
+
+    # daemon, so an abandoned call doesn't keep the process alive, and with a copy of the
+    # caller's context (ex: `directory_utils.model_workspace_directory`)
+    thread = threading.Thread(
+        target=contextvars.copy_context().run,
+        args=(run,),
+        name=f"tool-{_get_tool_name(func)}",
+        daemon=True,
+    )
+    thread.start()
+    thread.join(timeout_seconds)
+
+    if thread.is_alive():
+        raise ToolTimeoutError(
+            _get_tool_name(func),
+            timeout_seconds=timeout_seconds or 0.0,
+            execution_mode=tool_options.ExecutionMode.THREAD,
+        )
+
+    if "exception" in outcome:
+        raise outcome["exception"]
+
+    return outcome["result"]
+
+
+def _subprocess_main(
+    connection: multiprocessing.connection.Connection,
+    workspace_directory: pathlib.Path,
+    func: Callable[..., Any],
+    function_args: dict[str, Any],
+) -> None:
+    """Entry point of the child process, sends back either `("result", result)` or `("error", error_json_dict)`."""
+
+    # own session (and process group), so the parent can kill everything this starts
+    if hasattr(os, "setsid"):
+        os.setsid()
+
+    try:
+        with directory_utils.model_workspace_directory(workspace_directory):
+            result = _call_tool(func, function_args)
+
+        connection.send(("result", result))
+
+    except Exception as e:
+        connection.send(
+            (
+                "error",
+                {
+                    "type": type(e).__name__,
+                    "message": str(e),
+                    "traceback": traceback.format_exc(),
+                },
+            )
+        )
+
+    finally:
+        connection.close()
+
+
+def _kill_process_tree(process: multiprocessing.process.BaseProcess) -> None:
+
+    assert process.pid is not None
+
+    try:
+        if hasattr(os, "killpg"):
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        # already exited
+        pass
+
+    process.join()
+
+
+def _run_in_subprocess(
+    func: Callable[..., Any],
+    function_args: dict[str, Any],
+    timeout_seconds: float | None,
+) -> Any:
+
+    context = multiprocessing.get_context("spawn")
+
+    receiver, sender = context.Pipe(duplex=False)
+
+    process = context.Process(
+        target=_subprocess_main,
+        args=(
+            sender,
+            # note: context variables don't carry over to the child, so pass the workspace explicitly
+            directory_utils.get_current_model_workspace_directory(),
+            func,
+            function_args,
+        ),
+        name=f"tool-{_get_tool_name(func)}",
+        daemon=True,
+    )
+    process.start()
+
+    # close our copy of the sending end, so we see EOF if the child dies without sending anything
+    sender.close()
+
+    try:
+        if not receiver.poll(timeout_seconds):
+            raise ToolTimeoutError(
+                _get_tool_name(func),
+                timeout_seconds=timeout_seconds or 0.0,
+                execution_mode=tool_options.ExecutionMode.SUBPROCESS,
+            )
+
+        try:
+            status, payload = receiver.recv()
+        except EOFError:
+            process.join()
+            raise ToolExecutionError(
+                f"`{_get_tool_name(func)}` exited with code {process.exitcode} without a result"
+            )
+
+    finally:
+        receiver.close()
+
+        # note: the tool has finished (or timed out) either way, so this only cleans up
+        _kill_process_tree(process)
+
+    if status == "error":
+        raise SubprocessToolError(payload)
+
+    return payload
+
+
+def _call_in_workspace(
+    workspace_directory: pathlib.Path,
+    func: Callable[..., Any],
+    function_args: dict[str, Any],
+) -> Any:
+    """Runs in a pool worker, which doesn't have the caller's context variables."""
+
+    with directory_utils.model_workspace_directory(workspace_directory):
+        return _call_tool(func, function_args)
+
+
+def _run_in_process_pool(
+    func: Callable[..., Any],
+    function_args: dict[str, Any],
+    timeout_seconds: float | None,
+) -> Any:
+
+    try:
+        return process_pool.run_in_process_pool(
+            _call_in_workspace,
+            directory_utils.get_current_model_workspace_directory(),
+            func,
+            function_args,
+            timeout_seconds=timeout_seconds,
+        )
+    except TimeoutError:
+        raise ToolTimeoutError(
+            _get_tool_name(func),
+            timeout_seconds=timeout_seconds or 0.0,
+            execution_mode=tool_options.ExecutionMode.PROCESS_POOL,
+        )
+
+
+def run_tool(
+    func: Callable[..., Any],
+    function_args: dict[str, Any],
+    options: tool_options.ToolOptions,
+) -> Any:
+    """Call `func(**function_args)` in the way `options` asks for, raising `ToolTimeoutError` if it takes too long."""
+
+    match options.execution_mode:
+        case tool_options.ExecutionMode.INLINE:
+            # note: only coroutine tools can time out inline, see `ToolOptions.timeout_seconds`
+            return _call_tool(func, function_args, options.timeout_seconds)
+        case tool_options.ExecutionMode.THREAD:
+            return _run_in_thread(func, function_args, options.timeout_seconds)
+        case tool_options.ExecutionMode.SUBPROCESS:
+            # note: spans in the child aren't sent back, so this covers the whole process
+            with tracing.span(f"subprocess:{_get_tool_name(func)}", category="subprocess"):
+                return _run_in_subprocess(func, function_args, options.timeout_seconds)
+        case tool_options.ExecutionMode.PROCESS_POOL:
+            return _run_in_process_pool(func, function_args, options.timeout_seconds)
+
+
+async def async_run_tool(
+    func: Callable[..., Any],
+    function_args: dict[str, Any],
+    options: tool_options.ToolOptions,
+) -> Any:
+    """
+    Equivalent to `run_tool`, but without blocking the running event loop.
+
+    `INLINE` coroutine tools are awaited on the loop, everything else is run from the loop's default thread pool.
+
+    """
+
+    if options.execution_mode == tool_options.ExecutionMode.INLINE and inspect.iscoroutinefunction(func):
+        with tracing.span(_get_tool_name(func), category="tool"):
+            return await _await_tool(func, function_args, options.timeout_seconds)
+
+    # note: `to_thread` runs with a copy of the current context (ex: the model workspace)
+    return await asyncio.to_thread(run_tool, func, function_args, options)
@@ -0,0 +1,84 @@
+"""
+Validates tool call inputs against each tool's generated schema before the tool runs.
+
+Without this, bad inputs (ex: a missing argument, or a string where an int is expected) only fail
+deep inside the tool, sometimes after expensive work (ex: launching Safari), and with an error
+that doesn't say what to change.
+
+Example:
+
+    validate_input = compile_tool_input_validator(schemas.generate_json_schema_for_function(func))
+
+    # raises `ToolInputValidationError` if invalid
+    validate_input(tool_call.input)
+
+Note:
+  - validators are compiled with `fastjsonschema` (into python code), which takes milliseconds,
+    so they're cached by schema, after which validating takes microseconds
+
+"""
+
+from typing import Any, Callable, cast
+import functools
+import json
+
+import anthropic
+import fastjsonschema  # type: ignore[import-untyped]
+
+from local_claude.libs import tool_execution
+
+
+class ToolInputValidationError(tool_execution.ToolExecutionError):
+
+    def __init__(self, tool_name: str, message: str, input_schema: dict[str, Any]) -> None:
+
+        self.tool_name = tool_name
+        self.input_schema = input_schema
+
+        super().__init__(f"Invalid input for `{tool_name}`: {message}")
+
+    def to_json_dict(self) -> dict[str, Any]:
+        # note: includes the schema, so the model can fix the call without re-reading the tool definition
+        return {
+            **super().to_json_dict(),
+            "tool_name": self.tool_name,
+            "input_schema": self.input_schema,
+        }
+
+
+# raises `ToolInputValidationError` if the input is invalid
+type ToolInputValidator = Callable[[Any], None]
+
+
+@functools.lru_cache(maxsize=None)
+def _compile_validation_function(input_schema_json: str) -> Callable[[Any], Any]:
+    """Compile once per distinct schema, since handlers are often recreated (ex: every streamlit rerun)."""
+
+    return cast(Callable[[Any], Any], fastjsonschema.compile(json.loads(input_schema_json)))
+
+
+def compile_tool_input_validator(tool_schema: anthropic.types.ToolParam) -> ToolInputValidator:
+
+    tool_name = tool_schema["name"]
+    input_schema = dict(tool_schema["input_schema"])
+
+    validation_function = _compile_validation_function(
+        json.dumps(
+            # note: only when validating, unknown arguments would otherwise fail when calling the function
+            {**input_schema, "additionalProperties": False},
+            sort_keys=True,
+        )
+    )
+
+    def validate_input(tool_input: Any) -> None:
+
+        try:
+            validation_function(tool_input)
+
+        except fastjsonschema.JsonSchemaValueException as e:
+            # ex: `data.bar must be integer` -> `input.bar must be integer`
+            message = "input" + e.message.removeprefix("data")
+
+            raise ToolInputValidationError(tool_name, message, input_schema) from None
+
+    return validate_input
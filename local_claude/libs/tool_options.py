@@ -0,0 +1,98 @@
+"""Per tool options that `FunctionCallHandler` uses to decide how to execute a tool."""
+
+from typing import Callable, Any
+import dataclasses
+import enum
+import inspect
+
+
+class ExecutionMode(enum.Enum):
+    """Where `FunctionCallHandler` runs a tool, see `tool_execution`."""
+
+    # directly in the calling thread, cheapest but a timeout can't be enforced
+    INLINE = "inline"
+    # in a dedicated worker thread, a call that times out is abandoned (python threads can't be
+    # killed) but no longer blocks the caller
+    THREAD = "thread"
+    # in a child process, which is killed (along with anything it started) on timeout, for tools
+    # that can hang (ex: AppleScript), arguments and results must be picklable
+    SUBPROCESS = "subprocess"
+    # in the shared pool of worker processes (see `process_pool`), for CPU bound tools, which
+    # avoids starting a process per call but can't kill a call that times out
+    PROCESS_POOL = "process_pool"
+
+
+@dataclasses.dataclass(frozen=True)
+class ToolOptions:
+    # whether this tool can run at the same time as other tools, tools which share
+    # mutable workspace state (ex: writing files) should set this to `False`
+    is_parallel_safe: bool = True
+
+    # whether this tool can be started speculatively, as soon as its input has streamed and
+    # before the model finishes the rest of its response, which means it may run even if that
+    # response is then abandoned (ex: the stream errors), so only for tools where that's
+    # harmless (ex: searches and fetches)
+    is_side_effect_safe: bool = False
+
+    # if set, results are memoized for this long, for tools where repeating a call with the same
+    # arguments would return the same thing (see `tool_result_cache`), and which have no side
+    # effects (ex: writing files), since a cached result skips the call
+    cache_ttl_seconds: float | None = None
+
+    execution_mode: ExecutionMode = ExecutionMode.INLINE
+
+    # if set, calls taking longer than this return a timeout error to the model instead, which
+    # needs an execution mode other than `INLINE` (unless the tool is a coroutine function, which
+    # can be cancelled)
+    timeout_seconds: float | None = None
+
+
+_TOOL_OPTIONS_ATTRIBUTE = "__tool_options__"
+
+
+def tool_options[
+    F: Callable[..., Any]
+](**kwargs: Any) -> Callable[[F], F]:
+    """
+    Decorator to declare `ToolOptions` for a tool, any options not given use the defaults.
+
+    Example:
+
+        @tool_options(is_parallel_safe=False)
+        def save_content_to_persistent_file_in_workspace(filename: str, content: str) -> None:
+            ...
+
+    """
+
+    options = ToolOptions(**kwargs)
+
+    def decorator(func: F) -> F:
+
+        if (
+            options.timeout_seconds is not None
+            and options.execution_mode == ExecutionMode.INLINE
+            and not inspect.iscoroutinefunction(func)
+        ):
+            raise ValueError(
+                f"`timeout_seconds` can't be enforced for `{func.__name__}`, since it isn't a "
+                f"coroutine function, use `ExecutionMode.THREAD` or `ExecutionMode.SUBPROCESS`"
+            )
+
+        set_tool_options(func, options)
+        return func
+
+    return decorator
+
+
+def set_tool_options(func: Callable[..., Any], options: ToolOptions) -> None:
+    """Declare `ToolOptions` for a tool without the decorator (ex: for a tool that's loaded lazily)."""
+
+    setattr(func, _TOOL_OPTIONS_ATTRIBUTE, options)
+
+
+def get_tool_options(func: Callable[..., Any]) -> ToolOptions:
+    """Get the options declared for a tool, or the defaults if it didn't declare any."""
+
+    options: ToolOptions = getattr(func, _TOOL_OPTIONS_ATTRIBUTE, ToolOptions())
+
+    return options
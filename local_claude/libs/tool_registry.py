@@ -0,0 +1,277 @@
+"""
+Registry of tools by reference (`"<module>:<function>"`), which knows each tool's name, schema and
+options up front, but only imports a tool's module the first time the tool is called.
+
+Some tool modules are slow to import (ex: `serpapi` and `bs4`), and generating schemas (with
+`inspect` and `docstring_parser`) isn't free either, so neither should happen on every start up
+of the page, let alone every rerun.
+
+Example:
+
+    registry = ToolRegistry(
+        ["local_claude.libs.tools.google_search:search_google_and_return_list_of_results"]
+    )
+
+    # the tools stand in for the functions, until they're first called
+    function_call_handler = FunctionCallHandler(functions=registry.get_tools())
+
+Note:
+  - schemas and options are cached in a JSON file, keyed by the size and modification time of
+    each tool's module file (and of `schemas`, which generates them), so only tools whose module
+    changed are imported when the registry is created
+  - a tool whose schema depends on another module (ex: a docstring built from a constant) won't
+    see changes to that module until its own module changes, or the cache is deleted
+
+"""
+
+from typing import Any, Callable
+import dataclasses
+import importlib
+import importlib.util
+import json
+import os
+import pathlib
+import threading
+
+import anthropic
+
+from local_claude.libs import schemas
+from local_claude.libs import tool_options
+
+
+DEFAULT_SCHEMA_CACHE_FILEPATH = pathlib.Path("tool_registry") / "tool_schemas.json"
+
+# bump when the cache's structure changes, so older caches are ignored
+_CACHE_FORMAT_VERSION = 1
+
+
+class LazyTool:
+    """
+    Stands in for a tool function, importing it the first time it's called (or loaded).
+
+    Has the tool's `__name__` and `ToolOptions` (see `tool_options.get_tool_options`), so it can be
+    given to `FunctionCallHandler` in place of the function.
+
+    """
+
+    def __init__(
+        self,
+        tool_reference: str,
+        tool_schema: anthropic.types.ToolParam,
+        options: tool_options.ToolOptions,
+    ) -> None:
+
+        self.tool_reference = tool_reference
+        self.tool_schema = tool_schema
+
+        self.__name__ = tool_schema["name"]
+
+        tool_options.set_tool_options(self, options)
+
+        self._lock = threading.Lock()
+        self._func: Callable[..., Any] | None = None
+
+    def is_loaded(self) -> bool:
+        return self._func is not None
+
+    def load(self) -> Callable[..., Any]:
+        """Get the tool function, importing its module if this is the first use."""
+
+        with self._lock:
+
+            if self._func is None:
+                self._func = _import_tool(self.tool_reference)
+
+            return self._func
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        return self.load()(*args, **kwargs)
+
+    def __repr__(self) -> str:
+        return f"LazyTool({self.tool_reference!r}, is_loaded={self.is_loaded()})"
+
+
+def get_tool_schema(func: Callable[..., Any]) -> anthropic.types.ToolParam:
+    """Schema for a tool, which for a `LazyTool` is known without importing it."""
+
+    if isinstance(func, LazyTool):
+        return func.tool_schema
+
+    return schemas.generate_json_schema_for_function(func)
+
+
+def load_tool(func: Callable[..., Any]) -> Callable[..., Any]:
+    """The function to actually call for a tool, importing it if it's a `LazyTool`."""
+
+    if isinstance(func, LazyTool):
+        return func.load()
+
+    return func
+
+
+def _import_tool(tool_reference: str) -> Callable[..., Any]:
+
+    module_name, _, function_name = tool_reference.partition(":")
+
+    func: Callable[..., Any] = getattr(importlib.import_module(module_name), function_name)
+
+    return func
+
+
+def _get_source_stamp(module_name: str) -> list[int]:
+    """Modification time and size of a module's file, found without importing the module itself."""
+
+    spec = importlib.util.find_spec(module_name)
+
+    if spec is None or spec.origin is None:
+        raise ModuleNotFoundError(f"No source file found for module `{module_name}`")
+
+    stat = os.stat(spec.origin)
+
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _tool_options_to_json_dict(options: tool_options.ToolOptions) -> dict[str, Any]:
+    return {**dataclasses.asdict(options), "execution_mode": options.execution_mode.value}
+
+
+def _tool_options_from_json_dict(json_dict: dict[str, Any]) -> tool_options.ToolOptions:
+    return tool_options.ToolOptions(
+        **{
+            **json_dict,
+            "execution_mode": tool_options.ExecutionMode(json_dict["execution_mode"]),
+        }
+    )
+
+
+class ToolRegistry:
+    """
+    Tools by reference, with schemas and options read from the cache where it's up to date.
+
+    Create once per process (ex: see `default_tools.get_default_tool_registry`), since each
+    `LazyTool` only imports its function once.
+
+    """
+
+    def __init__(
+        self,
+        tool_references: list[str],
+        schema_cache_filepath: pathlib.Path | None = DEFAULT_SCHEMA_CACHE_FILEPATH,
+    ) -> None:
+
+        self._schema_cache_filepath = schema_cache_filepath
+
+        # for checking the cache is effective
+        self.num_tools_imported_for_schemas = 0
+
+        self._tools = self._create_tools(tool_references)
+
+    def get_tools(self) -> list[LazyTool]:
+        return list(self._tools)
+
+    def _read_cache_entry_by_tool_reference(
+        self,
+        schemas_source_stamp: list[int],
+    ) -> dict[str, dict[str, Any]]:
+
+        if self._schema_cache_filepath is None or not self._schema_cache_filepath.exists():
+            return {}
+
+        try:
+            cache = json.loads(self._schema_cache_filepath.read_text(encoding="utf-8"))
+        except json.JSONDecodeError:
+            # ex: a partial write from an older version, just rebuild it
+            return {}
+
+        # note: a change to how schemas are generated could change any of them
+        if (
+            cache.get("format_version") != _CACHE_FORMAT_VERSION
+            or cache.get("schemas_source_stamp") != schemas_source_stamp
+        ):
+            return {}
+
+        cache_entry_by_tool_reference: dict[str, dict[str, Any]] = cache["tools"]
+
+        return cache_entry_by_tool_reference
+
+    def _write_cache(
+        self,
+        schemas_source_stamp: list[int],
+        cache_entry_by_tool_reference: dict[str, dict[str, Any]],
+    ) -> None:
+
+        if self._schema_cache_filepath is None:
+            return None
+
+        self._schema_cache_filepath.parent.mkdir(parents=True, exist_ok=True)
+
+        # write then rename, so a concurrent reader never sees a partial file
+        temporary_filepath = self._schema_cache_filepath.with_name(
+            f"{self._schema_cache_filepath.name}.{os.getpid()}.tmp"
+        )
+
+        temporary_filepath.write_text(
+            json.dumps(
+                {
+                    "format_version": _CACHE_FORMAT_VERSION,
+                    "schemas_source_stamp": schemas_source_stamp,
+                    "tools": cache_entry_by_tool_reference,
+                },
+                indent=2,
+            ),
+            encoding="utf-8",
+        )
+
+        os.replace(temporary_filepath, self._schema_cache_filepath)
+
+        return None
+
+    def _create_tools(self, tool_references: list[str]) -> list[LazyTool]:
+
+        schemas_source_stamp = _get_source_stamp(schemas.__name__)
+
+        cache_entry_by_tool_reference = self._read_cache_entry_by_tool_reference(
+            schemas_source_stamp
+        )
+
+        is_cache_changed = False
+
+        tools: list[LazyTool] = []
+
+        for tool_reference in tool_references:
+
+            module_name, _, _ = tool_reference.partition(":")
+
+            source_stamp = _get_source_stamp(module_name)
+
+            cache_entry = cache_entry_by_tool_reference.get(tool_reference)
+
+            if cache_entry is None or cache_entry["source_stamp"] != source_stamp:
+
+                func = _import_tool(tool_reference)
+
+                self.num_tools_imported_for_schemas += 1
+
+                cache_entry = {
+                    "source_stamp": source_stamp,
+                    "tool_schema": schemas.generate_json_schema_for_function(func),
+                    "tool_options": _tool_options_to_json_dict(
+                        tool_options.get_tool_options(func)
+                    ),
+                }
+
+                cache_entry_by_tool_reference[tool_reference] = cache_entry
+                is_cache_changed = True
+
+            tools.append(
+                LazyTool(
+                    tool_reference=tool_reference,
+                    tool_schema=cache_entry["tool_schema"],
+                    options=_tool_options_from_json_dict(cache_entry["tool_options"]),
+                )
+            )
+
+        if is_cache_changed:
+            self._write_cache(schemas_source_stamp, cache_entry_by_tool_reference)
+
+        return tools
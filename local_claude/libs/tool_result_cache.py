@@ -0,0 +1,240 @@
+"""
+Memoizes tool results, so repeated calls (ex: the same search query) don't re-run the tool.
+
+Only tools that declare a `cache_ttl_seconds` (see `tool_options.ToolOptions`) are cached, keyed by
+tool name plus canonicalized arguments and the model workspace the call ran in. Entries live in a
+size bounded in memory LRU, optionally backed by a persistent store so results survive restarts.
+
+Example:
+
+    cache = ToolResultCache(persistent_store=SqliteToolResultStore(DEFAULT_PERSISTENT_STORE_FILEPATH))
+
+    function_call_handler = FunctionCallHandler(functions=..., tool_result_cache=cache)
+
+"""
+
+from typing import Any, Callable
+import collections
+import dataclasses
+import hashlib
+import json
+import pathlib
+import sqlite3
+import threading
+import time
+
+
+DEFAULT_PERSISTENT_STORE_FILEPATH = pathlib.Path("tool_result_cache") / "tool_results.sqlite3"
+
+
+def make_cache_key(
+    tool_name: str,
+    tool_input: dict[str, Any],
+    workspace_directory: pathlib.Path | None = None,
+) -> str:
+    """
+    Key for a tool call, the same regardless of argument order or formatting.
+
+    Calls in different model workspaces get different keys, since a tool's result may depend on
+    (or describe) what's in its workspace.
+
+    """
+
+    canonical_input = json.dumps(
+        {
+            "input": tool_input,
+            "workspace_directory": (
+                None if workspace_directory is None else str(workspace_directory.resolve())
+            ),
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+
+    input_hash = hashlib.sha256(canonical_input.encode("utf-8")).hexdigest()
+
+    return f"{tool_name}:{input_hash}"
+
+
+@dataclasses.dataclass(frozen=True)
+class ToolResultCacheStats:
+    hits: int
+    misses: int
+    evictions: int
+    num_entries: int
+
+    def get_hit_rate(self) -> float:
+
+        num_lookups = self.hits + self.misses
+
+        if not num_lookups:
+            return 0.0
+
+        return self.hits / num_lookups
+
+
+@dataclasses.dataclass(frozen=True)
+class _CacheEntry:
+    content: str
+    # wall clock time (seconds since epoch), so it's meaningful across restarts
+    expires_at: float
+
+
+class SqliteToolResultStore:
+    """
+    Persistent store for cached tool results, as a single SQLite file.
+
+    Safe to use from multiple threads.
+
+    """
+
+    def __init__(self, filepath: pathlib.Path) -> None:
+
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+
+        # note: access is serialized by `_lock`, so sharing the connection across threads is fine
+        self._connection = sqlite3.connect(filepath, check_same_thread=False)
+
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS tool_results "
+                "(key TEXT PRIMARY KEY, content TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def get(self, key: str, now: float) -> tuple[str, float] | None:
+        """Get the content and expiry time for `key`, if it hasn't expired."""
+
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT content, expires_at FROM tool_results WHERE key = ? AND expires_at > ?",
+                (key, now),
+            ).fetchone()
+
+        return None if row is None else (str(row[0]), float(row[1]))
+
+    def put(self, key: str, content: str, expires_at: float) -> None:
+
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO tool_results (key, content, expires_at) VALUES (?, ?, ?)",
+                (key, content, expires_at),
+            )
+
+    def delete_expired(self, now: float) -> None:
+
+        with self._lock, self._connection:
+            self._connection.execute(
+                "DELETE FROM tool_results WHERE expires_at <= ?",
+                (now,),
+            )
+
+
+class ToolResultCache:
+    """
+    Size bounded LRU of tool results, each expiring after its tool's TTL.
+
+    Safe to use from multiple threads (ex: `FunctionCallHandler.resolve_many`).
+
+    Note:
+      - two concurrent misses for the same key will both run the tool, which is fine since
+        cached tools must be safe to re-run anyway
+
+    """
+
+    DEFAULT_MAX_ENTRIES = 256
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        persistent_store: SqliteToolResultStore | None = None,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+
+        self._max_entries = max_entries
+        self._persistent_store = persistent_store
+        self._clock = clock
+
+        self._lock = threading.Lock()
+
+        # least recently used first
+        self._entries: collections.OrderedDict[str, _CacheEntry] = collections.OrderedDict()
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+        if self._persistent_store is not None:
+            self._persistent_store.delete_expired(now=self._clock())
+
+    def get(self, key: str) -> str | None:
+        """Get the cached result for `key`, or `None` (counted as a miss) if missing or expired."""
+
+        now = self._clock()
+
+        with self._lock:
+
+            entry = self._entries.get(key)
+
+            if entry is not None and entry.expires_at <= now:
+                del self._entries[key]
+                entry = None
+
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry.content
+
+        # note: outside the lock since it's IO, the store has its own lock
+        stored = (
+            self._persistent_store.get(key, now=now)
+            if self._persistent_store is not None
+            else None
+        )
+
+        with self._lock:
+
+            if stored is None:
+                self._misses += 1
+                return None
+
+            content, expires_at = stored
+
+            # keep it in memory, so the next lookup doesn't need the store
+            self._add_entry(key, _CacheEntry(content=content, expires_at=expires_at))
+
+            self._hits += 1
+
+        return content
+
+    def _add_entry(self, key: str, entry: _CacheEntry) -> None:
+        """Add an entry, evicting the least recently used if over the limit. Must hold `_lock`."""
+
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def put(self, key: str, content: str, ttl_seconds: float) -> None:
+
+        expires_at = self._clock() + ttl_seconds
+
+        with self._lock:
+            self._add_entry(key, _CacheEntry(content=content, expires_at=expires_at))
+
+        if self._persistent_store is not None:
+            self._persistent_store.put(key, content=content, expires_at=expires_at)
+
+    def get_stats(self) -> ToolResultCacheStats:
+
+        with self._lock:
+            return ToolResultCacheStats(
+                hits=self._hits,
+                misses=self._misses,
+                evictions=self._evictions,
+                num_entries=len(self._entries),
+            )
@@ -0,0 +1,77 @@
+"""
+Alternate (compact) descriptions for tool schemas, selected by a setting, so shorter schemas can be
+A/B tested for input cost and latency without editing the tools' docstrings.
+
+Example:
+
+    function_call_handler = FunctionCallHandler(
+        functions=tools,
+        tool_schema_variant=ToolSchemaVariant.COMPACT,
+        compact_tool_descriptions={
+            "execute_bash_command": CompactToolDescription("Run a bash command, returning its output."),
+        },
+    )
+
+Note:
+  - only descriptions change, never names or types, so calls are validated and resolved the same
+    way under every variant
+  - tools without a compact description keep their full one
+
+"""
+
+from typing import Any, cast
+import copy
+import dataclasses
+import enum
+
+import anthropic
+
+
+class ToolSchemaVariant(enum.Enum):
+    # descriptions generated from the tools' docstrings
+    FULL = "full"
+    # compact descriptions, for tools that have one
+    COMPACT = "compact"
+
+
+@dataclasses.dataclass(frozen=True)
+class CompactToolDescription:
+    description: str
+    # by parameter name, parameters not given keep their full description
+    parameter_descriptions: dict[str, str] = dataclasses.field(default_factory=dict)
+
+
+def apply_tool_schema_variant(
+    tool_schema: anthropic.types.ToolParam,
+    tool_schema_variant: ToolSchemaVariant,
+    compact_tool_descriptions: dict[str, CompactToolDescription],
+) -> anthropic.types.ToolParam:
+    """Get the schema to send for a tool under the given variant, the original is never modified."""
+
+    if tool_schema_variant == ToolSchemaVariant.FULL:
+        return tool_schema
+
+    compact_tool_description = compact_tool_descriptions.get(tool_schema["name"])
+
+    if compact_tool_description is None:
+        return tool_schema
+
+    # note: deep copy, since the full schema may be shared (ex: by `tool_registry.LazyTool`)
+    compact_tool_schema = copy.deepcopy(tool_schema)
+
+    compact_tool_schema["description"] = compact_tool_description.description
+
+    input_schema = cast(dict[str, Any], compact_tool_schema["input_schema"])
+    properties: dict[str, Any] = input_schema.get("properties", {})
+
+    for parameter_name, description in compact_tool_description.parameter_descriptions.items():
+
+        if parameter_name not in properties:
+            raise ValueError(
+                f"Compact description for `{tool_schema['name']}` describes unknown "
+                f"parameter `{parameter_name}`"
+            )
+
+        properties[parameter_name]["description"] = description
+
+    return compact_tool_schema
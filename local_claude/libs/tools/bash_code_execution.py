@@ -5,6 +5,7 @@ import os
 import pathlib
 
 from local_claude.libs import directory_utils
+from local_claude.libs.tool_options import ExecutionMode, tool_options
 
 
 @dataclasses.dataclass(frozen=True)
@@ -18,6 +19,14 @@ class BashCommandResult:
 #                since that's a generic way for function handler to communicate to claude that there
 #                was an error.
 # TODO(bschoen): Common higher level abstraction args like `timeout_in_seconds` are really a property of the workspace, but do I want a shared class here with them?`
+# note: in a subprocess, since `subprocess.run`'s own timeout only kills the shell, and anything
+#       it started that holds the output pipe open (ex: `sleep 1000 | cat`) would hang the call,
+#       whereas the handler kills the whole process group
+@tool_options(
+    is_parallel_safe=False,
+    execution_mode=ExecutionMode.SUBPROCESS,
+    timeout_seconds=90.0,
+)
 def execute_bash_command(command: str) -> str:
     """A tool that executes a bash command in a persistent bash shell and returns the output.
 
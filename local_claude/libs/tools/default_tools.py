@@ -0,0 +1,90 @@
+"""
+Tools given to the model by default, shared by the streamlit page and the batch runner.
+
+Tools are listed by reference rather than imported, so their modules (some of which are slow to
+import, ex: `serpapi`) are only imported once a tool is actually called (see `tool_registry`).
+
+"""
+
+import threading
+
+from local_claude.libs import tool_registry
+from local_claude.libs.tool_schema_variants import CompactToolDescription
+
+
+DEFAULT_TOOL_REFERENCES: list[str] = [
+    "local_claude.libs.tools.save_to_workspace_file:read_file_from_persistent_workspace",
+    "local_claude.libs.tools.save_to_workspace_file:save_content_to_persistent_file_in_workspace",
+    "local_claude.libs.tools.bash_code_execution:execute_bash_command",
+    "local_claude.libs.tools.python_code_execution:execute_python_code_and_write_python_code_to_file",
+    "local_claude.libs.tools.google_search:search_google_and_return_list_of_results",
+    "local_claude.libs.tools.visit_url_using_user_browser:open_url_with_users_local_browser_and_get_all_content_as_html",
+]
+
+# shorter descriptions for `ToolSchemaVariant.COMPACT`, kept here (rather than in the tools) so
+# they can be compared against the docstrings without changing the tools
+DEFAULT_COMPACT_TOOL_DESCRIPTIONS: dict[str, CompactToolDescription] = {
+    "read_file_from_persistent_workspace": CompactToolDescription(
+        description="Read a file from the workspace as text.",
+        parameter_descriptions={"filename": "Filename in the workspace (not a path)."},
+    ),
+    "save_content_to_persistent_file_in_workspace": CompactToolDescription(
+        description=(
+            "Save content to a file in the workspace, which all tools share for the whole "
+            "conversation (ex: to pass data to python or bash). Pass the actual content, never "
+            "a placeholder."
+        ),
+    ),
+    "execute_bash_command": CompactToolDescription(
+        description=(
+            "Run a command in a persistent bash shell (state, like the working directory, is kept "
+            "between calls). Returns JSON with `command`, `exit_code` and `output`."
+        ),
+    ),
+    "execute_python_code_and_write_python_code_to_file": CompactToolDescription(
+        description=(
+            "Write python code to a file in the workspace and run it, returning stdout and "
+            "stderr. `print` anything you need returned."
+        ),
+        parameter_descriptions={
+            "python_code_to_execute": "Python code to run.",
+            "filename_for_given_python_code": "Filename to write the code to before running it.",
+        },
+    ),
+    "search_google_and_return_list_of_results": CompactToolDescription(
+        description=(
+            "Search Google, returning the first page of results (`position`, `title`, `link`, "
+            "`snippet`, `source`, etc). Use "
+            "`open_url_with_users_local_browser_and_get_all_content_as_html` on a result's "
+            "`link` to read it."
+        ),
+        parameter_descriptions={"search_query": "Google search query."},
+    ),
+    "open_url_with_users_local_browser_and_get_all_content_as_html": CompactToolDescription(
+        description=(
+            "Open a URL in the user's browser and return the page's HTML (without scripts, "
+            "styles, or comments), also saved to `output_filepath` in the workspace."
+        ),
+        parameter_descriptions={
+            "url": "URL to open.",
+            "output_filepath": "Filename to save the HTML to.",
+        },
+    ),
+}
+
+_lock = threading.Lock()
+
+_default_tool_registry: tool_registry.ToolRegistry | None = None
+
+
+def get_default_tool_registry() -> tool_registry.ToolRegistry:
+    """Get the registry of default tools, created once per process."""
+
+    global _default_tool_registry
+
+    with _lock:
+
+        if _default_tool_registry is None:
+            _default_tool_registry = tool_registry.ToolRegistry(DEFAULT_TOOL_REFERENCES)
+
+        return _default_tool_registry
@@ -4,6 +4,8 @@ import dataclasses
 
 import serpapi
 
+from local_claude.libs.tool_options import ExecutionMode, tool_options
+
 
 @dataclasses.dataclass(frozen=True)
 class SearchResult:
@@ -57,6 +59,13 @@ class SearchResult:
 # TODO(bschoen): Mention in description that often used with visit url in browser tool
 # TODO(bschoen): We can actually return a list to claude, but it has to be a content block thing
 # TODO(bschoen): We can return images here, so can give it screenshots?
+# note: in a thread, so a stalled request to serpapi can't hold up the turn
+@tool_options(
+    is_side_effect_safe=True,
+    cache_ttl_seconds=60 * 60,
+    execution_mode=ExecutionMode.THREAD,
+    timeout_seconds=30.0,
+)
 def search_google_and_return_list_of_results(search_query: str) -> str:
     """
     Search Google and return the first page of results.
@@ -4,12 +4,18 @@ from local_claude.libs.tools.save_to_workspace_file import (
 from local_claude.libs.tools.bash_code_execution import (
     execute_bash_command,
 )
+from local_claude.libs.tool_options import ExecutionMode, tool_options
 
 
 # TODO(bschoen): We use a non-temporary file because:
 #                - it's easier to debug
 #                - it let's the model give it a persistent name
 # note: the model seems to do better with this than chaining bash etc
+@tool_options(
+    is_parallel_safe=False,
+    execution_mode=ExecutionMode.SUBPROCESS,
+    timeout_seconds=90.0,
+)
 def execute_python_code_and_write_python_code_to_file(
     python_code_to_execute: str,
     filename_for_given_python_code: str,
@@ -1,6 +1,7 @@
 import pathlib
 
 from local_claude.libs import directory_utils
+from local_claude.libs.tool_options import tool_options
 
 
 def _check_filepath_is_filename(filename: str) -> None:
@@ -15,6 +16,7 @@ def _check_filepath_is_filename(filename: str) -> None:
 
 
 # TODO(bschoen): Is the name content throwing it off? It keeps forgetting to pass the actual content in full
+@tool_options(is_parallel_safe=False)
 def save_content_to_persistent_file_in_workspace(filename: str, content: str) -> None:
     """Save arbitrary content to the specified filename in the model's workspace.
 
@@ -62,6 +64,7 @@ def save_content_to_persistent_file_in_workspace(filename: str, content: str) ->
 
 
 # Note: Claude is usually smart enough to use the `ls` bash command to write a file
+@tool_options(is_parallel_safe=False)
 def read_file_from_persistent_workspace(filename: str) -> str:
     """Read the entirety of the given file as text.
 
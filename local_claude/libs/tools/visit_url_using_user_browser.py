@@ -4,17 +4,24 @@ import json
 
 import bs4
 
+from local_claude.libs import process_pool
+from local_claude.libs import tracing
+from local_claude.libs.tool_options import ExecutionMode, tool_options
 from local_claude.libs.tools.save_to_workspace_file import (
     save_content_to_persistent_file_in_workspace,
 )
 
 
+# time allowed for Safari to start, on top of the page load timeout
+_APPLESCRIPT_TIMEOUT_MARGIN_SECONDS = 15
+
+
 class AppleScriptError(Exception):
     pass
 
 
-def _run_applescript(script: str) -> str:
-    """Run an AppleScript and return its output."""
+def _run_applescript(script: str, timeout_seconds: float | None = None) -> str:
+    """Run an AppleScript and return its output, killing it if it takes longer than `timeout_seconds`."""
     try:
         result = subprocess.run(
             ["osascript", "-s", "s"],  # '-s s' for strict compilation
@@ -22,8 +29,13 @@ def _run_applescript(script: str) -> str:
             capture_output=True,
             text=True,
             check=True,
+            timeout=timeout_seconds,
         )
         return result.stdout.strip()
+    except subprocess.TimeoutExpired:
+        raise AppleScriptError(
+            f"AppleScript didn't finish within {timeout_seconds}s (ex: Safari is stuck), so it was killed"
+        )
     except subprocess.CalledProcessError as e:
 
         error_message = (
@@ -45,6 +57,7 @@ def _run_applescript(script: str) -> str:
 
 
 # note: this is the 'less robust' version produced by claude but is saner to understand
+@tracing.traced(category="visit_url")
 def _get_safari_content(url: str, max_wait: int = 30, check_interval: int = 1) -> str:
     script = f"""
     on run
@@ -115,9 +128,11 @@ def _get_safari_content(url: str, max_wait: int = 30, check_interval: int = 1) -
     end run
     """
 
-    return _run_applescript(script)
+    # note: the script gives up on the page load after `max_wait`, this is in case Safari itself hangs
+    return _run_applescript(script, timeout_seconds=max_wait + _APPLESCRIPT_TIMEOUT_MARGIN_SECONDS)
 
 
+@tracing.traced(category="visit_url")
 def _extract_text_content(html: str) -> str:
     # Parse the HTML using BeautifulSoup
     soup = bs4.BeautifulSoup(html, "html.parser")
@@ -136,6 +151,7 @@ def _extract_text_content(html: str) -> str:
     return clean_html.strip()
 
 
+@tracing.traced(category="visit_url")
 def _collapse_whitespace(html: str) -> str:
     """
     Collapse multiple whitespace characters within HTML tags to a single space,
@@ -151,7 +167,27 @@ def _collapse_whitespace(html: str) -> str:
     return html.strip()
 
 
+def _clean_html(html: str) -> str:
+    """Strip scripts, styles and comments, and collapse whitespace, which for large pages is CPU heavy."""
+
+    # strip down page content
+    # TODO(bschoen): Likely want to limit this to max, plus see what we're discarding
+    html = _extract_text_content(html)
+
+    # collapse whitespace, otherwise HTML has insane number of newline and tab tokens, like 50-100 between headings
+    return _collapse_whitespace(html)
+
+
 # TODO(bschoen): Full description
+# note: not side effect safe, since it writes `output_filepath` to the workspace, so starting it
+#       early could race another tool in the same response writing the same file, and not cached
+#       for the same reason, since a cached result wouldn't write the file
+# note: in a thread, since it mostly waits on Safari (which is killed if it hangs), while the CPU
+#       heavy parsing runs in the shared process pool
+@tool_options(
+    execution_mode=ExecutionMode.THREAD,
+    timeout_seconds=90.0,
+)
 def open_url_with_users_local_browser_and_get_all_content_as_html(
     url: str,
     output_filepath: str = "default_output_filepath_open_url_with_users_local_browser_and_get_all_content_as_html.html",
@@ -175,19 +211,20 @@ def open_url_with_users_local_browser_and_get_all_content_as_html(
     """
     page_content = _get_safari_content(url=url)
 
-    # strip down page content
-    # TODO(bschoen): Likely want to limit this to max, plus see what we're discarding
-    page_content = _extract_text_content(page_content)
-
-    # collapse whitespace, otherwise HTML has insane number of newline and tab tokens, like 50-100 between headings
-    page_content = _collapse_whitespace(page_content)
+    # off the GIL, so parsing doesn't stall the UI or other sessions
+    page_content = process_pool.run_in_process_pool(_clean_html, page_content)
 
     # save the content to a file, so claude can do things like parsing it in python
     # for more complex operations
     if output_filepath:
-        save_content_to_persistent_file_in_workspace(
-            filename=output_filepath,
-            content=page_content,
-        )
+        with tracing.span(
+            "save_content_to_file",
+            category="visit_url",
+            num_chars=len(page_content),
+        ):
+            save_content_to_persistent_file_in_workspace(
+                filename=output_filepath,
+                content=page_content,
+            )
 
     return page_content
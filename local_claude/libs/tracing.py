@@ -0,0 +1,351 @@
+"""
+Span based tracing of turns (model calls, tool calls, and stages within tools), exported as
+Chrome trace event JSON, plus on demand cProfile capture of individual tool calls.
+
+Traces can be opened in https://ui.perfetto.dev (or `chrome://tracing`), with one track per
+thread (or asyncio task) and process, so it's easy to see whether a slow turn went to the model, Safari, parsing,
+a subprocess, or disk.
+
+Example:
+
+    tracer = Tracer()
+
+    with tracing_enabled(tracer):
+
+        with span("parse", category="visit_url", num_bytes=len(html)):
+            ...
+
+    tracer.write(pathlib.Path("traces") / "turn.json")
+
+Note:
+  - tracing and profiling follow the current context, so they apply to asyncio tasks and threads
+    started with a copy of it (ex: `asyncio.to_thread`), and are off by default, in which case
+    `span` and `profile` return a shared no-op context manager
+  - spans from `process_pool` workers are recorded in the worker and sent back with the result,
+    spans in `SUBPROCESS` tools aren't recorded (beyond the span around the whole subprocess)
+  - only one `profile` capture runs at a time per process (see `profile`)
+
+"""
+
+from typing import Any, Callable, Iterator
+import contextlib
+import contextvars
+import cProfile
+import dataclasses
+import functools
+import asyncio
+import inspect
+import json
+import os
+import pathlib
+import re
+import threading
+import time
+
+
+DEFAULT_TRACE_DIRECTORY = pathlib.Path("traces")
+
+DEFAULT_PROFILE_DIRECTORY = DEFAULT_TRACE_DIRECTORY / "profiles"
+
+# returned when tracing / profiling is off, so a disabled span costs a context variable lookup
+_NO_OP_CONTEXT_MANAGER = contextlib.nullcontext()
+
+
+def _get_timestamp_microseconds() -> float:
+    # note: monotonic and system wide, so timestamps from worker processes line up
+    return time.perf_counter_ns() / 1_000.0
+
+
+def _get_track_id_and_name() -> tuple[int, str]:
+    """
+    Track (trace "thread") for spans started here, one per thread, or per asyncio task.
+
+    Tasks get their own track, since tasks on the same thread interleave, so their spans overlap
+    without nesting, which trace viewers can't draw on a single track.
+
+    """
+
+    thread_name = threading.current_thread().name
+
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        # no event loop running in this thread
+        task = None
+
+    if task is None:
+        return threading.get_ident(), thread_name
+
+    return id(task), f"{thread_name} / {task.get_name()}"
+
+
+class Tracer:
+    """
+    Collects spans as Chrome trace "complete" events, safe to use from multiple threads.
+
+    See: https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OJQtYMH4h6I0nSsKchNAySU
+
+    """
+
+    def __init__(self) -> None:
+
+        self._lock = threading.Lock()
+
+        self._events: list[dict[str, Any]] = []
+
+        # for naming tracks (threads or asyncio tasks), by (pid, tid)
+        self._thread_name_by_id: dict[tuple[int, int], str] = {}
+
+    @contextlib.contextmanager
+    def span(self, name: str, category: str, args: dict[str, Any]) -> Iterator[None]:
+
+        track_id_and_name = _get_track_id_and_name()
+
+        start_timestamp = _get_timestamp_microseconds()
+
+        try:
+            yield None
+        finally:
+            self._add_span(name, category, args, start_timestamp, track_id_and_name)
+
+    def _add_span(
+        self,
+        name: str,
+        category: str,
+        args: dict[str, Any],
+        start_timestamp: float,
+        track_id_and_name: tuple[int, str],
+    ) -> None:
+
+        pid = os.getpid()
+        tid, track_name = track_id_and_name
+
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": start_timestamp,
+            "dur": _get_timestamp_microseconds() - start_timestamp,
+            "pid": pid,
+            "tid": tid,
+            # note: stringified, since args are only for display and may not be serializable
+            "args": {key: str(value) for key, value in args.items()},
+        }
+
+        with self._lock:
+            self._events.append(event)
+            self._thread_name_by_id.setdefault((pid, tid), track_name)
+
+    def get_events(self) -> list[dict[str, Any]]:
+        """Events recorded so far, including thread name metadata events."""
+
+        with self._lock:
+
+            metadata_events = [
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": pid,
+                    "tid": tid,
+                    "args": {"name": thread_name},
+                }
+                for (pid, tid), thread_name in self._thread_name_by_id.items()
+            ]
+
+            return metadata_events + list(self._events)
+
+    def add_events(self, events: list[dict[str, Any]]) -> None:
+        """Add events recorded by another tracer (ex: in a worker process)."""
+
+        with self._lock:
+            for event in events:
+
+                if event["ph"] == "M":
+                    self._thread_name_by_id.setdefault(
+                        (event["pid"], event["tid"]), event["args"]["name"]
+                    )
+                else:
+                    self._events.append(event)
+
+    def to_chrome_trace_json(self) -> str:
+        return json.dumps({"traceEvents": self.get_events(), "displayTimeUnit": "ms"})
+
+    def write(self, filepath: pathlib.Path) -> None:
+
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        filepath.write_text(self.to_chrome_trace_json(), encoding="utf-8")
+
+
+_current_tracer: contextvars.ContextVar[Tracer | None] = contextvars.ContextVar(
+    "current_tracer", default=None
+)
+
+_current_profile_directory: contextvars.ContextVar[pathlib.Path | None] = (
+    contextvars.ContextVar("current_profile_directory", default=None)
+)
+
+# held while a `profile` capture runs, since cProfile allows one active profiler per process
+_profile_lock = threading.Lock()
+
+
+def get_current_tracer() -> Tracer | None:
+    return _current_tracer.get()
+
+
+@contextlib.contextmanager
+def tracing_enabled(tracer: Tracer) -> Iterator[Tracer]:
+    """Record spans in the current context (and any tasks or threads started from it) to `tracer`."""
+
+    token = _current_tracer.set(tracer)
+
+    try:
+        yield tracer
+    finally:
+        _current_tracer.reset(token)
+
+
+def span(
+    name: str,
+    category: str = "function",
+    **args: Any,
+) -> contextlib.AbstractContextManager[None]:
+    """Record the duration of the block as a span, if tracing is enabled in the current context."""
+
+    tracer = _current_tracer.get()
+
+    if tracer is None:
+        return _NO_OP_CONTEXT_MANAGER
+
+    return tracer.span(name, category, args)
+
+
+def traced[F: Callable[..., Any]](category: str = "function") -> Callable[[F], F]:
+    """
+    Decorator to record each call of the function as a span, named after the function.
+
+    Example:
+
+        @traced(category="visit_url")
+        def _collapse_whitespace(html: str) -> str:
+            ...
+
+    """
+
+    def decorator(func: F) -> F:
+
+        name = func.__qualname__
+
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                with span(name, category):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper  # type: ignore[return-value]
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with span(name, category):
+                return func(*args, **kwargs)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorator
+
+
+@dataclasses.dataclass(frozen=True)
+class TracedResult:
+    result: Any
+    events: list[dict[str, Any]]
+
+
+def call_with_tracing(func: Callable[..., Any], *args: Any, **kwargs: Any) -> TracedResult:
+    """Call `func` with a new tracer, returning its events with the result (ex: in a worker process, to send back)."""
+
+    tracer = Tracer()
+
+    with tracing_enabled(tracer):
+        result = func(*args, **kwargs)
+
+    return TracedResult(result=result, events=tracer.get_events())
+
+
+@contextlib.contextmanager
+def profiling_enabled(directory: pathlib.Path) -> Iterator[pathlib.Path]:
+    """Write a cProfile capture to `directory` for each `profile` block in the current context."""
+
+    directory.mkdir(parents=True, exist_ok=True)
+
+    token = _current_profile_directory.set(directory)
+
+    try:
+        yield directory
+    finally:
+        _current_profile_directory.reset(token)
+
+
+@contextlib.contextmanager
+def _skip_profile(name: str, reason: str) -> Iterator[None]:
+
+    # note: recorded as a span, so skipped captures show up in the trace
+    with span(f"profile_skipped:{name}", category="profile", reason=reason):
+        yield None
+
+
+@contextlib.contextmanager
+def _profile_to_file(name: str, directory: pathlib.Path) -> Iterator[None]:
+
+    # note: not waiting for the running capture, which would serialize concurrent tool calls
+    if not _profile_lock.acquire(blocking=False):
+        with _skip_profile(name, reason="another capture is running"):
+            yield None
+        return None
+
+    try:
+        profiler = cProfile.Profile()
+
+        try:
+            profiler.enable()
+        except ValueError:
+            # ex: a profiler outside of `profile` (like `python -m cProfile`) is already active
+            with _skip_profile(name, reason="another profiler is active"):
+                yield None
+            return None
+
+        try:
+            yield None
+        finally:
+            profiler.disable()
+
+        # note: timestamp first, so files sort in the order they were captured
+        filename = f"{time.time_ns()}_{re.sub(r'[^A-Za-z0-9_.-]', '_', name)}.prof"
+
+        profiler.dump_stats(directory / filename)
+
+    finally:
+        _profile_lock.release()
+
+
+def profile(name: str) -> contextlib.AbstractContextManager[None]:
+    """
+    Capture a cProfile of the block, if profiling is enabled in the current context.
+
+    Captures are written as `<timestamp>_<name>.prof`, which can be read with `pstats` or viewed
+    with `snakeviz`.
+
+    Note:
+      - cProfile allows only one active profiler per process, so only one block is captured at a
+        time, a block starting while another is being captured (ex: a concurrent tool call) isn't
+        profiled, and is recorded as a `profile_skipped:<name>` span instead
+      - on python 3.12+ a capture includes every thread's work while it runs, not only the
+        block's thread
+
+    """
+
+    directory = _current_profile_directory.get()
+
+    if directory is None:
+        return _NO_OP_CONTEXT_MANAGER
+
+    return _profile_to_file(name, directory)
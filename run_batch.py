@@ -0,0 +1,77 @@
+"""
+Run many prompts through the same agent as `run_claude.py`, without the UI.
+
+Example:
+
+    python run_batch.py --prompts prompts.jsonl --output-dir batch_output --concurrency 8
+
+See `batch_runner.read_batch_prompts` for the prompts format.
+
+"""
+
+import argparse
+import pathlib
+
+from local_claude.libs import agent_engine
+from local_claude.libs import batch_runner
+from local_claude.libs.agent_defaults import AgentDefaults
+from local_claude.libs.tools import default_tools
+
+
+def main() -> None:
+
+    parser = argparse.ArgumentParser(description=__doc__)
+
+    parser.add_argument("--prompts", type=pathlib.Path, required=True)
+    parser.add_argument("--output-dir", type=pathlib.Path, required=True)
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="Number of conversations to run at once",
+    )
+    parser.add_argument("--max-iterations", type=int, default=10)
+
+    args = parser.parse_args()
+
+    prompts = batch_runner.read_batch_prompts(args.prompts)
+
+    print(f"Running {len(prompts)} prompts with concurrency {args.concurrency}...")
+
+    def on_result(
+        result: batch_runner.BatchResult,
+        summary: batch_runner.BatchSummary,
+    ) -> None:
+        print(
+            f"[{summary.num_conversations}/{len(prompts)}] {result.prompt_id}: "
+            f"{result.finish_reason} in {result.wall_time_seconds:.1f}s "
+            f"({summary.get_conversations_per_minute():.1f} conversations / minute)"
+        )
+
+    summary = batch_runner.run_batch(
+        prompts=prompts,
+        functions=default_tools.get_default_tool_registry().get_tools(),
+        config=agent_engine.AgentTurnConfig(
+            model=AgentDefaults.MODEL.value,
+            max_tokens=AgentDefaults.MAX_TOKENS,
+            system=AgentDefaults.SYSTEM_PROMPT,
+            max_iterations=args.max_iterations,
+            context_token_budget=AgentDefaults.CONTEXT_TOKEN_BUDGET,
+            # note: nothing renders deltas, so don't accumulate events for them
+            is_streaming_enabled=False,
+        ),
+        output_dir=args.output_dir,
+        concurrency=args.concurrency,
+        on_result=on_result,
+    )
+
+    print(
+        f"Finished {summary.num_conversations} conversations ({summary.num_errors} errors) "
+        f"in {summary.wall_time_seconds:.1f}s, "
+        f"{summary.get_conversations_per_minute():.1f} conversations / minute"
+    )
+    print(f"Transcripts and telemetry written to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
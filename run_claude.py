@@ -2,309 +2,569 @@ import streamlit as st
 import anthropic
 
 import datetime
-from typing import Iterable
-import enum
-import json
+import io
+import pathlib
+import pstats
+import time
+from typing import Callable
 
 import coolname
 import pytz
 
 # import function call handler
 from local_claude.libs.function_call_handler import FunctionCallHandler
+from local_claude.libs import agent_engine
+from local_claude.libs.agent_defaults import AgentDefaults
+from local_claude.libs import api_clients
+from local_claude.libs import conversation_search
+from local_claude.libs import conversation_store
+from local_claude.libs import message_rendering
+from local_claude.libs import prompt_caching
+from local_claude.libs import telemetry
+from local_claude.libs import tool_result_cache
+from local_claude.libs import tool_schema_variants
+from local_claude.libs import tracing
 
-# import tools
-from local_claude.libs.tools.save_to_workspace_file import (
-    save_content_to_persistent_file_in_workspace,
-    read_file_from_persistent_workspace,
-)
-from local_claude.libs.tools.bash_code_execution import execute_bash_command
-from local_claude.libs.tools.python_code_execution import (
-    execute_python_code_and_write_python_code_to_file,
-)
-from local_claude.libs.tools.google_search import (
-    search_google_and_return_list_of_results,
-)
-from local_claude.libs.tools.visit_url_using_user_browser import (
-    open_url_with_users_local_browser_and_get_all_content_as_html,
-)
+# tools, only imported once first called
+from local_claude.libs.tools import default_tools
 
 
-class Models(enum.Enum):
-    CLAUDE_SONNET_3_5 = "claude-3-5-sonnet-20240620"
+class Defaults(AgentDefaults):
+    # turns of history to show at once, more are loaded on request
+    NUM_TURNS_SHOWN = 10
 
+    # how often the page checks for progress of turns running in the background
+    AGENT_ENGINE_POLL_INTERVAL_SECONDS = 0.1
 
-class Defaults:
-    # sonnet 3.5 is smartest model
-    MODEL = Models.CLAUDE_SONNET_3_5
+    # functions shown per tool call profile, by cumulative time
+    NUM_PROFILE_FUNCTIONS_SHOWN = 15
 
-    # note: 4096 is usual max
-    MAX_TOKENS = 1024
+    # most recent tool call profiles shown
+    NUM_PROFILES_SHOWN = 5
 
-    # TODO(bschoen): Provide `environment` tags?
-    # TODO(bschoen): A bunch of examples for what's possible with the tools
-    # TODO(bschoen): Chaining them together
-    SYSTEM_PROMPT: str = """
-    You are an AI assistant helping a user. You are provided with a containerized,
-    sandboxed environment in which you can make arbitrary modifications safely. The
-    containerized, sandboxed environment is persistent across calls. You are free
-    to add, create, remove, or modify any files, as your access is already constrained
-    to a sandboxed working directory.
 
-    Note that the availability of these tools does not mean you have to use them in every response.
-    If you are confident you can answer the user's question without using any of the tools, feel free
-    to answer without using the tools.
+type ConversationId = str
 
-    For any code you generate, ensure there are inline comments explaining the motivation and
-    intuition for all of it, as well as appropriate docstrings and type annotations.
+# distinguishes this app's conversations from `run_o1.py`'s in the shared search index
+CONVERSATION_SEARCH_SOURCE = "claude"
 
-    When making updates to previously generated code, you should instead create a new
-    python file via a call to `execute_python_code_and_write_python_code_to_file` which
-    contains ALL code needed to run.
 
-    When iterating on responses, you don't need to include code that hasn't changed since
-    previous response.
+def generate_conversation_id() -> ConversationId:
+    """
+    Generate a unique conversation id.
+    """
+    # Get the current time in PST
+    pst_timezone = pytz.timezone("America/Los_Angeles")
+    current_time = datetime.datetime.now(pst_timezone)
 
-    Whenever it would make a task easier, feel free to include existing 3rd party libraries
-    or suggest using new programmer tools (ex: some new cli tool, some new desktop application,
-    etc).
+    # Format the time as ex: 10:06 AM
+    timestamp_string = current_time.strftime("%Y-%m-%d_%I:%M_%p")
+    unique_coolname = "_".join(coolname.generate())
 
-    If there is an alternative approach that you believe is more promising in fufilling the user's
-    overall goal, please feel free to suggest it at the end of your response, even if it is in a
-    different direction than the current conversation. You do not need to mention an alternative
-    approach if you believe the current one is the most promising.
+    return f"{timestamp_string}__{unique_coolname}"
 
-    More information about the user is provided between the `user_info` tags here:
 
-    <user_info>
-    
-    The user is a developer with 8 years of experience building various products
-    spanning multiple programming languages and internal tools.
-    
-    </user_info>
+@st.cache_resource
+def get_conversation_store() -> conversation_store.ConversationStore:
+    """Get the conversation store, shared by all sessions in the process (and with other processes using the same file)."""
 
-    More info about the available tools is provided between the `available_tools` tags here:
+    return conversation_store.SqliteConversationStore(
+        conversation_store.DEFAULT_CONVERSATION_STORE_FILEPATH
+    )
 
-    <available_tools>
 
-    - `save_content_to_persistent_file_in_workspace`: Save content to a persistent file in the workspace, useful for passing data to other tools
-    - `read_file_from_persistent_workspace`: Read data from file
-    - `execute_python_code_and_write_python_code_to_file`: Executes python code and writes it to a file
-    - `execute_bash_command`: Executes a bash command and returns the output
-    - `search_google_and_return_list_of_results`: Searches google and returns the results
-    - `open_url_with_users_local_browser_and_get_all_content_as_html`: Opens a URL in the user's local browser and returns the HTML content
+@st.cache_resource
+def get_conversation_search_index() -> conversation_search.ConversationSearchIndex:
+    """Get the search index, shared by all sessions in the process (and with `run_o1.py`)."""
 
-    </available_tools>
+    search_index = conversation_search.ConversationSearchIndex(
+        conversation_search.DEFAULT_SEARCH_INDEX_FILEPATH
+    )
 
-    Here is a multi step example of:
-    - (1) Getting HTML content of a url via `open_url_with_users_local_browser_and_get_all_content_as_html`
-    - (2) Using python to parse desired information from the HTML content
+    # catch up on conversations stored without indexing (ex: before search existed)
+    conversation_search.sync_search_index(
+        search_index,
+        get_conversation_store(),
+        source=CONVERSATION_SEARCH_SOURCE,
+    )
 
-    <example_multi_step_tool_use>
+    return search_index
 
-    html_content = open_url_with_users_local_browser_and_get_all_content_as_html("https://pypi.org/project/anthropic")
 
-    execute_python_code_and_write_python_code_to_file(f'''
-        import 
+# TODO(bschoen): We likely *later* want to add the ability to "wake up" (i.e. use same docker container etc)
+class ConversationManager:
+    """
+    Handles getting / setting conversations and messages, backed by a `ConversationStore`.
 
-        html_content
-    ''')
+    This allows caller to not have to know anything about how conversations are stored.
 
-    </example_multi_step_tool_use>
+    We keep conversations outside of `st.session_state` since streamlit reruns every time, and
+    session state would grow without bound, be lost on refresh, and not be shared between processes.
 
-    Here is a multi step example of:
-    - (1) Getting the results from a google search via `search_google_and_return_list_of_results`
-    - (2) Using the links from those results with `open_url_with_users_local_browser_and_get_all_content_as_html` to get more detailed information to more helpfully respond to the user's query
+    Note:
+      - messages are only loaded when asked for, so listing conversations is cheap
+      - messages are also added to the search index as they're added
 
-    <example_multi_step_tool_use>
+    """
 
-    search_results = search_google_and_return_list_of_results("How does AutoGPT4 work")
+    def __init__(
+        self,
+        store: conversation_store.ConversationStore | None = None,
+        search_index: conversation_search.ConversationSearchIndex | None = None,
+    ) -> None:
 
-    # call `open_url_with_users_local_browser_and_get_all_content_as_html` on the interesting links,
-    # here we're arbitrarily choosing 0 and 3 for this example
-    interesting_links = [search_results[0]["link"], search_results[3]["link"]]
+        self._store = store or get_conversation_store()
+        self._search_index = search_index or get_conversation_search_index()
 
-    content_of_interesting_links = [
-        open_url_with_users_local_browser_and_get_all_content_as_html(interesting_link)
-        for interesting_link in interesting_links
-    ]
+    def get_conversation_ids(self) -> list[ConversationId]:
+        return self._store.get_conversation_ids()
 
-    # now use `content_of_interesting_links` to help you provide an answer to the user
+    def get_conversation_messages(
+        self,
+        conversation_id: ConversationId,
+    ) -> list[anthropic.types.MessageParam]:
+        return self._store.get_messages(conversation_id)
 
-    </example_multi_step_tool_use>
+    def add_conversation_message(
+        self,
+        conversation_id: ConversationId,
+        message: anthropic.types.MessageParam,
+    ) -> None:
+        self._store.append_message(conversation_id, message)
 
-    """
+        self._search_index.index_message(
+            CONVERSATION_SEARCH_SOURCE,
+            conversation_id,
+            message_index=self._store.get_num_messages(conversation_id) - 1,
+            message=dict(message),
+        )
 
+    def get_recent_conversation_messages(
+        self,
+        conversation_id: ConversationId,
+        num_turns: int,
+    ) -> tuple[int, list[anthropic.types.MessageParam]]:
+        """Messages of the last `num_turns` turns, and the index of the first one."""
+
+        return message_rendering.get_recent_turns(
+            self._store,
+            conversation_id,
+            num_turns=num_turns,
+        )
 
-type ConversationId = str
+    def create_new_conversation(self) -> ConversationId:
+        conversation_id = generate_conversation_id()
 
+        self._store.create_conversation(conversation_id)
 
-def generate_conversation_id() -> ConversationId:
+        return conversation_id
+
+
+def display_conversation_search(
+    search_index: conversation_search.ConversationSearchIndex,
+) -> None:
+    """Sidebar search over this app's conversations, with a button to open each result."""
+
+    search_query = st.sidebar.text_input("Search conversations")
+
+    if not search_query:
+        return None
+
+    search_results = search_index.search(
+        search_query,
+        source=CONVERSATION_SEARCH_SOURCE,
+    )
+
+    if not search_results:
+        st.sidebar.caption("No matches")
+        return None
+
+    for search_result in search_results:
+
+        st.sidebar.markdown(
+            f"`{search_result.conversation_id}` ({search_result.role}, "
+            f"message {search_result.message_index})\n\n{search_result.snippet}"
+        )
+
+        # note: set in a callback, since the selectbox's state can't be changed once it's rendered
+        def open_conversation(
+            conversation_id: ConversationId = search_result.conversation_id,
+        ) -> None:
+            st.session_state.selected_conversation_id = conversation_id
+
+        st.sidebar.button(
+            "Open",
+            key=f"open_search_result_{search_result.conversation_id}_{search_result.message_index}",
+            on_click=open_conversation,
+        )
+
+    return None
+
+
+@st.cache_resource
+def get_rendered_message_cache() -> message_rendering.RenderedMessageCache:
+    """Get the rendered message cache, shared by all sessions since stored messages never change."""
+
+    return message_rendering.RenderedMessageCache()
+
+
+def display_rendered_message(rendered_message: message_rendering.RenderedMessage) -> None:
+
+    with st.chat_message(rendered_message.role):
+
+        for element in rendered_message.elements:
+
+            match element.kind:
+                case "markdown":
+                    st.markdown(element.body)
+                case "code":
+                    st.code(element.body)
+                case "image":
+                    st.image(element.body)
+
+
+def display_message(message: anthropic.types.MessageParam) -> None:
     """
-    Generate a unique conversation id.
+
+    Annoyingly, this operates on `MessageParam` instead of `Message`, since `UserMessage`s aren't actually a legitimate
+    `Message` instance, at least we still have the type checking of `TypedDict`.
+
     """
-    # Get the current time in PST
-    pst_timezone = pytz.timezone("America/Los_Angeles")
-    current_time = datetime.datetime.now(pst_timezone)
 
-    # Format the time as ex: 10:06 AM
-    timestamp_string = current_time.strftime("%Y-%m-%d_%I:%M_%p")
-    unique_coolname = "_".join(coolname.generate())
+    display_rendered_message(message_rendering.render_message(message))
 
-    return f"{timestamp_string}__{unique_coolname}"
 
+def display_conversation_history(
+    conversation_manager: ConversationManager,
+    conversation_id: ConversationId,
+) -> int:
+    """
+    Show the last few turns of the conversation, with a button to page in older ones.
+
+    Returns the number of messages in the conversation as shown.
 
-# TODO(bschoen): We likely want this to be actually persistent state
-# TODO(bschoen): We likely *later* want to add the ability to "wake up" (i.e. use same docker container etc)
-class ConversationManager:
     """
-    Handles getting / setting conversations and messages whenever they interact with the `st.session_state` singleton.
 
-    This allows caller to not have to know anything about the singleton usage.
+    # number of turns shown for each conversation, kept across reruns
+    num_turns_shown_by_conversation_id: dict[ConversationId, int] = (
+        st.session_state.setdefault("num_turns_shown_by_conversation_id", {})
+    )
+
+    num_turns_shown = num_turns_shown_by_conversation_id.get(
+        conversation_id, Defaults.NUM_TURNS_SHOWN
+    )
 
-    We wrap messages in a singleton since streamlit reruns every time.
+    window_start, messages = conversation_manager.get_recent_conversation_messages(
+        conversation_id,
+        num_turns=num_turns_shown,
+    )
 
-    Note:
-      - `st.session_state` is just an arbitrary persistent key-value store, see https://docs.streamlit.io/develop/api-reference/caching-and-state/st.session_state
-      - this is the same pattern used in https://docs.streamlit.io/develop/tutorials/llms/build-conversational-apps
+    if window_start > 0:
 
-    """
+        def show_older_turns() -> None:
+            num_turns_shown_by_conversation_id[conversation_id] = (
+                num_turns_shown + Defaults.NUM_TURNS_SHOWN
+            )
 
-    def __init__(self) -> None:
+        st.button(
+            f"Load older turns ({window_start} earlier messages)",
+            on_click=show_older_turns,
+        )
 
-        # initialize if not present yet, this way all other functions
-        # can assume there is an initialized `st.session_state.conversations``
-        if "conversations" not in st.session_state:
+    rendered_message_cache = get_rendered_message_cache()
 
-            conversations: dict[ConversationId, list[anthropic.types.MessageParam]] = {}
+    for message_index, message in enumerate(messages, start=window_start):
+        display_rendered_message(
+            rendered_message_cache.get_rendered_message(
+                conversation_id,
+                message_index,
+                message,
+            )
+        )
 
-            st.session_state.conversations = conversations
+    return window_start + len(messages)
 
-    def get_conversation_ids(self) -> list[ConversationId]:
-        return list(st.session_state.conversations.keys())
 
-    def get_conversation_messages(
-        self,
-        conversation_id: ConversationId,
-    ) -> list[anthropic.types.MessageParam]:
-        return st.session_state.conversations[conversation_id]
+def get_telemetry_recorder() -> telemetry.TelemetryRecorder:
+    """Get the telemetry recorder, which is kept in `st.session_state` so it persists across reruns."""
 
-    def add_conversation_message(
-        self,
-        conversation_id: ConversationId,
-        message: anthropic.types.MessageParam,
-    ) -> None:
-        print(f"Adding message to dict: {message}")
-        st.session_state.conversations[conversation_id].append(message)
+    if "telemetry_recorder" not in st.session_state:
+        st.session_state.telemetry_recorder = telemetry.TelemetryRecorder()
 
-    def create_new_conversation(self) -> ConversationId:
-        conversation_id = generate_conversation_id()
+    recorder: telemetry.TelemetryRecorder = st.session_state.telemetry_recorder
 
-        st.session_state.conversations[conversation_id] = []
+    return recorder
 
-        return conversation_id
 
+def display_telemetry_panel(
+    container: st.delta_generator.DeltaGenerator,
+    totals: telemetry.ConversationTelemetryTotals,
+) -> None:
+    """Show per conversation telemetry totals, replacing whatever was previously in `container`."""
 
-MessageContent = (
-    str
-    | Iterable[
-        anthropic.types.TextBlockParam
-        | anthropic.types.ImageBlockParam
-        | anthropic.types.ToolUseBlockParam
-        | anthropic.types.ToolResultBlockParam
-        | anthropic.types.ContentBlock
-    ]
-)
+    with container.container():
+
+        st.markdown("### Usage")
+
+        st.markdown(
+            f"""
+| | |
+|---|---|
+| Model calls | {totals.model_calls} |
+| Model latency | {totals.model_latency_seconds:.1f}s |
+| Input tokens | {totals.input_tokens} |
+| Output tokens | {totals.output_tokens} |
+| Cache read tokens | {totals.cache_read_input_tokens} |
+| Cache write tokens | {totals.cache_creation_input_tokens} |
+| Tokens saved by compaction | ~{totals.estimated_tokens_saved_by_compaction} |
+| Tool calls (errors) | {totals.tool_calls} ({totals.tool_errors}) |
+| Tool wall time | {totals.tool_wall_time_seconds:.1f}s |
+| Tool result size | {totals.tool_result_bytes / 1024:.1f} KiB (~{totals.estimated_tool_result_tokens} tokens) |
+"""
+        )
+
+
+def get_last_context_usage_event_by_conversation_id() -> dict[
+    ConversationId, agent_engine.ContextUsageEvent
+]:
+    """Latest request size estimate per conversation, kept in session state so the meter survives reruns."""
 
+    if "last_context_usage_event_by_conversation_id" not in st.session_state:
+        st.session_state.last_context_usage_event_by_conversation_id = {}
 
-def try_load_json_or_default_to_string(json_string: str) -> str:
-    try:
-        return json.loads(json_string)
-    except json.JSONDecodeError:
-        return json_string
+    last_context_usage_event_by_conversation_id: dict[
+        ConversationId, agent_engine.ContextUsageEvent
+    ] = st.session_state.last_context_usage_event_by_conversation_id
 
+    return last_context_usage_event_by_conversation_id
 
-def display_message_content(message_content: MessageContent) -> None:
 
-    if isinstance(message_content, str):
-        st.markdown(message_content)
+def display_context_meter(
+    container: st.delta_generator.DeltaGenerator,
+    event: agent_engine.ContextUsageEvent | None,
+) -> None:
+    """Show how much of the context window the last request used, replacing whatever was previously in `container`."""
+
+    if event is None:
+        container.caption("Context used: no requests yet")
         return None
 
-    # recursively handle list
-    if isinstance(message_content, list):
-        for item in message_content:
-            display_message_content(item)
+    request_token_count = event.request_token_count
+
+    container.progress(
+        min(request_token_count.get_context_window_fraction(event.context_window_tokens), 1.0),
+        text=(
+            f"Context used: ~{request_token_count.get_total_tokens():,} / "
+            f"{event.context_window_tokens:,} tokens (system "
+            f"{request_token_count.system_tokens:,}, tools {request_token_count.tools_tokens:,}, "
+            f"messages {request_token_count.messages_tokens:,}, response "
+            f"{request_token_count.max_output_tokens:,})"
+        ),
+    )
+
+    return None
+
+
+@st.cache_resource
+def get_tool_result_cache(is_persistent: bool) -> tool_result_cache.ToolResultCache:
+    """Get the tool result cache, shared by all sessions in the process since results (ex: searches) aren't user specific."""
+
+    return tool_result_cache.ToolResultCache(
+        persistent_store=(
+            tool_result_cache.SqliteToolResultStore(
+                tool_result_cache.DEFAULT_PERSISTENT_STORE_FILEPATH
+            )
+            if is_persistent
+            else None
+        )
+    )
+
+
+def display_tool_result_cache_stats(
+    stats: tool_result_cache.ToolResultCacheStats,
+) -> None:
+
+    st.sidebar.markdown(
+        f"Tool result cache: {stats.hits} hits / {stats.misses} misses "
+        f"({stats.get_hit_rate():.0%} hit rate), {stats.num_entries} entries, "
+        f"{stats.evictions} evicted"
+    )
+
+
+def display_latest_trace(conversation_id: ConversationId) -> None:
+    """Offer the conversation's most recent turn trace for download, to open in https://ui.perfetto.dev."""
+
+    # note: filenames end in a timestamp, so the last one sorted is the latest
+    trace_filepaths = sorted(
+        tracing.DEFAULT_TRACE_DIRECTORY.glob(f"{conversation_id}_*.json")
+    )
+
+    if not trace_filepaths:
+        st.sidebar.caption("No traces yet for this conversation")
         return None
 
-    # each item is
-    # WOW match with copilot is crazy
-    match message_content["type"]:
-        case "text":
-            st.markdown(message_content["text"])
-            return None
-        case "image":
-            st.image(message_content["source"]["data"])
-            return None
-        case "tool_use":
-            st.markdown(f"Tool use: {message_content['id']}")
-            st.markdown(f"```json\n{json.dumps(message_content, indent=2)}\n```")
-            return None
-        case "tool_result":
-            st.markdown(f"Tool result: {message_content['tool_use_id']}")
+    st.sidebar.download_button(
+        "Download latest turn trace (open in ui.perfetto.dev)",
+        data=trace_filepaths[-1].read_bytes(),
+        file_name=trace_filepaths[-1].name,
+        mime="application/json",
+    )
 
-            # show details for error
-            if message_content["is_error"]:
+    return None
 
-                # in this case, we know it should be a JSON dict representing a python exception
-                exception_dict = json.loads(message_content["content"])
-                st.code(exception_dict["traceback"])
 
-            # otherwise show content, up to a limit
-            else:
+def _format_profile(profile_filepath: pathlib.Path) -> str:
 
-                # TODO(bschoen): Handle when this is just a string
+    output = io.StringIO()
 
-                # if it's a json, show that
-                function_result = try_load_json_or_default_to_string(
-                    message_content["content"]
-                )
+    stats = pstats.Stats(str(profile_filepath), stream=output)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(Defaults.NUM_PROFILE_FUNCTIONS_SHOWN)
 
-                if isinstance(function_result, str):
+    return output.getvalue()
 
-                    st.code(
-                        function_result[:100].strip()
-                        + "... (only showing up to first 100 characters)"
-                    )
 
-                # otherwise json decode was successful
-                else:
-                    st.markdown(
-                        f"```json\n{json.dumps(function_result, indent=2)}\n```"
-                    )
+def display_latest_profiles() -> None:
+    """Show the top functions of the most recent tool call profiles."""
 
-                    # TODO(bschoen): How to make this more generic?
-                    if "output" in function_result:
+    # note: filenames start with a timestamp, so the last ones sorted are the latest
+    profile_filepaths = sorted(tracing.DEFAULT_PROFILE_DIRECTORY.glob("*.prof"))[
+        -Defaults.NUM_PROFILES_SHOWN :
+    ]
 
-                        st.code(function_result["output"])
+    if not profile_filepaths:
+        st.sidebar.caption("No tool call profiles yet")
+        return None
 
-            return None
-        case "content":
-            st.markdown(f"Content: {message_content['name']}")
-            return None
+    for profile_filepath in reversed(profile_filepaths):
+        with st.sidebar.expander(profile_filepath.name):
+            st.code(_format_profile(profile_filepath), language=None)
+
+    return None
+
+
+@st.cache_resource
+def get_agent_engine() -> agent_engine.AgentEngine:
+    """Get the agent engine, which is shared by all sessions in the process and persists across reruns."""
+
+    return agent_engine.AgentEngine()
+
+
+def display_model_call_record(model_call_record: telemetry.ModelCallRecord) -> None:
+
+    # report cache usage per call, so we can check breakpoints are actually being hit
+    cache_usage = prompt_caching.CacheUsage(
+        input_tokens=model_call_record.input_tokens,
+        cache_read_input_tokens=model_call_record.cache_read_input_tokens,
+        cache_creation_input_tokens=model_call_record.cache_creation_input_tokens,
+    )
+
+    caption = (
+        f"Cache read: {cache_usage.cache_read_input_tokens} tokens, "
+        f"cache write: {cache_usage.cache_creation_input_tokens} tokens, "
+        f"uncached input: {cache_usage.input_tokens} tokens "
+        f"(hit rate: {cache_usage.get_cache_hit_rate():.0%})"
+    )
+
+    if model_call_record.estimated_tokens_saved_by_compaction:
+        caption += (
+            f", ~{model_call_record.estimated_tokens_saved_by_compaction} tokens "
+            "saved by compacting stale tool results"
+        )
+
+    st.caption(caption)
+
+
+def display_turn_finished_event(event: agent_engine.AgentEvent) -> None:
+
+    if not isinstance(event, agent_engine.TurnFinishedEvent):
+        return None
+
+    match event.reason:
+        case "max_iterations":
+            # TODO(bschoen): Error for max iterations
+            st.warning("Reached max iterations")
+        case "error":
+            st.error("Turn failed with an error")
+            st.code(event.error_traceback)
         case _:
-            raise ValueError(f"Unexpected item type: {message_content['type']}")
+            print("No more tool use, turn finished")
 
+    return None
 
-def display_message(message: anthropic.types.MessageParam) -> None:
+
+def display_turn_in_progress(
+    engine: agent_engine.AgentEngine,
+    conversation_id: ConversationId,
+    num_messages_shown: int,
+    on_usage: Callable[[], None],
+    on_context_usage: Callable[[agent_engine.ContextUsageEvent], None],
+) -> None:
     """
+    Poll the engine and render the conversation's in progress turn, until it finishes.
 
-    Annoyingly, this operates on `MessageParam` instead of `Message`, since `UserMessage`s aren't actually a legitimate
-    `Message` instance, at least we still have the type checking of `TypedDict`.
+    If the script is rerun while this is polling, the turn keeps running in the background
+    and the next script run picks up rendering where this left off (the engine saves messages
+    itself, so they're shown from the store, and only messages past `num_messages_shown` are
+    shown from events).
 
     """
 
-    with st.chat_message(message["role"]):
+    # holds whatever is currently being streamed / run, replaced once the message is complete
+    live_placeholder = st.empty()
+
+    running_tool_names_by_id: dict[str, str] = {}
+
+    while True:
+
+        # check before polling, so we don't miss events emitted right before the turn finishes
+        is_running = engine.is_running(conversation_id)
+
+        for event in engine.poll_events(conversation_id):
+
+            match event:
+                case agent_engine.TextDeltaEvent():
+                    with live_placeholder.container():
+                        with st.chat_message("assistant"):
+                            st.markdown(event.snapshot)
+
+                case agent_engine.MessageAddedEvent():
+                    if event.message_index < num_messages_shown:
+                        continue
+
+                    live_placeholder.empty()
+                    display_message(event.message)
+                    live_placeholder = st.empty()
+
+                case agent_engine.ToolStartedEvent():
+                    running_tool_names_by_id[event.tool_call.id] = event.tool_call.name
+
+                case agent_engine.ToolFinishedEvent():
+                    running_tool_names_by_id.pop(event.tool_call.id, None)
+                    on_usage()
+
+                case agent_engine.UsageEvent():
+                    display_model_call_record(event.model_call_record)
+                    on_usage()
 
-        display_message_content(message["content"])
+                case agent_engine.ContextUsageEvent():
+                    on_context_usage(event)
+
+                case agent_engine.TurnFinishedEvent():
+                    live_placeholder.empty()
+                    display_turn_finished_event(event)
+
+            if isinstance(event, (agent_engine.ToolStartedEvent, agent_engine.ToolFinishedEvent)):
+                if running_tool_names_by_id:
+                    live_placeholder.caption(
+                        f"Running tools: {', '.join(running_tool_names_by_id.values())}..."
+                    )
+                else:
+                    live_placeholder.empty()
+
+        if not is_running:
+            return None
+
+        time.sleep(Defaults.AGENT_ENGINE_POLL_INTERVAL_SECONDS)
 
 
 # TODO(bschoen): Should we make all tools read and write from files, like kubeflow?
@@ -318,7 +578,7 @@ def main() -> None:
 
     Source code available at: https://github.com/b-schoen/local_claude
                 
-    Refresh to clear all conversations.
+    Conversations are saved, so they're still here after a refresh.
 """
     )
 
@@ -326,8 +586,15 @@ def main() -> None:
     conversation_manager = ConversationManager()
 
     # allow creating new conversations
-    if st.sidebar.button("New Conversation"):
-        conversation_manager.create_new_conversation()
+    is_new_conversation_created = st.sidebar.button("New Conversation")
+
+    if is_new_conversation_created:
+        # select it, since it's what the user will want to use next
+        st.session_state.selected_conversation_id = (
+            conversation_manager.create_new_conversation()
+        )
+
+    display_conversation_search(get_conversation_search_index())
 
     # select conversation id
     conversation_ids = conversation_manager.get_conversation_ids()
@@ -342,6 +609,7 @@ def main() -> None:
     selected_conversation_id = st.selectbox(
         "Select Conversation",
         conversation_ids[::-1],
+        key="selected_conversation_id",
     )
 
     assert selected_conversation_id
@@ -361,22 +629,79 @@ def main() -> None:
     # st.markdown(selected_system_prompt)
     st.markdown("---")
 
-    # show the messages in the selected conversation
-    for message in conversation_manager.get_conversation_messages(
-        selected_conversation_id
-    ):
-        display_message(message)
+    # show the end of the selected conversation
+    num_messages_shown = display_conversation_history(
+        conversation_manager, selected_conversation_id
+    )
+
+    # record model + tool call telemetry, shown in the sidebar and appended to a JSONL file
+    telemetry_recorder = get_telemetry_recorder()
+
+    telemetry_panel = st.sidebar.empty()
+
+    display_telemetry_panel(
+        telemetry_panel,
+        telemetry_recorder.get_totals(selected_conversation_id),
+    )
+
+    # estimated size of the last request, updated live as a turn runs
+    last_context_usage_event_by_conversation_id = (
+        get_last_context_usage_event_by_conversation_id()
+    )
+
+    context_meter = st.sidebar.empty()
+
+    display_context_meter(
+        context_meter,
+        last_context_usage_event_by_conversation_id.get(selected_conversation_id),
+    )
+
+    def on_context_usage(event: agent_engine.ContextUsageEvent) -> None:
+        last_context_usage_event_by_conversation_id[event.conversation_id] = event
+        display_context_meter(context_meter, event)
+
+    def on_tool_call_resolved(
+        tool_call: anthropic.types.ToolUseBlock,
+        tool_result: anthropic.types.ToolResultBlockParam,
+        wall_time_seconds: float,
+    ) -> None:
+        telemetry_recorder.record(
+            telemetry.ToolCallRecord.from_tool_result(
+                conversation_id=selected_conversation_id,
+                tool_call=tool_call,
+                tool_result=tool_result,
+                wall_time_seconds=wall_time_seconds,
+            )
+        )
+
+    # memoize repeated tool calls (ex: the same search), optionally across restarts
+    is_tool_result_cache_persistent = st.sidebar.checkbox(
+        "Persist tool result cache across restarts",
+        value=False,
+    )
+
+    function_call_tool_result_cache = get_tool_result_cache(
+        is_persistent=is_tool_result_cache_persistent
+    )
+
+    display_tool_result_cache_stats(function_call_tool_result_cache.get_stats())
+
+    # for A/B testing shorter tool descriptions, the variant is recorded with each model call
+    tool_schema_variant = st.sidebar.selectbox(
+        "Tool descriptions",
+        options=list(tool_schema_variants.ToolSchemaVariant),
+        format_func=lambda x: x.value,
+    )
+
+    assert tool_schema_variant is not None
 
     # create the function call handler
     function_call_handler = FunctionCallHandler(
-        functions=[
-            read_file_from_persistent_workspace,
-            save_content_to_persistent_file_in_workspace,
-            execute_bash_command,
-            execute_python_code_and_write_python_code_to_file,
-            search_google_and_return_list_of_results,
-            open_url_with_users_local_browser_and_get_all_content_as_html,
-        ]
+        functions=default_tools.get_default_tool_registry().get_tools(),
+        on_tool_call_resolved=on_tool_call_resolved,
+        tool_result_cache=function_call_tool_result_cache,
+        tool_schema_variant=tool_schema_variant,
+        compact_tool_descriptions=default_tools.DEFAULT_COMPACT_TOOL_DESCRIPTIONS,
     )
 
     # show settings even if no user input yet
@@ -395,120 +720,153 @@ def main() -> None:
         value=10,
     )
 
-    # only run if new user input
-    if user_message_content := st.chat_input("What is your message?"):
-
-        # we only need to initialize the client when we actually make a call,
-        # we're doing slow synchronous calls so this is fine, since user
-        # interacts in between each one
-        #
-        # note: defaults to getting ANTHROPIC_API_KEY from environment
-        client = anthropic.Anthropic()
-
-        user_message: anthropic.types.MessageParam = {
-            "role": "user",
-            "content": [
-                {
-                    "type": "text",
-                    "text": user_message_content,
-                    # use caching (note: applies to whole message + tools + system prompt)
-                    "cache_control": {"type": "ephemeral"},
-                }
-            ],
-        }
-
-        # add user message to message history
-        conversation_manager.add_conversation_message(
-            selected_conversation_id,
-            user_message,
-        )
-
-        # display user message
-        display_message(user_message)
-
-        # retrieve history to send to client
-        messages = conversation_manager.get_conversation_messages(
-            selected_conversation_id
-        )
+    is_streaming_enabled = st.sidebar.checkbox(
+        "Stream responses",
+        value=True,
+    )
 
-        for iteration_count in range(max_iterations):
+    is_speculative_tool_execution_enabled = st.sidebar.checkbox(
+        "Start read only tools (ex: search) while the response is still streaming",
+        value=True,
+        disabled=not is_streaming_enabled,
+    )
 
-            if is_show_messages_between_tool_use_enabled:
-                st.write(messages)
+    context_token_budget = st.sidebar.number_input(
+        "Context token budget (stale tool results are compacted above this)",
+        min_value=1_000,
+        value=Defaults.CONTEXT_TOKEN_BUDGET,
+        step=1_000,
+    )
 
-            # TODO(bschoen): Cache subsequent messages instead of just the first
-            # note: the full api is `create` and `stream`
-            with st.spinner("Thinking..."):
-                response: anthropic.types.Message = client.messages.create(
-                    messages=messages,
-                    max_tokens=Defaults.MAX_TOKENS,
-                    model=Defaults.MODEL.value,
-                    system=selected_system_prompt,
-                    tools=function_call_handler.get_schema_for_tools_arg(),
-                    # needed for caching
-                    extra_headers={"anthropic-beta": "prompt-caching-2024-07-31"},
-                )
+    is_cache_warming_enabled = st.sidebar.checkbox(
+        "Warm prompt cache for new conversations",
+        value=True,
+    )
 
-            # TODO(bschoen): Show usage and potentially limit tokens
+    # for finding where a slow turn's time went, off by default since profiling slows tools down
+    is_tracing_enabled = st.sidebar.checkbox(
+        "Trace turns (Chrome trace JSON)",
+        value=False,
+    )
 
-            print(f"Response: {response.model_dump_json(indent=2)}")
+    if is_tracing_enabled:
+        display_latest_trace(selected_conversation_id)
 
-            # note: using dict representation for consistency with user_message + it's what API expects
-            response_message = response.model_dump(include=["role", "content"])
+    is_tool_profiling_enabled = st.sidebar.checkbox(
+        "Profile tool calls (cProfile)",
+        value=False,
+    )
 
-            # display agent message
-            display_message(response_message)
+    if is_tool_profiling_enabled:
+        display_latest_profiles()
 
-            # add response to message history
-            messages.append(response_message)
+    # write system prompt + tools to the cache while the user is typing their first message
+    if is_new_conversation_created and is_cache_warming_enabled:
 
-            if any(block.type == "tool_use" for block in response.content):
+        with st.spinner("Warming prompt cache..."):
+            warm_cache_usage = prompt_caching.warm_prompt_cache(
+                client=api_clients.get_anthropic_client(),
+                model=Defaults.MODEL.value,
+                system=selected_system_prompt,
+                tools=function_call_handler.get_schema_for_tools_arg(),
+            )
 
-                # collect tool results, as they all need to go in a single message
-                tool_results: anthropic.types.ToolResultBlockParam = []
+        print(f"Warmed prompt cache: {warm_cache_usage}")
 
-                # handle tool use
-                for response_block in response.content:
+    engine = get_agent_engine()
 
-                    if response_block.type == "tool_use":
+    # only run if new user input
+    if user_message_content := st.chat_input("What is your message?"):
 
-                        tool_result = function_call_handler.resolve(
-                            tool_call=response_block
-                        )
+        if engine.is_running(selected_conversation_id):
+            st.warning("Wait for the current turn to finish before sending a new message")
 
-                        tool_results.append(tool_result)
+        else:
+            user_message: anthropic.types.MessageParam = {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": user_message_content,
+                    }
+                ],
+            }
 
-                    elif response_block.type == "text":
+            # add user message to message history
+            conversation_manager.add_conversation_message(
+                selected_conversation_id,
+                user_message,
+            )
 
-                        print("Got text message.")
+            # display user message
+            display_message(user_message)
 
-                    else:
-                        raise ValueError(
-                            f"Unexpected response block type: {response_block.type} in {response_block}"
-                        )
+            # retrieve history to send to client
+            messages = conversation_manager.get_conversation_messages(
+                selected_conversation_id
+            )
 
-                tool_result_message: anthropic.types.MessageParam = {
-                    "role": "user",
-                    "content": tool_results,
-                }
+            num_messages_shown = len(messages)
 
-                conversation_manager.add_conversation_message(
-                    selected_conversation_id,
-                    tool_result_message,
-                )
+            if is_show_messages_between_tool_use_enabled:
+                st.write(messages)
 
-                display_message(tool_result_message)
+            # run the tool use loop in the background, so it isn't abandoned on rerun
+            engine.start_turn(
+                conversation_id=selected_conversation_id,
+                messages=messages,
+                function_call_handler=function_call_handler,
+                config=agent_engine.AgentTurnConfig(
+                    model=Defaults.MODEL.value,
+                    max_tokens=Defaults.MAX_TOKENS,
+                    system=selected_system_prompt,
+                    max_iterations=int(max_iterations),
+                    context_token_budget=int(context_token_budget),
+                    is_streaming_enabled=is_streaming_enabled,
+                    is_speculative_tool_execution_enabled=is_speculative_tool_execution_enabled,
+                    trace_directory=(
+                        tracing.DEFAULT_TRACE_DIRECTORY if is_tracing_enabled else None
+                    ),
+                    profile_directory=(
+                        tracing.DEFAULT_PROFILE_DIRECTORY
+                        if is_tool_profiling_enabled
+                        else None
+                    ),
+                ),
+                telemetry_recorder=telemetry_recorder,
+                # saves (and indexes) each message as the engine adds it, independent of rendering
+                message_sink=conversation_manager.add_conversation_message,
+            )
+
+    # render the selected conversation's turn while it's in progress (including one started
+    # before a rerun), until it finishes
+    if engine.is_running(selected_conversation_id):
+
+        display_turn_in_progress(
+            engine=engine,
+            conversation_id=selected_conversation_id,
+            num_messages_shown=num_messages_shown,
+            on_usage=lambda: display_telemetry_panel(
+                telemetry_panel,
+                telemetry_recorder.get_totals(selected_conversation_id),
+            ),
+            on_context_usage=on_context_usage,
+        )
 
-            # if no more tool use, break
-            else:
+    # otherwise show anything left over since the last script run (ex: a turn which finished in between)
+    else:
+        for event in engine.poll_events(selected_conversation_id):
 
-                print("No more tool use, breaking")
+            if (
+                isinstance(event, agent_engine.MessageAddedEvent)
+                and event.message_index >= num_messages_shown
+            ):
+                display_message(event.message)
 
-                # return, so we don't show the max iterations warning message when it doesn't apply
-                return None
+            if isinstance(event, agent_engine.ContextUsageEvent):
+                on_context_usage(event)
 
-        # TODO(bschoen): Error for max iterations
-        st.warning("Reached max iterations")
+            display_turn_finished_event(event)
 
 
 if __name__ == "__main__":
@@ -2,6 +2,7 @@ import streamlit as st
 import openai
 
 import datetime
+import time
 from typing import Iterable, Any
 import enum
 import json
@@ -10,6 +11,13 @@ import pathlib
 import coolname
 import pytz
 
+from local_claude.libs import api_clients
+from local_claude.libs import chat_completion_streaming
+from local_claude.libs import conversation_search
+from local_claude.libs import conversation_store
+from local_claude.libs import model_race
+from local_claude.libs import telemetry
+
 
 class Models(enum.Enum):
     O1_PREVIEW = "o1-preview"
@@ -31,11 +39,27 @@ class Defaults:
     # max_completion_tokens -> total actually generated (output + reasoning)
     MAX_COMPLETION_TOKENS = 16000
 
+    # how often a streaming response is checkpointed, so a refresh mid stream loses at most this much
+    DRAFT_CHECKPOINT_INTERVAL_SECONDS = 1.0
+
 
 type ConversationId = str
 MessageParam = Any  # openai.types.
 MessageContent = Any
 
+# distinguishes this app's conversations from `run_claude.py`'s in the shared search index
+CONVERSATION_SEARCH_SOURCE = "o1"
+
+# anthropic models that can be raced against the openai ones, since plain text conversations
+# are the same format for both
+RACE_ANTHROPIC_MODELS = ["claude-3-5-sonnet-20240620"]
+
+RACE_POLICY_BY_LABEL: dict[str, model_race.RacePolicy | None] = {
+    "Off": None,
+    "First wins (fastest answer, cancel the rest)": model_race.RacePolicy.FIRST_WINS,
+    "Compare (all answers side by side)": model_race.RacePolicy.COMPARE,
+}
+
 
 def generate_conversation_id() -> ConversationId:
     """
@@ -52,53 +76,63 @@ def generate_conversation_id() -> ConversationId:
     return f"{timestamp_string}__{unique_coolname}"
 
 
-def read_json_file(filepath: pathlib.Path) -> list[MessageParam]:
-    """
-    Read and return the data from a JSON file.
-    """
-    with filepath.open("r", encoding="utf-8") as file:
-        return json.load(file)
+@st.cache_resource
+def get_conversation_store() -> conversation_store.JsonlConversationStore:
+    """Get the conversation store, kept across reruns so its parsed file cache is reused."""
+
+    return conversation_store.JsonlConversationStore(pathlib.Path("conversations"))
 
 
-def write_json_file(filepath: pathlib.Path, data: list[MessageParam]) -> None:
-    """Write data to a JSON file."""
+@st.cache_resource
+def get_conversation_search_index() -> conversation_search.ConversationSearchIndex:
+    """Get the search index, shared by all sessions in the process (and with `run_claude.py`)."""
 
-    with filepath.open("w", encoding="utf-8") as file:
-        json.dump(data, file, ensure_ascii=False, indent=4)
+    search_index = conversation_search.ConversationSearchIndex(
+        conversation_search.DEFAULT_SEARCH_INDEX_FILEPATH
+    )
+
+    # catch up on conversations stored without indexing (ex: before search existed)
+    conversation_search.sync_search_index(
+        search_index,
+        get_conversation_store(),
+        source=CONVERSATION_SEARCH_SOURCE,
+    )
+
+    return search_index
 
 
 class ConversationManager:
     """
-    Handles getting and setting conversations and messages using JSON files in a subdirectory.
+    Handles getting and setting conversations and messages using JSONL files in a subdirectory.
 
-    Each conversation is stored as a separate JSON file named <conversation-id>.json
-    within the 'conversations' directory.
+    Each conversation is stored as a separate append only file named <conversation-id>.jsonl
+    within the 'conversations' directory, see `conversation_store.JsonlConversationStore`.
 
     This approach replaces the use of Streamlit's session state with persistent storage.
-    """
 
-    _CONVERSATIONS_DIR = pathlib.Path("conversations")
+    Messages are also added to the search index as they're added.
+    """
 
     def __init__(self) -> None:
 
-        # Create the conversations directory if it doesn't exist
-        self._CONVERSATIONS_DIR.mkdir(exist_ok=True)
+        self._store = get_conversation_store()
+        self._search_index = get_conversation_search_index()
 
     def get_conversation_ids(self) -> list[ConversationId]:
         """
-        Returns a list of all conversation IDs by listing JSON files in the conversations directory.
+        Returns a list of all conversation IDs, oldest first, from the conversations index.
         """
-        return [filepath.stem for filepath in self._CONVERSATIONS_DIR.glob("*.json")]
+        return self._store.get_conversation_ids()
 
     def get_conversation_messages(self, conversation_id: ConversationId) -> list[MessageParam]:
         """
-        Retrieves the list of messages for a given conversation ID by loading the corresponding JSON file.
+        Retrieves the list of messages for a given conversation ID, only re-parsing the file if it changed.
         """
-        filepath = self._CONVERSATIONS_DIR / f"{conversation_id}.json"
+        filepath = self._store.get_conversation_filepath(conversation_id)
 
         st.write(f"Loading conversation from: {filepath.resolve()}")
 
-        return read_json_file(filepath)
+        return self._store.get_messages(conversation_id)
 
     def add_conversation_message(
         self,
@@ -106,22 +140,81 @@ class ConversationManager:
         message: MessageParam,
     ) -> None:
         """
-        Adds a new message to the specified conversation and saves it back to the JSON file.
+        Appends a new message to the specified conversation's file, and indexes it for search.
         """
-        filepath = self._CONVERSATIONS_DIR / f"{conversation_id}.json"
-        messages = read_json_file(filepath)
-        messages.append(message)
-        write_json_file(filepath, messages)
+        self._store.append_message(conversation_id, message)
+
+        self._search_index.index_message(
+            CONVERSATION_SEARCH_SOURCE,
+            conversation_id,
+            message_index=self._store.get_num_messages(conversation_id) - 1,
+            message=message,
+        )
 
     def create_new_conversation(self) -> ConversationId:
         """
-        Creates a new conversation by generating a unique ID and initializing an empty JSON file.
+        Creates a new conversation by generating a unique ID and adding it to the index.
         """
         conversation_id = generate_conversation_id()
-        filepath = self._CONVERSATIONS_DIR / f"{conversation_id}.json"
-        write_json_file(filepath, [])
+        self._store.create_conversation(conversation_id)
         return conversation_id
 
+    def save_draft_message(self, conversation_id: ConversationId, message: MessageParam) -> None:
+        """
+        Checkpoints a response that's still streaming, replacing any previous checkpoint.
+        """
+        self._store.save_draft_message(conversation_id, message)
+
+    def get_draft_message(self, conversation_id: ConversationId) -> MessageParam | None:
+        """
+        Returns the checkpoint of a response that never finished streaming (ex: the page was refreshed), if any.
+        """
+        return self._store.get_draft_message(conversation_id)
+
+    def clear_draft_message(self, conversation_id: ConversationId) -> None:
+        self._store.clear_draft_message(conversation_id)
+
+
+def display_conversation_search(
+    search_index: conversation_search.ConversationSearchIndex,
+) -> None:
+    """Sidebar search over this app's conversations, with a button to open each result."""
+
+    search_query = st.sidebar.text_input("Search conversations")
+
+    if not search_query:
+        return None
+
+    search_results = search_index.search(
+        search_query,
+        source=CONVERSATION_SEARCH_SOURCE,
+    )
+
+    if not search_results:
+        st.sidebar.caption("No matches")
+        return None
+
+    for search_result in search_results:
+
+        st.sidebar.markdown(
+            f"`{search_result.conversation_id}` ({search_result.role}, "
+            f"message {search_result.message_index})\n\n{search_result.snippet}"
+        )
+
+        # note: set in a callback, since the selectbox's state can't be changed once it's rendered
+        def open_conversation(
+            conversation_id: ConversationId = search_result.conversation_id,
+        ) -> None:
+            st.session_state.selected_conversation_id = conversation_id
+
+        st.sidebar.button(
+            "Open",
+            key=f"open_search_result_{search_result.conversation_id}_{search_result.message_index}",
+            on_click=open_conversation,
+        )
+
+    return None
+
 
 def try_load_json_or_default_to_string(json_string: str) -> str:
     try:
@@ -148,6 +241,169 @@ def display_message(message: MessageParam) -> None:
         display_message_content(message["content"])
 
 
+def display_interrupted_response(
+    conversation_manager: ConversationManager,
+    conversation_id: ConversationId,
+) -> None:
+    """Show a response that was checkpointed mid stream, letting the user keep or discard it."""
+
+    draft_message = conversation_manager.get_draft_message(conversation_id)
+
+    if draft_message is None:
+        return None
+
+    st.warning("The last response was interrupted before it finished streaming")
+
+    display_message(draft_message)
+
+    # note: callbacks, so the change is visible in the rerun they trigger
+    def keep_partial_response() -> None:
+        conversation_manager.add_conversation_message(conversation_id, draft_message)
+        conversation_manager.clear_draft_message(conversation_id)
+
+    def discard_partial_response() -> None:
+        conversation_manager.clear_draft_message(conversation_id)
+
+    keep_column, discard_column = st.columns(2)
+
+    keep_column.button("Keep partial response", on_click=keep_partial_response)
+    discard_column.button("Discard partial response", on_click=discard_partial_response)
+
+    return None
+
+
+def stream_response(
+    client: openai.OpenAI,
+    conversation_manager: ConversationManager,
+    conversation_id: ConversationId,
+    **kwargs: Any,
+) -> tuple[chat_completion_streaming.ChatCompletionAccumulator, float | None]:
+    """
+    Stream a response into the page as it's generated, periodically checkpointing it as a draft.
+
+    Returns the accumulated response, and the time to first token.
+
+    The draft is left in place if streaming fails, so the output isn't lost, and should be cleared
+    by the caller once the full response is saved.
+
+    """
+
+    with st.chat_message("assistant"):
+        placeholder = st.empty()
+
+    text_deltas: list[str] = []
+    start_time = last_checkpoint_time = time.perf_counter()
+    time_to_first_token_seconds: float | None = None
+
+    def on_text_delta(text_delta: str) -> None:
+        nonlocal last_checkpoint_time, time_to_first_token_seconds
+
+        if time_to_first_token_seconds is None:
+            time_to_first_token_seconds = time.perf_counter() - start_time
+
+        text_deltas.append(text_delta)
+
+        partial_text = "".join(text_deltas)
+
+        placeholder.markdown(partial_text)
+
+        if time.perf_counter() - last_checkpoint_time < Defaults.DRAFT_CHECKPOINT_INTERVAL_SECONDS:
+            return None
+
+        conversation_manager.save_draft_message(
+            conversation_id,
+            {"role": "assistant", "content": partial_text},
+        )
+
+        last_checkpoint_time = time.perf_counter()
+
+    accumulator = chat_completion_streaming.stream_chat_completion(
+        client,
+        on_text_delta=on_text_delta,
+        **kwargs,
+    )
+
+    return accumulator, time_to_first_token_seconds
+
+
+def display_usage(model: str, usage: chat_completion_streaming.ChatCompletionUsage) -> None:
+
+    st.caption(
+        f"`{model}`: {usage.input_tokens} input / {usage.output_tokens} output tokens "
+        f"({usage.reasoning_tokens} reasoning)"
+    )
+
+
+def make_model_call(model: str, messages: list[MessageParam]) -> model_race.ModelCall:
+
+    if model in RACE_ANTHROPIC_MODELS:
+        return lambda: model_race.get_anthropic_answer(
+            api_clients.get_async_anthropic_client(),
+            model=model,
+            messages=messages,
+            max_tokens=Defaults.MAX_TOKENS,
+        )
+
+    # o1 models don't support streaming, and limit total tokens including reasoning
+    if model.startswith("o1"):
+        return lambda: model_race.get_openai_answer(
+            api_clients.get_async_openai_client(),
+            model=model,
+            messages=messages,
+            is_streaming_enabled=False,
+            max_completion_tokens=Defaults.MAX_COMPLETION_TOKENS,
+        )
+
+    return lambda: model_race.get_openai_answer(
+        api_clients.get_async_openai_client(),
+        model=model,
+        messages=messages,
+        max_tokens=Defaults.MAX_TOKENS,
+    )
+
+
+def display_model_answer_metrics(model_answer: model_race.ModelAnswer) -> None:
+
+    time_to_first_token = (
+        f"{model_answer.time_to_first_token_seconds:.2f}s"
+        if model_answer.time_to_first_token_seconds is not None
+        else "n/a"
+    )
+
+    st.caption(
+        f"`{model_answer.model}`: {model_answer.latency_seconds:.2f}s total, "
+        f"{time_to_first_token} to first token, {model_answer.input_tokens} input / "
+        f"{model_answer.output_tokens} output tokens ({model_answer.reasoning_tokens} reasoning)"
+    )
+
+
+def display_race_result(
+    race_result: model_race.RaceResult,
+    race_policy: model_race.RacePolicy,
+) -> None:
+    """Show how each raced model did, the fastest answer is shown (and saved) as the response."""
+
+    if race_policy == model_race.RacePolicy.COMPARE and race_result.answers:
+
+        for column, model_answer in zip(
+            st.columns(len(race_result.answers)),
+            race_result.answers,
+        ):
+            with column:
+                display_model_answer_metrics(model_answer)
+                st.markdown(model_answer.text)
+
+    elif race_result.answers:
+        display_model_answer_metrics(race_result.answers[0])
+
+    if race_result.cancelled_models:
+        st.caption(f"Cancelled: {', '.join(race_result.cancelled_models)}")
+
+    for model, error_traceback in race_result.error_by_model.items():
+        st.error(f"`{model}` failed")
+        st.code(error_traceback)
+
+
 # TODO(bschoen): Should we make all tools read and write from files, like kubeflow?
 def main() -> None:
 
@@ -179,12 +435,29 @@ def main() -> None:
         ],
     )
 
+    # send each message to several models at once, for comparing latency
+    race_policy = RACE_POLICY_BY_LABEL[
+        st.sidebar.selectbox("Race models", options=list(RACE_POLICY_BY_LABEL))
+    ]
+
+    race_models = st.sidebar.multiselect(
+        "Models to race",
+        options=[x.value for x in Models] + RACE_ANTHROPIC_MODELS,
+        default=[Models.GPT_4O_MINI.value, *RACE_ANTHROPIC_MODELS],
+        disabled=race_policy is None,
+    )
+
     # initialize conversation manager to handle state
     conversation_manager = ConversationManager()
 
     # allow creating new conversations
     if st.sidebar.button("New Conversation"):
-        conversation_manager.create_new_conversation()
+        # select it, since it's what the user will want to use next
+        st.session_state.selected_conversation_id = (
+            conversation_manager.create_new_conversation()
+        )
+
+    display_conversation_search(get_conversation_search_index())
 
     # select conversation id
     conversation_ids = conversation_manager.get_conversation_ids()
@@ -199,6 +472,7 @@ def main() -> None:
     selected_conversation_id = st.selectbox(
         "Select Conversation",
         conversation_ids[::-1],
+        key="selected_conversation_id",
     )
 
     assert selected_conversation_id
@@ -207,15 +481,16 @@ def main() -> None:
     for message in conversation_manager.get_conversation_messages(selected_conversation_id):
         display_message(message)
 
+    display_interrupted_response(conversation_manager, selected_conversation_id)
+
     # only run if new user input
     if user_message_content := st.chat_input("What is your message?"):
 
-        # we only need to initialize the client when we actually make a call,
-        # we're doing slow synchronous calls so this is fine, since user
-        # interacts in between each one
+        # shared by every session in the process, so connections are reused between turns
+        # and concurrent sessions share rate limits
         #
-        # note: defaults to getting ANTHROPIC_API_KEY from environment
-        client = openai.OpenAI()
+        # note: defaults to getting OPENAI_API_KEY from environment
+        client = api_clients.get_openai_client()
 
         user_message: MessageParam = {
             "role": "user",
@@ -239,43 +514,109 @@ def main() -> None:
         # if is_show_messages_between_tool_use_enabled:
         #    st.write(messages)
 
-        # TODO(bschoen): Cache subsequent messages instead of just the first
-        # note: the full api is `create` and `stream`
-        with st.spinner("Thinking..."):
+        if race_policy is not None and race_models:
+
+            with st.spinner(f"Racing {', '.join(race_models)}..."):
+
+                # note: a new event loop per race, which only lives for the script run
+                race_result = model_race.run_race(
+                    {x: make_model_call(x, messages) for x in race_models},
+                    policy=race_policy,
+                )
+
+            # record every model's latency, for comparing distributions across conversations
+            telemetry_recorder = telemetry.TelemetryRecorder()
+
+            for model_answer in race_result.answers:
+                telemetry_recorder.record(
+                    model_answer.to_model_call_record(selected_conversation_id)
+                )
 
-            kwargs = {
-                "messages": messages,
-                "model": selected_model,
+            display_race_result(race_result, race_policy)
+
+            if not race_result.answers:
+                return None
+
+            race_response_message = {
+                "role": "assistant",
+                "content": race_result.answers[0].text,
             }
 
-            if selected_model.startswith("o1"):
-                kwargs.update({"max_completion_tokens": Defaults.MAX_COMPLETION_TOKENS})
-            else:
-                kwargs.update({"max_tokens": Defaults.MAX_TOKENS})
+            conversation_manager.add_conversation_message(
+                selected_conversation_id,
+                race_response_message,
+            )
+
+            display_message(race_response_message)
+
+            return None
+
+        kwargs = {
+            "messages": messages,
+            "model": selected_model,
+        }
+
+        start_time = time.perf_counter()
+
+        # o1 models don't support streaming, and limit total tokens including reasoning
+        if selected_model.startswith("o1"):
 
-            response = client.chat.completions.create(**kwargs)
+            kwargs.update({"max_completion_tokens": Defaults.MAX_COMPLETION_TOKENS})
 
-        # TODO(bschoen): Show usage and potentially limit tokens
+            with st.spinner("Thinking..."):
+                response = client.chat.completions.create(**kwargs)
 
-        print(f"Response: {response.model_dump_json(indent=2)}")
+            response_text = response.choices[0].message.content or ""
+            usage = chat_completion_streaming.ChatCompletionUsage.from_usage(response.usage)
+
+            time_to_first_token_seconds = None
+
+        else:
+
+            kwargs.update({"max_tokens": Defaults.MAX_TOKENS})
+
+            # note: rendered as it arrives, so no separate `display_message` is needed
+            accumulator, time_to_first_token_seconds = stream_response(
+                client,
+                conversation_manager,
+                selected_conversation_id,
+                **kwargs,
+            )
+
+            response_text = accumulator.get_text()
+            usage = accumulator.usage
+
+        telemetry.TelemetryRecorder().record(
+            telemetry.ModelCallRecord(
+                conversation_id=selected_conversation_id,
+                model=selected_model,
+                latency_seconds=time.perf_counter() - start_time,
+                time_to_first_token_seconds=time_to_first_token_seconds,
+                input_tokens=usage.input_tokens,
+                output_tokens=usage.output_tokens,
+                cache_read_input_tokens=0,
+                cache_creation_input_tokens=0,
+                reasoning_tokens=usage.reasoning_tokens,
+            )
+        )
 
         # note: using dict representation for consistency with user_message + it's what API expects
         response_message = {
             "role": "assistant",
-            "content": response.choices[0].message.content,
+            "content": response_text,
         }
 
-        # add response to conversation
+        # add response to conversation, then drop the checkpoint now that it's fully saved
         conversation_manager.add_conversation_message(
             selected_conversation_id,
             response_message,
         )
+        conversation_manager.clear_draft_message(selected_conversation_id)
 
-        # display agent message
-        display_message(response_message)
+        if selected_model.startswith("o1"):
+            display_message(response_message)
 
-        # add response to message history
-        messages.append(response_message)
+        display_usage(selected_model, usage)
 
 
 if __name__ == "__main__":
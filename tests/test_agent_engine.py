@@ -0,0 +1,478 @@
+import asyncio
+import json
+import pathlib
+import threading
+
+import anthropic
+import httpx
+
+from local_claude.libs import agent_engine
+from local_claude.libs import conversation_store
+from local_claude.libs import directory_utils
+from local_claude.libs.function_call_handler import FunctionCallHandler
+from local_claude.libs.tool_options import tool_options
+
+from benchmarks import fake_messages_api
+
+
+def add_one(value: int) -> int:
+    """
+    Add one to the value.
+
+    Args:
+        value (int): The value to add one to.
+
+    """
+
+    return value + 1
+
+
+def test_agent_engine_runs_tool_loop_in_background() -> None:
+    """Check a turn runs to completion in the background, emitting events in order."""
+
+    # scripted responses, first a tool use then a final answer
+    responses = [
+        fake_messages_api.make_tool_use_message_json(
+            tool_use_id="toolu_fake",
+            name="add_one",
+            tool_input={"value": 41},
+        ),
+        fake_messages_api.make_text_message_json("The answer is 42"),
+    ]
+
+    requests: list[dict] = []
+
+    def handle_request(request: httpx.Request) -> httpx.Response:
+        requests.append(json.loads(request.content))
+        return httpx.Response(200, json=responses[len(requests) - 1])
+
+    client = anthropic.AsyncAnthropic(
+        api_key="fake_api_key",
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handle_request)),
+    )
+
+    engine = agent_engine.AgentEngine(client=client)
+
+    messages: list[anthropic.types.MessageParam] = [
+        {"role": "user", "content": "What is 41 + 1?"}
+    ]
+
+    store = conversation_store.InMemoryConversationStore()
+    store.create_conversation("conversation_a")
+    store.append_message("conversation_a", messages[0])
+
+    with directory_utils.temporary_working_directory():
+
+        future = engine.start_turn(
+            conversation_id="conversation_a",
+            messages=messages,
+            function_call_handler=FunctionCallHandler(functions=[add_one]),
+            config=agent_engine.AgentTurnConfig(
+                model="claude-3-5-sonnet-20240620",
+                max_tokens=1024,
+                system="You are a helpful assistant",
+                max_iterations=10,
+                context_token_budget=50_000,
+                is_streaming_enabled=False,
+            ),
+            message_sink=store.append_message,
+        )
+
+        all_messages = future.result(timeout=10.0)
+
+    assert not engine.is_running("conversation_a")
+
+    events = engine.poll_events("conversation_a")
+
+    assert [type(x).__name__ for x in events] == [
+        "ContextUsageEvent",
+        "UsageEvent",
+        "MessageAddedEvent",
+        "ToolStartedEvent",
+        "ToolFinishedEvent",
+        "MessageAddedEvent",
+        "ContextUsageEvent",
+        "UsageEvent",
+        "MessageAddedEvent",
+        "TurnFinishedEvent",
+    ]
+
+    assert events[-1].reason == "end_turn"
+
+    # messages are saved by the engine, whether or not events are polled
+    assert store.get_messages("conversation_a") == all_messages
+    assert len(all_messages) == 4
+    assert [x.message_index for x in events if isinstance(x, agent_engine.MessageAddedEvent)] == [
+        1,
+        2,
+        3,
+    ]
+    assert events[4].tool_result["content"] == "42"
+
+    # recorded with each model call, for comparing tool schema variants
+    assert events[1].model_call_record.tool_schema_variant == "full"
+
+    # check the caller's messages weren't modified, and the second request included the tool result
+    assert len(messages) == 1
+    assert requests[1]["messages"][-1]["content"][0]["tool_use_id"] == "toolu_fake"
+
+    # check events were drained
+    assert engine.poll_events("conversation_a") == []
+
+    engine.shutdown()
+
+
+@tool_options(is_side_effect_safe=True)
+def add_two(value: int) -> int:
+    """
+    Add two to the value.
+
+    Args:
+        value (int): The value to add two to.
+
+    """
+
+    return value + 2
+
+
+def test_agent_engine_starts_side_effect_safe_tools_while_streaming() -> None:
+    """Check side effect safe tools start before the rest of the response streams, and results stay in block order."""
+
+    def script(request_json: dict) -> fake_messages_api.MessageJson:
+
+        if len(request_json["messages"]) > 1:
+            return fake_messages_api.make_text_message_json("Done")
+
+        # tool use blocks followed by text, so there's still streaming after them
+        return fake_messages_api.make_message_json(
+            content=[
+                {
+                    "type": "tool_use",
+                    "id": "toolu_a",
+                    "name": "add_one",
+                    "input": {"value": 1},
+                },
+                {
+                    "type": "tool_use",
+                    "id": "toolu_b",
+                    "name": "add_two",
+                    "input": {"value": 1},
+                },
+                {"type": "text", "text": "Running both tools."},
+            ],
+            stop_reason="tool_use",
+        )
+
+    fake_api = fake_messages_api.ScriptedMessagesApi(script=script)
+
+    engine = agent_engine.AgentEngine(
+        client=anthropic.AsyncAnthropic(
+            api_key="fake_api_key",
+            http_client=httpx.AsyncClient(transport=fake_api.get_transport()),
+        )
+    )
+
+    with directory_utils.temporary_working_directory():
+
+        messages = engine.start_turn(
+            conversation_id="conversation_a",
+            messages=[{"role": "user", "content": "Add one and two to 1"}],
+            function_call_handler=FunctionCallHandler(functions=[add_one, add_two]),
+            config=agent_engine.AgentTurnConfig(
+                model="claude-3-5-sonnet-20240620",
+                max_tokens=1024,
+                system="You are a helpful assistant",
+                max_iterations=10,
+                context_token_budget=50_000,
+                is_speculative_tool_execution_enabled=True,
+            ),
+        ).result(timeout=10.0)
+
+    events = engine.poll_events("conversation_a")
+
+    engine.shutdown()
+
+    event_names = [
+        (type(x).__name__, x.tool_call.id if hasattr(x, "tool_call") else None)
+        for x in events
+    ]
+
+    # only `add_two` is started before the text after it streams
+    first_text_delta_index = event_names.index(("TextDeltaEvent", None))
+
+    assert event_names.index(("ToolStartedEvent", "toolu_b")) < first_text_delta_index
+    assert event_names.index(("ToolStartedEvent", "toolu_a")) > first_text_delta_index
+
+    assert [x["tool_use_id"] for x in messages[2]["content"]] == ["toolu_a", "toolu_b"]
+    assert [x["content"] for x in messages[2]["content"]] == ["2", "3"]
+
+
+fetch_slowly_finished = threading.Event()
+
+
+@tool_options(is_side_effect_safe=True)
+async def fetch_slowly(value: int) -> str:
+    """
+    Wait on a (fake) network call, then return the value.
+
+    Args:
+        value (int): The value to return.
+
+    """
+
+    await asyncio.sleep(0.5)
+
+    fetch_slowly_finished.set()
+
+    return f"fetched-{value}"
+
+
+def test_agent_engine_cancels_speculative_tools_if_stream_fails() -> None:
+
+    # the tool use block streams completely, then the API errors before the message finishes
+    stream_events = fake_messages_api.message_json_to_stream_events(
+        fake_messages_api.make_tool_use_message_json(
+            tool_use_id="toolu_a",
+            name="fetch_slowly",
+            tool_input={"value": 1},
+        )
+    )[:-2] + [{"type": "error", "error": {"type": "overloaded_error", "message": "Overloaded"}}]
+
+    def handle_request(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(
+            200,
+            headers={"content-type": "text/event-stream"},
+            content="".join(
+                f"event: {x['type']}\ndata: {json.dumps(x)}\n\n" for x in stream_events
+            ).encode("utf-8"),
+        )
+
+    engine = agent_engine.AgentEngine(
+        client=anthropic.AsyncAnthropic(
+            api_key="fake_api_key",
+            http_client=httpx.AsyncClient(transport=httpx.MockTransport(handle_request)),
+        )
+    )
+
+    with directory_utils.temporary_working_directory():
+
+        engine.start_turn(
+            conversation_id="conversation_a",
+            messages=[{"role": "user", "content": "Fetch 1"}],
+            function_call_handler=FunctionCallHandler(functions=[fetch_slowly]),
+            config=agent_engine.AgentTurnConfig(
+                model="claude-3-5-sonnet-20240620",
+                max_tokens=1024,
+                system="You are a helpful assistant",
+                max_iterations=10,
+                context_token_budget=50_000,
+                is_speculative_tool_execution_enabled=True,
+            ),
+        ).result(timeout=10.0)
+
+    events = engine.poll_events("conversation_a")
+
+    engine.shutdown()
+
+    assert [type(x).__name__ for x in events] == [
+        "ContextUsageEvent",
+        "ToolStartedEvent",
+        "TurnFinishedEvent",
+    ]
+    assert events[-1].reason == "error"
+
+    # cancelled, rather than left running on the engine's loop
+    assert not fetch_slowly_finished.wait(timeout=1.0)
+
+
+def test_agent_engine_collapses_unpolled_text_deltas() -> None:
+
+    text = "The answer is 42. " * 50
+
+    fake_api = fake_messages_api.ScriptedMessagesApi(
+        script=lambda request_json: fake_messages_api.make_text_message_json(text)
+    )
+
+    engine = agent_engine.AgentEngine(
+        client=anthropic.AsyncAnthropic(
+            api_key="fake_api_key",
+            http_client=httpx.AsyncClient(transport=fake_api.get_transport()),
+        )
+    )
+
+    with directory_utils.temporary_working_directory():
+
+        engine.start_turn(
+            conversation_id="conversation_a",
+            messages=[{"role": "user", "content": "What is 41 + 1?"}],
+            function_call_handler=FunctionCallHandler(functions=[add_one]),
+            config=agent_engine.AgentTurnConfig(
+                model="claude-3-5-sonnet-20240620",
+                max_tokens=1024,
+                system="You are a helpful assistant",
+                max_iterations=10,
+                context_token_budget=50_000,
+            ),
+        ).result(timeout=10.0)
+
+    events = engine.poll_events("conversation_a")
+
+    engine.shutdown()
+
+    (text_delta_event,) = [x for x in events if isinstance(x, agent_engine.TextDeltaEvent)]
+
+    assert text_delta_event.text == text
+    assert text_delta_event.snapshot == text
+
+
+def test_agent_engine_refuses_requests_over_context_window() -> None:
+
+    fake_api = fake_messages_api.ScriptedMessagesApi(
+        script=lambda request_json: fake_messages_api.make_text_message_json("Hello")
+    )
+
+    engine = agent_engine.AgentEngine(
+        client=anthropic.AsyncAnthropic(
+            api_key="fake_api_key",
+            http_client=httpx.AsyncClient(transport=fake_api.get_transport()),
+        )
+    )
+
+    with directory_utils.temporary_working_directory():
+
+        engine.start_turn(
+            conversation_id="conversation_a",
+            messages=[{"role": "user", "content": "Hi " * 1000}],
+            function_call_handler=FunctionCallHandler(functions=[add_one]),
+            config=agent_engine.AgentTurnConfig(
+                model="claude-3-5-sonnet-20240620",
+                max_tokens=1024,
+                system="You are a helpful assistant",
+                max_iterations=10,
+                context_token_budget=50_000,
+                context_window_tokens=1_500,
+            ),
+        ).result(timeout=10.0)
+
+    context_usage_event, turn_finished_event = engine.poll_events("conversation_a")
+
+    engine.shutdown()
+
+    assert isinstance(context_usage_event, agent_engine.ContextUsageEvent)
+    assert context_usage_event.request_token_count.get_total_tokens() > 1_500
+
+    assert isinstance(turn_finished_event, agent_engine.TurnFinishedEvent)
+    assert turn_finished_event.reason == "error"
+    assert "ContextWindowExceededError" in str(turn_finished_event.error_traceback)
+
+    # never sent
+    assert fake_api.num_requests == 0
+
+
+def test_agent_engine_writes_turn_trace() -> None:
+
+    def script(request_json: dict) -> fake_messages_api.MessageJson:
+
+        if len(request_json["messages"]) > 1:
+            return fake_messages_api.make_text_message_json("Done")
+
+        return fake_messages_api.make_tool_use_message_json(
+            tool_use_id="toolu_a",
+            name="add_one",
+            tool_input={"value": 1},
+        )
+
+    fake_api = fake_messages_api.ScriptedMessagesApi(script=script)
+
+    engine = agent_engine.AgentEngine(
+        client=anthropic.AsyncAnthropic(
+            api_key="fake_api_key",
+            http_client=httpx.AsyncClient(transport=fake_api.get_transport()),
+        )
+    )
+
+    with directory_utils.temporary_working_directory():
+
+        engine.start_turn(
+            conversation_id="conversation_a",
+            messages=[{"role": "user", "content": "Add one to 1"}],
+            function_call_handler=FunctionCallHandler(functions=[add_one]),
+            config=agent_engine.AgentTurnConfig(
+                model="claude-3-5-sonnet-20240620",
+                max_tokens=1024,
+                system="You are a helpful assistant",
+                max_iterations=10,
+                context_token_budget=50_000,
+                trace_directory=pathlib.Path("traces"),
+            ),
+        ).result(timeout=10.0)
+
+        (trace_filepath,) = pathlib.Path("traces").glob("conversation_a_*.json")
+
+        trace = json.loads(trace_filepath.read_text())
+
+    engine.shutdown()
+
+    span_names = [x["name"] for x in trace["traceEvents"] if x["ph"] == "X"]
+
+    assert span_names.count("model_call") == 2
+    assert "resolve:add_one" in span_names
+    assert "add_one" in span_names
+    assert span_names[-1] == "turn"
+
+
+def test_agent_engine_drops_finished_turns_once_polled() -> None:
+
+    fake_api = fake_messages_api.ScriptedMessagesApi(
+        script=lambda request_json: fake_messages_api.make_text_message_json("Hello")
+    )
+
+    engine = agent_engine.AgentEngine(
+        client=anthropic.AsyncAnthropic(
+            api_key="fake_api_key",
+            http_client=httpx.AsyncClient(transport=fake_api.get_transport()),
+        )
+    )
+
+    config = agent_engine.AgentTurnConfig(
+        model="claude-3-5-sonnet-20240620",
+        max_tokens=1024,
+        system="You are a helpful assistant",
+        max_iterations=10,
+        context_token_budget=50_000,
+    )
+
+    store = conversation_store.InMemoryConversationStore()
+    store.create_conversation("conversation_a")
+
+    token_counters = []
+
+    with directory_utils.temporary_working_directory():
+
+        for user_message in ["Hi", "Hi again"]:
+
+            store.append_message("conversation_a", {"role": "user", "content": user_message})
+
+            engine.start_turn(
+                conversation_id="conversation_a",
+                messages=store.get_messages("conversation_a"),
+                function_call_handler=FunctionCallHandler(functions=[add_one]),
+                config=config,
+                message_sink=store.append_message,
+            ).result(timeout=10.0)
+
+            # still available after the turn finished, until polled
+            assert isinstance(
+                engine.poll_events("conversation_a")[-1], agent_engine.TurnFinishedEvent
+            )
+            assert "conversation_a" not in engine._run_state_by_conversation_id
+
+            token_counters.append(engine._get_token_counter("conversation_a"))
+
+    # kept across turns, so messages from the first turn weren't counted again
+    assert token_counters[0] is token_counters[1]
+    assert token_counters[1].num_messages_counted == 3
+
+    engine.shutdown()
+
+    assert not engine._thread.is_alive()
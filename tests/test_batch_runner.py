@@ -0,0 +1,106 @@
+import json
+import pathlib
+
+import anthropic
+import httpx
+import pytest
+
+from local_claude.libs import agent_engine
+from local_claude.libs import batch_runner
+from local_claude.libs import directory_utils
+from local_claude.libs.tools.save_to_workspace_file import (
+    save_content_to_persistent_file_in_workspace,
+)
+
+from benchmarks import fake_messages_api
+
+
+def script(request_json: dict) -> fake_messages_api.MessageJson:
+    """Fake model which saves the prompt to a file, then finishes."""
+
+    messages = request_json["messages"]
+
+    if len(messages) == 1:
+        # note: content is converted to blocks to add cache breakpoints
+        prompt = messages[0]["content"][0]["text"]
+
+        return fake_messages_api.make_tool_use_message_json(
+            tool_use_id="toolu_fake",
+            name="save_content_to_persistent_file_in_workspace",
+            tool_input={"filename": "prompt.txt", "content": prompt},
+        )
+
+    return fake_messages_api.make_text_message_json("Done")
+
+
+def test_run_batch() -> None:
+    """Check every prompt is run, with isolated workspaces, and transcripts are written."""
+
+    engine = agent_engine.AgentEngine(
+        client=anthropic.AsyncAnthropic(
+            api_key="fake_api_key",
+            http_client=httpx.AsyncClient(
+                transport=fake_messages_api.ScriptedMessagesApi(script=script).get_transport()
+            ),
+        )
+    )
+
+    with directory_utils.temporary_working_directory() as tmp_dir:
+
+        prompts_filepath = pathlib.Path("prompts.jsonl")
+        prompts_filepath.write_text(
+            "\n".join(json.dumps({"id": f"p{i}", "prompt": f"prompt {i}"}) for i in range(6))
+        )
+
+        output_dir = pathlib.Path(tmp_dir) / "batch_output"
+
+        summary = batch_runner.run_batch(
+            prompts=batch_runner.read_batch_prompts(prompts_filepath),
+            functions=[save_content_to_persistent_file_in_workspace],
+            config=agent_engine.AgentTurnConfig(
+                model="claude-3-5-sonnet-20240620",
+                max_tokens=1024,
+                system="You are a helpful assistant",
+                max_iterations=10,
+                context_token_budget=50_000,
+                is_streaming_enabled=False,
+            ),
+            output_dir=output_dir,
+            concurrency=3,
+            engine=engine,
+        )
+
+        engine.shutdown()
+
+        assert summary.num_conversations == 6
+        assert summary.num_errors == 0
+
+        # check each conversation wrote to its own workspace
+        for i in range(6):
+            assert (output_dir / "workspaces" / f"p{i}" / "prompt.txt").read_text() == f"prompt {i}"
+
+        # check transcripts
+        transcripts = [
+            json.loads(x)
+            for x in (output_dir / "transcripts.jsonl").read_text().splitlines()
+        ]
+
+        assert sorted(x["prompt_id"] for x in transcripts) == [f"p{i}" for i in range(6)]
+
+        for transcript in transcripts:
+            assert transcript["finish_reason"] == "end_turn"
+            assert len(transcript["messages"]) == 4
+            assert transcript["usage"]["model_calls"] == 2
+            assert transcript["usage"]["tool_calls"] == 1
+
+
+@pytest.mark.parametrize("prompt_id", ["../outside", "a/b", "..", ""])
+def test_read_batch_prompts_rejects_ids_outside_workspaces(prompt_id: str) -> None:
+
+    with directory_utils.temporary_working_directory():
+
+        prompts_filepath = pathlib.Path("prompts.jsonl")
+        prompts_filepath.write_text(json.dumps({"id": prompt_id, "prompt": "Hi"}))
+
+        with pytest.raises(ValueError, match="Prompt id"):
+            batch_runner.read_batch_prompts(prompts_filepath)
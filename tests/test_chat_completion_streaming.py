@@ -0,0 +1,73 @@
+import json
+
+import httpx
+import pytest
+
+from local_claude.libs import chat_completion_streaming
+
+
+def _make_chunk(content: str | None, usage: dict | None = None) -> dict:
+    return {
+        "id": "chatcmpl_fake",
+        "object": "chat.completion.chunk",
+        "created": 0,
+        "model": "o1-mini",
+        "choices": (
+            [{"index": 0, "delta": {"content": content}, "finish_reason": None}]
+            if content is not None
+            else []
+        ),
+        "usage": usage,
+    }
+
+
+def test_stream_chat_completion() -> None:
+
+    # note: openai is only needed by `run_o1.py`, so may not be installed
+    openai = pytest.importorskip("openai")
+
+    chunks = [
+        _make_chunk("Hello"),
+        _make_chunk(""),
+        _make_chunk(" there"),
+        _make_chunk(
+            None,
+            usage={
+                "prompt_tokens": 7,
+                "completion_tokens": 130,
+                "total_tokens": 137,
+                "completion_tokens_details": {"reasoning_tokens": 128},
+            },
+        ),
+    ]
+
+    def handle_request(request: httpx.Request) -> httpx.Response:
+
+        assert json.loads(request.content)["stream_options"] == {"include_usage": True}
+
+        return httpx.Response(
+            200,
+            headers={"content-type": "text/event-stream"},
+            content="".join(f"data: {json.dumps(x)}\n\n" for x in chunks) + "data: [DONE]\n\n",
+        )
+
+    text_deltas: list[str] = []
+
+    accumulator = chat_completion_streaming.stream_chat_completion(
+        openai.OpenAI(
+            api_key="fake_api_key",
+            http_client=httpx.Client(transport=httpx.MockTransport(handle_request)),
+        ),
+        on_text_delta=text_deltas.append,
+        model="o1-mini",
+        messages=[{"role": "user", "content": "Hi"}],
+    )
+
+    # empty deltas aren't passed on
+    assert text_deltas == ["Hello", " there"]
+    assert accumulator.get_text() == "Hello there"
+    assert accumulator.usage == chat_completion_streaming.ChatCompletionUsage(
+        input_tokens=7,
+        output_tokens=130,
+        reasoning_tokens=128,
+    )
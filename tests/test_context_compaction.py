@@ -0,0 +1,80 @@
+import copy
+
+import anthropic
+
+from local_claude.libs import context_compaction
+from local_claude.libs import directory_utils
+from local_claude.libs.tools.save_to_workspace_file import (
+    read_file_from_persistent_workspace,
+)
+
+from benchmarks import fake_messages_api
+
+
+def test_compact_messages() -> None:
+    """Check oldest tool results are compacted first, recent ones are kept, and pairing is preserved."""
+
+    with directory_utils.temporary_working_directory():
+
+        messages: list[anthropic.types.MessageParam] = [
+            {"role": "user", "content": "summarize these pages"}
+        ]
+
+        for index in range(5):
+            messages.extend(
+                fake_messages_api.make_tool_turn_messages(
+                    tool_use_id=f"toolu_{index}",
+                    tool_result_content=f"<html>{index}</html>" * 2000,
+                )
+            )
+
+        original_messages = copy.deepcopy(messages)
+
+        result = context_compaction.compact_messages(
+            messages=messages,
+            token_budget=20_000,
+            keep_recent_messages=2,
+        )
+
+        # check inputs weren't modified
+        assert messages == original_messages
+
+        # each page is ~7000 tokens, so need to compact the oldest 3 to get within budget
+        assert result.compacted_tool_use_ids == ["toolu_0", "toolu_1", "toolu_2"]
+        assert result.estimated_tokens_after <= 20_000
+        assert result.estimated_tokens_saved > 0
+
+        # check structure is the same, so tool_use / tool_result pairing is preserved
+        assert len(result.messages) == len(messages)
+
+        for compacted_message, message in zip(result.messages, messages):
+            assert compacted_message["role"] == message["role"]
+
+            if not isinstance(message["content"], str):
+                assert [x.get("tool_use_id") or x.get("id") for x in compacted_message["content"]] == [
+                    x.get("tool_use_id") or x.get("id") for x in message["content"]
+                ]
+
+        # check the full content is still available from the workspace
+        assert "compacted_tool_result_toolu_0.txt" in result.messages[2]["content"][0]["content"]
+
+        assert read_file_from_persistent_workspace(
+            "compacted_tool_result_toolu_0.txt"
+        ) == messages[2]["content"][0]["content"]
+
+        # check the most recent tool result is intact
+        assert result.messages[-1] is messages[-1]
+
+
+def test_compact_messages_within_budget_is_unchanged() -> None:
+
+    messages = fake_messages_api.make_tool_turn_messages(
+        tool_use_id="toolu_0",
+        tool_result_content="small",
+    )
+
+    result = context_compaction.compact_messages(messages=messages, token_budget=1_000)
+
+    assert result.messages == messages
+    assert result.compacted_tool_use_ids == []
+    assert result.estimated_tokens_saved == 0
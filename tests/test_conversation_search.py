@@ -0,0 +1,116 @@
+import pathlib
+import time
+
+from local_claude.libs import conversation_search
+from local_claude.libs import conversation_store
+from local_claude.libs import directory_utils
+
+from benchmarks import fake_messages_api
+
+
+def _make_tool_turn(query: str, tool_output: str) -> list[dict]:
+    return [
+        {"role": "user", "content": [{"type": "text", "text": query}]},
+        *fake_messages_api.make_tool_turn_messages(
+            tool_use_id="toolu_fake",
+            tool_result_content=tool_output,
+            tool_input={"url": "https://pypi.org/project/anthropic"},
+        ),
+    ]
+
+
+def test_conversation_search_index() -> None:
+
+    with directory_utils.temporary_working_directory():
+
+        search_index = conversation_search.ConversationSearchIndex(
+            pathlib.Path("search_index.sqlite3")
+        )
+
+        for message_index, message in enumerate(
+            _make_tool_turn("Find the latest anthropic version", "Latest version: 0.33.1")
+        ):
+            search_index.index_message("claude", "conversation_a", message_index, message)
+
+        search_index.index_message(
+            "o1",
+            "conversation_b",
+            0,
+            {"role": "user", "content": "What version of python should I use?"},
+        )
+
+        # matches tool results, including characters that are FTS5 syntax
+        results = search_index.search("version: 0.33.1")
+
+        assert [(x.conversation_id, x.message_index) for x in results] == [
+            ("conversation_a", 2)
+        ]
+        assert "**0.33.1**" in results[0].snippet
+
+        # matches tool inputs
+        assert search_index.search("pypi.org")[0].message_index == 1
+
+        assert {x.source for x in search_index.search("version")} == {"claude", "o1"}
+        assert [x.source for x in search_index.search("version", source="o1")] == ["o1"]
+
+        assert search_index.search("") == []
+
+
+def test_sync_search_index_only_reindexes_changed_conversations() -> None:
+
+    with directory_utils.temporary_working_directory():
+
+        store = conversation_store.InMemoryConversationStore()
+
+        for conversation_id in ["conversation_a", "conversation_b"]:
+            store.create_conversation(conversation_id)
+
+            for message in _make_tool_turn(f"question for {conversation_id}", "output"):
+                store.append_message(conversation_id, message)
+
+        search_index = conversation_search.ConversationSearchIndex(
+            pathlib.Path("search_index.sqlite3")
+        )
+
+        assert conversation_search.sync_search_index(search_index, store, "claude") == [
+            "conversation_a",
+            "conversation_b",
+        ]
+
+        store.append_message(
+            "conversation_b", {"role": "assistant", "content": "zebra answer"}
+        )
+
+        assert conversation_search.sync_search_index(search_index, store, "claude") == [
+            "conversation_b"
+        ]
+
+        assert len(search_index.search("zebra")) == 1
+        assert len(search_index.search("output")) == 2
+
+
+def test_conversation_search_is_fast_over_many_messages() -> None:
+
+    with directory_utils.temporary_working_directory():
+
+        search_index = conversation_search.ConversationSearchIndex(
+            pathlib.Path("search_index.sqlite3")
+        )
+
+        search_index.reindex_conversation(
+            "claude",
+            "conversation_a",
+            [
+                {"role": "user", "content": f"message {i} about topic{i % 1000}"}
+                for i in range(20_000)
+            ],
+        )
+
+        start_time = time.perf_counter()
+
+        results = search_index.search("topic123")
+
+        elapsed_seconds = time.perf_counter() - start_time
+
+        assert len(results) == 20
+        assert elapsed_seconds < 0.1, f"search took {elapsed_seconds:.3f}s"
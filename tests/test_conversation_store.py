@@ -0,0 +1,203 @@
+import json
+import pathlib
+
+import pytest
+
+from local_claude.libs import conversation_store
+from local_claude.libs import directory_utils
+
+
+def _make_message(index: int) -> dict:
+    return {"role": "user", "content": [{"type": "text", "text": f"message {index}"}]}
+
+
+def _make_store(store_type: str) -> conversation_store.ConversationStore:
+
+    match store_type:
+        case "in_memory":
+            return conversation_store.InMemoryConversationStore()
+        case "sqlite":
+            return conversation_store.SqliteConversationStore(
+                pathlib.Path("conversations.sqlite3")
+            )
+        case "jsonl":
+            return conversation_store.JsonlConversationStore(pathlib.Path("conversations"))
+        case _:
+            raise ValueError(store_type)
+
+
+@pytest.mark.parametrize("store_type", ["in_memory", "sqlite", "jsonl"])
+def test_conversation_store_append_and_page(store_type: str) -> None:
+
+    with directory_utils.temporary_working_directory():
+
+        store = _make_store(store_type)
+
+        store.create_conversation("conversation_b")
+        store.create_conversation("conversation_a")
+
+        for i in range(5):
+            store.append_message("conversation_a", _make_message(i))
+
+        # listed in creation order, not alphabetical
+        assert store.get_conversation_ids() == ["conversation_b", "conversation_a"]
+
+        assert store.get_num_messages("conversation_a") == 5
+        assert store.get_num_messages("conversation_b") == 0
+
+        assert store.get_messages("conversation_a") == [_make_message(i) for i in range(5)]
+        assert store.get_messages("conversation_a", offset=3) == [
+            _make_message(3),
+            _make_message(4),
+        ]
+        assert store.get_messages("conversation_a", offset=1, limit=2) == [
+            _make_message(1),
+            _make_message(2),
+        ]
+
+
+def test_sqlite_conversation_store_is_durable() -> None:
+
+    with directory_utils.temporary_working_directory():
+
+        filepath = pathlib.Path("conversations") / "conversations.sqlite3"
+
+        store = conversation_store.SqliteConversationStore(filepath)
+
+        store.create_conversation("conversation_a")
+        store.append_message("conversation_a", _make_message(0))
+
+        # ex: after a refresh or from another process
+        reopened_store = conversation_store.SqliteConversationStore(filepath)
+
+        reopened_store.append_message("conversation_a", _make_message(1))
+
+        assert reopened_store.get_conversation_ids() == ["conversation_a"]
+        assert store.get_messages("conversation_a") == [_make_message(0), _make_message(1)]
+
+        with pytest.raises(KeyError):
+            store.append_message("missing_conversation", _make_message(0))
+
+
+def test_jsonl_conversation_store_reads_appends_incrementally() -> None:
+
+    with directory_utils.temporary_working_directory():
+
+        directory = pathlib.Path("conversations")
+
+        # conversation in the older format, rewritten as a whole on every append
+        directory.mkdir()
+        (directory / "legacy_conversation.json").write_text(
+            json.dumps([_make_message(0), _make_message(1)], indent=4)
+        )
+
+        store = conversation_store.JsonlConversationStore(directory)
+
+        store.create_conversation("new_conversation")
+
+        # the legacy conversation was converted, and is older than the new one
+        assert store.get_conversation_ids() == ["legacy_conversation", "new_conversation"]
+        assert not (directory / "legacy_conversation.json").exists()
+        assert (directory / "legacy_conversation.json.bak").exists()
+
+        assert store.get_messages("legacy_conversation") == [
+            _make_message(0),
+            _make_message(1),
+        ]
+
+        # ex: another process is part way through writing a line
+        filepath = store.get_conversation_filepath("legacy_conversation")
+
+        with filepath.open("a", encoding="utf-8") as file:
+            file.write(json.dumps(_make_message(2)) + "\n" + '{"role": "us')
+
+        assert store.get_num_messages("legacy_conversation") == 3
+
+        with filepath.open("a", encoding="utf-8") as file:
+            file.write('er", "content": "finished"}\n')
+
+        store.append_message("legacy_conversation", _make_message(4))
+
+        assert store.get_messages("legacy_conversation", offset=3) == [
+            {"role": "user", "content": "finished"},
+            _make_message(4),
+        ]
+
+        # a new store (ex: another process) sees the same thing
+        reopened_store = conversation_store.JsonlConversationStore(directory)
+
+        assert reopened_store.get_conversation_ids() == store.get_conversation_ids()
+        assert reopened_store.get_num_messages("legacy_conversation") == 5
+
+
+def test_jsonl_conversation_store_migrates_legacy_conversations_once() -> None:
+
+    with directory_utils.temporary_working_directory():
+
+        directory = pathlib.Path("conversations")
+        directory.mkdir()
+
+        # already converted, so its legacy file is left alone
+        (directory / "conversation_a.jsonl").write_text(json.dumps(_make_message(0)) + "\n")
+        (directory / "conversation_a.json").write_text(json.dumps([_make_message(1)]))
+
+        conversation_store.JsonlConversationStore(directory)
+
+        assert (directory / "conversation_a.json").exists()
+
+        # only converted the first time the directory is opened
+        (directory / "conversation_b.json").write_text(json.dumps([_make_message(2)]))
+
+        store = conversation_store.JsonlConversationStore(directory)
+
+        assert store.get_conversation_ids() == []
+        assert not (directory / "conversation_b.jsonl").exists()
+        assert (directory / "conversation_b.json").exists()
+
+
+def test_jsonl_conversation_store_messages_are_copies() -> None:
+
+    with directory_utils.temporary_working_directory():
+
+        store = conversation_store.JsonlConversationStore(pathlib.Path("conversations"))
+        store.create_conversation("conversation_a")
+        store.append_message("conversation_a", _make_message(0))
+
+        messages = store.get_messages("conversation_a")
+        messages[0]["content"][0]["text"] = "modified by the caller"
+
+        # the cached records are unaffected
+        assert store.get_messages("conversation_a") == [_make_message(0)]
+
+        store.append_message("conversation_a", _make_message(1))
+
+        assert store.get_messages("conversation_a") == [_make_message(0), _make_message(1)]
+
+
+def test_jsonl_conversation_store_draft_message() -> None:
+
+    with directory_utils.temporary_working_directory():
+
+        directory = pathlib.Path("conversations")
+
+        store = conversation_store.JsonlConversationStore(directory)
+        store.create_conversation("conversation_a")
+
+        assert store.get_draft_message("conversation_a") is None
+
+        store.save_draft_message("conversation_a", {"role": "assistant", "content": "Hel"})
+        store.save_draft_message("conversation_a", {"role": "assistant", "content": "Hello"})
+
+        # ex: the page was refreshed mid stream, and migration doesn't mistake it for a conversation
+        reopened_store = conversation_store.JsonlConversationStore(directory)
+
+        assert reopened_store.get_conversation_ids() == ["conversation_a"]
+        assert reopened_store.get_num_messages("conversation_a") == 0
+        assert reopened_store.get_draft_message("conversation_a") == {
+            "role": "assistant",
+            "content": "Hello",
+        }
+
+        reopened_store.clear_draft_message("conversation_a")
+
+        assert store.get_draft_message("conversation_a") is None
@@ -4,6 +4,8 @@ from local_claude.libs.tools.save_to_workspace_file import (
 )
 from local_claude.libs import directory_utils
 
+import pathlib
+
 import pytest
 
 
@@ -30,3 +32,25 @@ def test_read_and_write_to_workspace() -> None:
 
         # and that it matches the original content
         assert content == content_from_file
+
+
+def test_model_workspace_directory_override() -> None:
+
+    with directory_utils.temporary_working_directory() as tmp_dir:
+
+        isolated_workspace = pathlib.Path(tmp_dir) / "isolated"
+
+        with directory_utils.model_workspace_directory(isolated_workspace):
+
+            save_content_to_persistent_file_in_workspace(
+                filename="test_file.txt",
+                content="isolated",
+            )
+
+            assert read_file_from_persistent_workspace("test_file.txt") == "isolated"
+
+        # check we're back to the default workspace
+        with pytest.raises(FileNotFoundError):
+            read_file_from_persistent_workspace(filename="test_file.txt")
+
+        assert (isolated_workspace / "test_file.txt").read_text() == "isolated"
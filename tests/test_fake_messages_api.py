@@ -0,0 +1,49 @@
+import anthropic
+import httpx
+
+from local_claude.libs import message_streaming
+
+from benchmarks import fake_messages_api
+
+
+def test_scripted_messages_api_streamed_and_created_messages_match() -> None:
+    """Check the SDK parses the fake's stream into the same message it returns from `create`."""
+
+    message_json = fake_messages_api.make_tool_use_message_json(
+        tool_use_id="toolu_fake",
+        name="search_google_and_return_list_of_results",
+        tool_input={"search_query": "OpenAI function calling"},
+        text="Let me search for that.",
+    )
+
+    fake_api = fake_messages_api.ScriptedMessagesApi(script=lambda _: message_json)
+
+    client = anthropic.Anthropic(
+        api_key="fake_api_key",
+        http_client=httpx.Client(transport=fake_api.get_transport()),
+    )
+
+    create_kwargs = dict(
+        messages=[{"role": "user", "content": "search for OpenAI function calling"}],
+        max_tokens=1024,
+        model="claude-3-5-sonnet-20240620",
+    )
+
+    created_message = client.messages.create(**create_kwargs)
+
+    text_deltas: list[str] = []
+
+    streamed_message = message_streaming.stream_message(
+        client,
+        on_text_delta=text_deltas.append,
+        **create_kwargs,
+    )
+
+    assert "".join(text_deltas) == "Let me search for that."
+
+    include = {"role", "content"}
+    assert streamed_message.model_dump(include=include) == created_message.model_dump(
+        include=include
+    )
+
+    assert fake_api.num_requests == 2
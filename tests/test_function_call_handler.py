@@ -1,9 +1,13 @@
+import asyncio
 import json
+import threading
+import time
 
 import anthropic
 
 
 from local_claude.libs import function_call_handler
+from local_claude.libs import tool_options
 
 
 def foo_1(bar: int, buzz: str = "cat") -> str:
@@ -106,3 +110,269 @@ def test_function_call_handler_resolve_with_and_without_error() -> None:
     assert exception_json_dict["type"] == "ValueError"
     assert exception_json_dict["message"] == "Value must be even"
     assert exception_json_dict["traceback"] is not None
+
+
+# used to check parallel safe functions actually run at the same time, since each
+# waits for the other to also reach the barrier
+_barrier = threading.Barrier(2, timeout=5.0)
+
+_call_log: list[str] = []
+
+
+def wait_for_other_call(value: int) -> str:
+    """
+    Wait until another call is also running, then return the value.
+
+    Args:
+        value (int): The value to return.
+
+    """
+
+    _barrier.wait()
+
+    return f"waited-{value}"
+
+
+@tool_options.tool_options(is_parallel_safe=False)
+def append_to_call_log(value: int) -> str:
+    """
+    Append the value to the call log, which is shared state.
+
+    Args:
+        value (int): The value to append.
+
+    """
+
+    _call_log.append(f"append-{value}")
+
+    return f"appended-{value}"
+
+
+def test_function_call_handler_resolve_many() -> None:
+    """Check independent calls run concurrently, serial ones don't, and results keep block order."""
+
+    func_call_handler = function_call_handler.FunctionCallHandler(
+        functions=[wait_for_other_call, append_to_call_log],
+    )
+
+    tool_calls = [
+        anthropic.types.ToolUseBlock(
+            type="tool_use",
+            id=f"fake_tool_use_id_{i}",
+            name=name,
+            input={"value": i},
+        )
+        for i, name in enumerate(
+            [
+                "wait_for_other_call",
+                "wait_for_other_call",
+                "append_to_call_log",
+                "append_to_call_log",
+                "wait_for_other_call",
+                "wait_for_other_call",
+            ]
+        )
+    ]
+
+    results = func_call_handler.resolve_many(tool_calls=tool_calls)
+
+    # no errors means the `wait_for_other_call` pairs were run at the same time
+    assert [x["is_error"] for x in results] == [False] * len(tool_calls)
+
+    assert [x["tool_use_id"] for x in results] == [x.id for x in tool_calls]
+    assert [x["content"] for x in results] == [
+        "waited-0",
+        "waited-1",
+        "appended-2",
+        "appended-3",
+        "waited-4",
+        "waited-5",
+    ]
+
+    assert _call_log == ["append-2", "append-3"]
+
+
+def test_function_call_handler_on_tool_call_resolved() -> None:
+    """Check the callback is called with each result and its wall time."""
+
+    resolved = []
+
+    func_call_handler = function_call_handler.FunctionCallHandler(
+        functions=[foo_1],
+        on_tool_call_resolved=lambda *args: resolved.append(args),
+    )
+
+    tool_call = anthropic.types.ToolUseBlock(
+        type="tool_use",
+        id="fake_tool_use_id",
+        name="foo_1",
+        input={"bar": 1},
+    )
+
+    result = func_call_handler.resolve(tool_call=tool_call)
+
+    assert len(resolved) == 1
+
+    resolved_tool_call, resolved_result, wall_time_seconds = resolved[0]
+
+    assert resolved_tool_call is tool_call
+    assert resolved_result == result
+    assert wall_time_seconds >= 0.0
+
+
+@tool_options.tool_options(
+    execution_mode=tool_options.ExecutionMode.THREAD,
+    timeout_seconds=0.1,
+)
+def wait_forever(value: int) -> str:
+    """
+    Never returns in time.
+
+    Args:
+        value (int): Unused.
+
+    """
+
+    threading.Event().wait(timeout=5.0)
+
+    return f"waited-{value}"
+
+
+def test_function_call_handler_returns_structured_timeout_error() -> None:
+
+    func_call_handler = function_call_handler.FunctionCallHandler(functions=[wait_forever])
+
+    result = func_call_handler.resolve(
+        tool_call=anthropic.types.ToolUseBlock(
+            type="tool_use",
+            id="fake_tool_use_id",
+            name="wait_forever",
+            input={"value": 1},
+        )
+    )
+
+    assert result["is_error"]
+
+    assert json.loads(str(result["content"])) == {
+        "type": "ToolTimeoutError",
+        "message": (
+            "`wait_forever` didn't finish within 0.1s, so it was abandoned. Retry with a "
+            "smaller input, or try a different approach."
+        ),
+        "tool_name": "wait_forever",
+        "timeout_seconds": 0.1,
+        "execution_mode": "thread",
+    }
+
+
+def test_function_call_handler_rejects_invalid_input() -> None:
+
+    func_call_handler = function_call_handler.FunctionCallHandler(functions=[foo_1])
+
+    for tool_input, expected_message in [
+        ({"bar": "1"}, "Invalid input for `foo_1`: input.bar must be integer"),
+        ({}, "Invalid input for `foo_1`: input must contain ['bar'] properties"),
+        ({"bar": 1, "baz": 2}, "Invalid input for `foo_1`: input must not contain {'baz'} properties"),
+    ]:
+
+        result = func_call_handler.resolve(
+            tool_call=anthropic.types.ToolUseBlock(
+                type="tool_use",
+                id="fake_tool_use_id",
+                name="foo_1",
+                input=tool_input,
+            )
+        )
+
+        assert result["is_error"]
+
+        exception_json_dict = json.loads(str(result["content"]))
+
+        assert exception_json_dict["type"] == "ToolInputValidationError"
+        assert exception_json_dict["message"] == expected_message
+        assert exception_json_dict["input_schema"]["required"] == ["bar"]
+
+
+async def fetch_after_delay(value: int) -> str:
+    """
+    Wait on a (fake) network call, then return the value.
+
+    Args:
+        value (int): The value to return.
+
+    """
+
+    await asyncio.sleep(0.2)
+
+    return f"fetched-{value}"
+
+
+def test_function_call_handler_async_resolve_many() -> None:
+    """Check coroutine tools are awaited concurrently, alongside sync tools, keeping block order."""
+
+    func_call_handler = function_call_handler.FunctionCallHandler(
+        functions=[fetch_after_delay, foo_1],
+    )
+
+    tool_calls = [
+        anthropic.types.ToolUseBlock(
+            type="tool_use",
+            id=f"fake_tool_use_id_{i}",
+            name=name,
+            input={"value": i} if name == "fetch_after_delay" else {"bar": i},
+        )
+        for i, name in enumerate(
+            ["fetch_after_delay", "foo_1", "fetch_after_delay", "fetch_after_delay"]
+        )
+    ]
+
+    start_time = time.perf_counter()
+
+    results = asyncio.run(func_call_handler.async_resolve_many(tool_calls=tool_calls))
+
+    # about as long as one call, instead of all three
+    assert time.perf_counter() - start_time < 0.5
+
+    assert [x["content"] for x in results] == [
+        "fetched-0",
+        "foo1-1-cat",
+        "fetched-2",
+        "fetched-3",
+    ]
+
+    # coroutine tools can still be resolved from sync code
+    assert func_call_handler.resolve(tool_call=tool_calls[0])["content"] == "fetched-0"
+
+
+@tool_options.tool_options(timeout_seconds=0.1)
+async def fetch_forever(value: int) -> str:
+    """
+    Never finishes in time.
+
+    Args:
+        value (int): Unused.
+
+    """
+
+    await asyncio.sleep(5.0)
+
+    return f"fetched-{value}"
+
+
+def test_function_call_handler_async_resolve_cancels_on_timeout() -> None:
+
+    func_call_handler = function_call_handler.FunctionCallHandler(functions=[fetch_forever])
+
+    result = asyncio.run(
+        func_call_handler.async_resolve(
+            tool_call=anthropic.types.ToolUseBlock(
+                type="tool_use",
+                id="fake_tool_use_id",
+                name="fetch_forever",
+                input={"value": 1},
+            )
+        )
+    )
+
+    assert result["is_error"]
+    assert json.loads(str(result["content"]))["type"] == "ToolTimeoutError"
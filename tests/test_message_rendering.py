@@ -0,0 +1,121 @@
+import base64
+import json
+
+import anthropic
+
+from local_claude.libs import conversation_store
+from local_claude.libs import message_rendering
+
+
+def _make_turn(index: int) -> list[dict]:
+    """A user message, a tool use, its result, and the final answer."""
+
+    return [
+        {"role": "user", "content": [{"type": "text", "text": f"question {index}"}]},
+        {
+            "role": "assistant",
+            "content": [
+                {"type": "tool_use", "id": f"toolu_{index}", "name": "foo", "input": {}}
+            ],
+        },
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "tool_result",
+                    "tool_use_id": f"toolu_{index}",
+                    "content": json.dumps({"output": "bar"}),
+                    "is_error": False,
+                }
+            ],
+        },
+        {"role": "assistant", "content": [{"type": "text", "text": f"answer {index}"}]},
+    ]
+
+
+def test_render_message() -> None:
+
+    rendered_message = message_rendering.render_message(_make_turn(0)[2])
+
+    assert rendered_message.role == "user"
+    assert [x.kind for x in rendered_message.elements] == ["markdown", "markdown", "code"]
+    assert rendered_message.elements[2].body == "bar"
+
+    rendered_image = message_rendering.render_message(
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "image",
+                    "source": {
+                        "type": "base64",
+                        "media_type": "image/png",
+                        "data": base64.b64encode(b"fake_png").decode("utf-8"),
+                    },
+                }
+            ],
+        }
+    )
+
+    assert rendered_image.elements[0].body == b"fake_png"
+
+
+def test_rendered_message_cache_renders_each_message_once() -> None:
+
+    cache = message_rendering.RenderedMessageCache(max_entries=1)
+
+    message = _make_turn(0)[0]
+
+    rendered_message = cache.get_rendered_message("conversation_a", 0, message)
+
+    assert cache.get_rendered_message("conversation_a", 0, message) is rendered_message
+
+    # evicted by another message
+    cache.get_rendered_message("conversation_a", 1, message)
+
+    assert cache.get_rendered_message("conversation_a", 0, message) is not rendered_message
+
+
+def test_get_recent_turns() -> None:
+
+    store = conversation_store.InMemoryConversationStore()
+    store.create_conversation("conversation_a")
+
+    for i in range(5):
+        for message in _make_turn(i):
+            store.append_message("conversation_a", message)
+
+    # page size smaller than a turn, so needs multiple pages
+    window_start, messages = message_rendering.get_recent_turns(
+        store,
+        "conversation_a",
+        num_turns=2,
+        page_size=3,
+    )
+
+    assert window_start == 12
+    assert messages == _make_turn(3) + _make_turn(4)
+
+    window_start, messages = message_rendering.get_recent_turns(
+        store,
+        "conversation_a",
+        num_turns=10,
+    )
+
+    assert window_start == 0
+    assert len(messages) == 20
+
+
+def test_is_turn_start() -> None:
+
+    tool_result_message, answer_message = _make_turn(0)[2:]
+
+    assert message_rendering.is_turn_start({"role": "user", "content": "question"})
+    assert message_rendering.is_turn_start(_make_turn(0)[0])
+    assert not message_rendering.is_turn_start(tool_result_message)
+    assert not message_rendering.is_turn_start(answer_message)
+
+    # content blocks can also be SDK models
+    assert message_rendering.is_turn_start(
+        {"role": "user", "content": [anthropic.types.TextBlock(type="text", text="question")]}
+    )
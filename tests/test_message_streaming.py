@@ -0,0 +1,127 @@
+import json
+from typing import Any
+
+import anthropic
+
+from local_claude.libs import message_streaming
+
+
+def make_stream_events(message: anthropic.types.Message) -> list[Any]:
+    """Split a complete message into the raw events the API would stream for it."""
+
+    events: list[Any] = [
+        anthropic.types.RawMessageStartEvent(
+            type="message_start",
+            message=message.model_copy(
+                update={"content": [], "stop_reason": None, "stop_sequence": None}
+            ),
+        )
+    ]
+
+    for index, content_block in enumerate(message.content):
+
+        if content_block.type == "text":
+            start_block: Any = {"type": "text", "text": ""}
+
+            # split into a few chunks to check deltas are concatenated
+            deltas: list[Any] = [
+                {"type": "text_delta", "text": content_block.text[i : i + 5]}
+                for i in range(0, len(content_block.text), 5)
+            ]
+        else:
+            start_block = {
+                "type": "tool_use",
+                "id": content_block.id,
+                "name": content_block.name,
+                "input": {},
+            }
+
+            input_json = json.dumps(content_block.input)
+            deltas = [
+                {"type": "input_json_delta", "partial_json": input_json[i : i + 3]}
+                for i in range(0, len(input_json), 3)
+            ]
+
+        events.append(
+            anthropic.types.RawContentBlockStartEvent.model_validate(
+                {"type": "content_block_start", "index": index, "content_block": start_block}
+            )
+        )
+
+        for delta in deltas:
+            events.append(
+                anthropic.types.RawContentBlockDeltaEvent.model_validate(
+                    {"type": "content_block_delta", "index": index, "delta": delta}
+                )
+            )
+
+        events.append(
+            anthropic.types.RawContentBlockStopEvent(
+                type="content_block_stop", index=index
+            )
+        )
+
+    events.append(
+        anthropic.types.RawMessageDeltaEvent.model_validate(
+            {
+                "type": "message_delta",
+                "delta": {
+                    "stop_reason": message.stop_reason,
+                    "stop_sequence": message.stop_sequence,
+                },
+                "usage": {"output_tokens": message.usage.output_tokens},
+            }
+        )
+    )
+    events.append(anthropic.types.RawMessageStopEvent(type="message_stop"))
+
+    return events
+
+
+def test_streamed_message_accumulator_matches_create() -> None:
+    """Check the accumulated message dumps identically to the one `create` would have returned."""
+
+    message = anthropic.types.Message.model_validate(
+        {
+            "id": "msg_fake",
+            "type": "message",
+            "role": "assistant",
+            "model": "claude-3-5-sonnet-20240620",
+            "content": [
+                {"type": "text", "text": "Let me look that up for you."},
+                {
+                    "type": "tool_use",
+                    "id": "toolu_fake",
+                    "name": "search_google_and_return_list_of_results",
+                    "input": {"search_query": "OpenAI function calling"},
+                },
+                {"type": "text", "text": "And then another one."},
+            ],
+            "stop_reason": "tool_use",
+            "stop_sequence": None,
+            "usage": {"input_tokens": 123, "output_tokens": 45},
+        }
+    )
+
+    accumulator = message_streaming.StreamedMessageAccumulator()
+
+    text_deltas = []
+
+    for event in make_stream_events(message):
+        if text_delta := accumulator.add_event(event):
+            text_deltas.append(text_delta)
+
+    streamed_message = accumulator.get_final_message()
+
+    # check text was surfaced incrementally
+    assert "".join(text_deltas) == "Let me look that up for you.And then another one."
+    assert len(text_deltas) > 2
+
+    # check what we'd store in the conversation is identical
+    include = {"role", "content"}
+    assert json.dumps(streamed_message.model_dump(include=include)) == json.dumps(
+        message.model_dump(include=include)
+    )
+
+    assert streamed_message.stop_reason == "tool_use"
+    assert streamed_message.usage.output_tokens == 45
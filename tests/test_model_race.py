@@ -0,0 +1,182 @@
+import asyncio
+import json
+
+import anthropic
+import httpx
+import pytest
+
+from local_claude.libs import api_clients
+from local_claude.libs import model_race
+
+from benchmarks import fake_messages_api
+
+
+def _make_model_call(
+    model: str,
+    delay_seconds: float,
+    finished_models: list[str],
+    is_error: bool = False,
+) -> model_race.ModelCall:
+
+    async def model_call() -> model_race.ModelAnswer:
+
+        await asyncio.sleep(delay_seconds)
+
+        if is_error:
+            raise RuntimeError(f"{model} failed")
+
+        finished_models.append(model)
+
+        return model_race.ModelAnswer(
+            model=model,
+            text=f"answer from {model}",
+            latency_seconds=delay_seconds,
+            time_to_first_token_seconds=None,
+            input_tokens=10,
+            output_tokens=5,
+        )
+
+    return model_call
+
+
+def test_race_models_first_wins_cancels_slower_models() -> None:
+
+    finished_models: list[str] = []
+
+    race_result = asyncio.run(
+        model_race.race_models(
+            {
+                "failing": _make_model_call("failing", 0.0, finished_models, is_error=True),
+                "fast": _make_model_call("fast", 0.01, finished_models),
+                "slow": _make_model_call("slow", 5.0, finished_models),
+            },
+            policy=model_race.RacePolicy.FIRST_WINS,
+        )
+    )
+
+    # the failure doesn't win, and the slow model never finishes
+    assert [x.model for x in race_result.answers] == ["fast"]
+    assert race_result.cancelled_models == ["slow"]
+    assert "failing failed" in race_result.error_by_model["failing"]
+    assert finished_models == ["fast"]
+
+
+def test_race_models_compare_waits_for_all() -> None:
+
+    finished_models: list[str] = []
+
+    race_result = asyncio.run(
+        model_race.race_models(
+            {
+                "slow": _make_model_call("slow", 0.05, finished_models),
+                "fast": _make_model_call("fast", 0.01, finished_models),
+            },
+            policy=model_race.RacePolicy.COMPARE,
+        )
+    )
+
+    assert [x.model for x in race_result.answers] == ["fast", "slow"]
+    assert race_result.cancelled_models == []
+
+
+def test_get_anthropic_answer() -> None:
+
+    fake_api = fake_messages_api.ScriptedMessagesApi(
+        script=lambda request_json: fake_messages_api.make_text_message_json("Hello there")
+    )
+
+    async def get_answer() -> model_race.ModelAnswer:
+        return await model_race.get_anthropic_answer(
+            anthropic.AsyncAnthropic(
+                api_key="fake_api_key",
+                http_client=httpx.AsyncClient(transport=fake_api.get_transport()),
+            ),
+            model="claude-3-5-sonnet-20240620",
+            messages=[{"role": "user", "content": "Hi"}],
+            max_tokens=1024,
+        )
+
+    model_answer = asyncio.run(get_answer())
+
+    assert model_answer.text == "Hello there"
+    assert model_answer.time_to_first_token_seconds is not None
+    assert (model_answer.input_tokens, model_answer.output_tokens) == (10, 5)
+
+
+def test_get_openai_answer_streamed() -> None:
+
+    # note: openai is only needed by `run_o1.py`, so may not be installed
+    openai = pytest.importorskip("openai")
+
+    def make_chunk(content: str | None, usage: dict | None = None) -> dict:
+        return {
+            "id": "chatcmpl_fake",
+            "object": "chat.completion.chunk",
+            "created": 0,
+            "model": "gpt-4o-mini",
+            "choices": (
+                [{"index": 0, "delta": {"content": content}, "finish_reason": None}]
+                if content is not None
+                else []
+            ),
+            "usage": usage,
+        }
+
+    chunks = [
+        make_chunk("Hello"),
+        make_chunk(" there"),
+        make_chunk(None, usage={"prompt_tokens": 7, "completion_tokens": 2, "total_tokens": 9}),
+    ]
+
+    def handle_request(request: httpx.Request) -> httpx.Response:
+
+        assert json.loads(request.content)["stream_options"] == {"include_usage": True}
+
+        return httpx.Response(
+            200,
+            headers={"content-type": "text/event-stream"},
+            content="".join(f"data: {json.dumps(x)}\n\n" for x in chunks) + "data: [DONE]\n\n",
+        )
+
+    async def get_answer() -> model_race.ModelAnswer:
+        return await model_race.get_openai_answer(
+            openai.AsyncOpenAI(
+                api_key="fake_api_key",
+                http_client=httpx.AsyncClient(transport=httpx.MockTransport(handle_request)),
+            ),
+            model="gpt-4o-mini",
+            messages=[{"role": "user", "content": "Hi"}],
+        )
+
+    model_answer = asyncio.run(get_answer())
+
+    assert model_answer.text == "Hello there"
+    assert (model_answer.input_tokens, model_answer.output_tokens) == (7, 2)
+
+
+def test_race_on_its_own_loop_closes_pooled_clients() -> None:
+    """Check races run with `asyncio.run` (like the o1 page) don't leave per loop clients open."""
+
+    clients: list[anthropic.AsyncAnthropic] = []
+
+    async def model_call() -> model_race.ModelAnswer:
+
+        clients.append(api_clients.get_async_anthropic_client())
+
+        return model_race.ModelAnswer(
+            model="model_a",
+            text="answer",
+            latency_seconds=0.0,
+            time_to_first_token_seconds=None,
+            input_tokens=10,
+            output_tokens=5,
+        )
+
+    for _ in range(2):
+        model_race.run_race({"model_a": model_call}, policy=model_race.RacePolicy.FIRST_WINS)
+
+    # a client per loop, each closed before its loop finished
+    assert len(clients) == 2
+    assert clients[0] is not clients[1]
+    assert all(x.is_closed() for x in clients)
+    assert len(api_clients._async_anthropic_client_by_loop) == 0
@@ -0,0 +1,53 @@
+import os
+import pathlib
+import time
+
+import pytest
+
+from local_claude.libs import directory_utils
+from local_claude.libs import process_pool
+from local_claude.libs import tool_execution
+from local_claude.libs import tool_options
+
+
+def test_run_in_process_pool_reuses_workers() -> None:
+
+    try:
+        worker_pids = {process_pool.run_in_process_pool(os.getpid) for _ in range(20)}
+
+        assert os.getpid() not in worker_pids
+        assert len(worker_pids) <= process_pool.DEFAULT_MAX_WORKERS
+
+        # same pool, so no new workers
+        assert process_pool.get_process_pool() is process_pool.get_process_pool()
+
+        with pytest.raises(TimeoutError):
+            process_pool.run_in_process_pool(time.sleep, 1.0, timeout_seconds=0.1)
+
+    finally:
+        process_pool.shutdown_process_pool()
+
+
+def test_run_tool_in_process_pool() -> None:
+
+    options = tool_options.ToolOptions(
+        execution_mode=tool_options.ExecutionMode.PROCESS_POOL,
+        timeout_seconds=30.0,
+    )
+
+    try:
+        with directory_utils.temporary_working_directory():
+
+            with directory_utils.model_workspace_directory(pathlib.Path("isolated_workspace")):
+
+                # note: tools need to be importable from the workers, so using a library function
+                workspace_directory = tool_execution.run_tool(
+                    directory_utils.get_current_model_workspace_directory,
+                    {},
+                    options,
+                )
+
+        assert workspace_directory == pathlib.Path("isolated_workspace")
+
+    finally:
+        process_pool.shutdown_process_pool()
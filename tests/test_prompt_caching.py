@@ -0,0 +1,110 @@
+import copy
+
+import anthropic
+
+from local_claude.libs import prompt_caching
+
+
+def _get_cached_message_indices(
+    messages: list[anthropic.types.MessageParam],
+) -> list[int]:
+    return [
+        index
+        for index, message in enumerate(messages)
+        if not isinstance(message["content"], str)
+        and any("cache_control" in x for x in message["content"])
+    ]
+
+
+def test_plan_cache_breakpoints() -> None:
+    """Check breakpoints stay within the limit, roll forward, and don't modify the inputs."""
+
+    tools: list[anthropic.types.ToolParam] = [
+        {"name": "foo", "description": "Foo", "input_schema": {"type": "object"}},
+        {"name": "bar", "description": "Bar", "input_schema": {"type": "object"}},
+    ]
+
+    messages: list[anthropic.types.MessageParam] = [
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": "hi",
+                    # old style breakpoint, which should be removed
+                    "cache_control": {"type": "ephemeral"},
+                }
+            ],
+        },
+    ]
+
+    for iteration in range(5):
+
+        original_tools = copy.deepcopy(tools)
+        original_messages = copy.deepcopy(messages)
+
+        plan = prompt_caching.plan_cache_breakpoints(
+            system="You are a helpful assistant",
+            tools=tools,
+            messages=messages,
+        )
+
+        # check inputs weren't modified
+        assert tools == original_tools
+        assert messages == original_messages
+
+        # check only the last tool and system prompt are cached
+        assert "cache_control" not in plan.tools[0]
+        assert "cache_control" in plan.tools[-1]
+        assert "cache_control" in plan.system[-1]
+
+        # check the newest message and the newest message of the previous call are cached
+        expected_indices = [len(messages) - 3, len(messages) - 1]
+        assert _get_cached_message_indices(plan.messages) == [
+            x for x in expected_indices if x >= 0
+        ]
+
+        # simulate a tool use iteration
+        messages.append(
+            {
+                "role": "assistant",
+                "content": [{"type": "text", "text": f"response {iteration}"}],
+            }
+        )
+        messages.append({"role": "user", "content": f"tool result {iteration}"})
+
+
+def test_plan_cache_breakpoints_respects_max_breakpoints() -> None:
+
+    messages: list[anthropic.types.MessageParam] = [
+        {"role": "user", "content": f"message {i}"} for i in range(10)
+    ]
+
+    plan = prompt_caching.plan_cache_breakpoints(
+        system="You are a helpful assistant",
+        tools=[],
+        messages=messages,
+        max_breakpoints=3,
+    )
+
+    # no tools, so system prompt and two messages
+    assert "cache_control" in plan.system[-1]
+    assert _get_cached_message_indices(plan.messages) == [7, 9]
+
+
+def test_cache_usage_from_usage() -> None:
+
+    usage = anthropic.types.Usage.model_validate(
+        {
+            "input_tokens": 10,
+            "output_tokens": 5,
+            "cache_read_input_tokens": 70,
+            "cache_creation_input_tokens": 20,
+        }
+    )
+
+    cache_usage = prompt_caching.CacheUsage.from_usage(usage)
+
+    assert cache_usage.cache_read_input_tokens == 70
+    assert cache_usage.cache_creation_input_tokens == 20
+    assert cache_usage.get_cache_hit_rate() == 0.7
@@ -0,0 +1,61 @@
+from local_claude.libs import prompt_token_profiler
+
+
+_SYSTEM_PROMPT = """
+    You are a helpful assistant.
+    Answer concisely.
+
+    More about the user:
+
+    <user_info>
+
+    A developer.
+
+    </user_info>
+    """
+
+
+def test_split_system_prompt_into_sections() -> None:
+
+    assert prompt_token_profiler.split_system_prompt_into_sections(_SYSTEM_PROMPT) == [
+        "You are a helpful assistant.\nAnswer concisely.",
+        "More about the user:",
+        "<user_info>\n\nA developer.\n\n</user_info>",
+    ]
+
+
+def test_profile_system_prompt_and_tool_schemas() -> None:
+
+    system_prompt_token_profile = prompt_token_profiler.profile_system_prompt(_SYSTEM_PROMPT)
+
+    assert [x.title for x in system_prompt_token_profile.section_token_costs] == [
+        "You are a helpful assistant.",
+        "More about the user:",
+        "<user_info>",
+    ]
+
+    # the prompt's indentation isn't part of any section
+    assert system_prompt_token_profile.get_whitespace_tokens() > 0
+
+    tool_schema_token_costs = prompt_token_profiler.profile_tool_schemas(
+        [
+            {
+                "name": "short",
+                "description": "Short.",
+                "input_schema": {"type": "object", "properties": {}},
+            },
+            {
+                "name": "long",
+                "description": "Long. " * 100,
+                "input_schema": {"type": "object", "properties": {}},
+            },
+        ]
+    )
+
+    # most expensive first
+    assert [x.tool_name for x in tool_schema_token_costs] == ["long", "short"]
+    assert tool_schema_token_costs[0].description_tokens > 100
+
+    report = prompt_token_profiler.format_tool_schema_token_costs(tool_schema_token_costs)
+
+    assert "long" in report.splitlines()[3]
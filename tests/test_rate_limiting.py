@@ -0,0 +1,158 @@
+import datetime
+
+import httpx
+
+from local_claude.libs import rate_limiting
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _make_request(max_tokens: int = 100) -> httpx.Request:
+    return httpx.Request("POST", "https://example.com/v1/messages", json={"max_tokens": max_tokens})
+
+
+def _make_response(
+    status_code: int,
+    headers: dict[str, str],
+    request: httpx.Request | None = None,
+) -> httpx.Response:
+    return httpx.Response(status_code, headers=headers, request=request or _make_request())
+
+
+def test_rate_limit_scheduler_token_buckets() -> None:
+
+    clock = FakeClock()
+
+    scheduler = rate_limiting.RateLimitScheduler(
+        rate_limiting.ANTHROPIC_RATE_LIMIT_HEADER_NAMES,
+        clock=clock,
+    )
+
+    # before any limits are known, never wait
+    assert scheduler.reserve(estimated_tokens=1_000_000) == 0.0
+
+    # 60 requests per minute -> 1 per second, 6000 tokens per minute -> 100 per second
+    scheduler.update_from_response(
+        _make_response(
+            200,
+            headers={
+                "anthropic-ratelimit-requests-limit": "60",
+                "anthropic-ratelimit-requests-remaining": "2",
+                "anthropic-ratelimit-tokens-limit": "6000",
+                "anthropic-ratelimit-tokens-remaining": "6000",
+            },
+        )
+    )
+
+    # first two requests are within the remaining requests
+    assert scheduler.reserve(estimated_tokens=100) == 0.0
+    assert scheduler.reserve(estimated_tokens=100) == 0.0
+
+    # third has to wait for a request to refill
+    assert scheduler.reserve(estimated_tokens=100) == 1.0
+
+    # after waiting, token limit is the bottleneck (refilled to the 6000 limit, so 500 over)
+    clock.now += 10.0
+    assert scheduler.reserve(estimated_tokens=6500) == 5.0
+
+
+def test_rate_limit_scheduler_backs_off_on_429() -> None:
+
+    clock = FakeClock()
+
+    scheduler = rate_limiting.RateLimitScheduler(
+        rate_limiting.OPENAI_RATE_LIMIT_HEADER_NAMES,
+        clock=clock,
+    )
+
+    scheduler.update_from_response(_make_response(429, headers={"retry-after": "7"}))
+
+    assert scheduler.reserve(estimated_tokens=1) == 7.0
+
+    clock.now += 7.0
+
+    assert scheduler.reserve(estimated_tokens=1) == 0.0
+
+
+def test_rate_limit_scheduler_keeps_in_flight_reservations() -> None:
+    """Check a response doesn't hand out capacity reserved by requests still waiting on theirs."""
+
+    clock = FakeClock()
+
+    scheduler = rate_limiting.RateLimitScheduler(
+        rate_limiting.ANTHROPIC_RATE_LIMIT_HEADER_NAMES,
+        clock=clock,
+    )
+
+    first_request = _make_request(max_tokens=1000)
+    second_request = _make_request(max_tokens=3000)
+
+    scheduler.before_request(first_request)
+    scheduler.before_request(second_request)
+
+    headers = {
+        "anthropic-ratelimit-tokens-limit": "6000",
+        "anthropic-ratelimit-tokens-remaining": "6000",
+    }
+
+    scheduler.update_from_response(_make_response(200, headers=headers, request=first_request))
+
+    # the second request's ~3000 tokens are still reserved, so 4000 more has to wait for some
+    assert scheduler.reserve(estimated_tokens=4000) > 0.0
+
+    # once it's answered, the API's remaining count is used as is
+    scheduler.update_from_response(_make_response(200, headers=headers, request=second_request))
+
+    assert scheduler.reserve(estimated_tokens=4000) == 0.0
+
+
+def test_parse_reset_seconds() -> None:
+
+    now = datetime.datetime(2024, 8, 1, 12, 0, 0, tzinfo=datetime.timezone.utc)
+
+    # anthropic style
+    assert rate_limiting.parse_reset_seconds("2024-08-01T12:00:30Z", now=now) == 30.0
+
+    # openai style
+    assert rate_limiting.parse_reset_seconds("6m0s", now=now) == 360.0
+    assert rate_limiting.parse_reset_seconds("1.5s", now=now) == 1.5
+    assert rate_limiting.parse_reset_seconds("20ms", now=now) == 0.02
+
+    assert rate_limiting.parse_reset_seconds("not a time", now=now) is None
+
+
+def test_rate_limit_scheduler_event_hooks() -> None:
+    """Check hooks read headers from responses, and estimate tokens from requests."""
+
+    clock = FakeClock()
+
+    scheduler = rate_limiting.RateLimitScheduler(
+        rate_limiting.ANTHROPIC_RATE_LIMIT_HEADER_NAMES,
+        clock=clock,
+    )
+
+    def handle_request(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(
+            200,
+            headers={
+                "anthropic-ratelimit-tokens-limit": "60000",
+                "anthropic-ratelimit-tokens-remaining": "1000",
+            },
+            json={},
+        )
+
+    http_client = httpx.Client(
+        transport=httpx.MockTransport(handle_request),
+        event_hooks=scheduler.get_event_hooks(),
+    )
+
+    http_client.post("https://example.com/v1/messages", json={"max_tokens": 500})
+
+    # 1000 remaining tokens, so a request for 1500 waits for 500 more (at 1000 / second)
+    assert scheduler.reserve(estimated_tokens=1500) == 0.5
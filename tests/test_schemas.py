@@ -19,3 +19,24 @@ def foo(bar: int, buzz: str = "cat") -> str:
 def test_generate_json_schema_for_function() -> None:
 
     pprint.pprint(schemas.generate_json_schema_for_function(foo))
+
+
+async def async_foo(bar: int, buzz: str = "cat") -> str:
+    """
+    If the user provides a `bar` value, call this function with it and give them back the result.
+
+    Args:
+        bar (int): User provided value.
+        buzz (str): Unused (default: cat).
+
+    """
+
+    return f"foo-{bar}-{buzz}"
+
+
+def test_generate_json_schema_for_async_function() -> None:
+
+    schema = schemas.generate_json_schema_for_function(async_foo)
+
+    assert schema["name"] == "async_foo"
+    assert schema["input_schema"] == schemas.generate_json_schema_for_function(foo)["input_schema"]
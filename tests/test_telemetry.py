@@ -0,0 +1,112 @@
+import anthropic
+
+from local_claude.libs import directory_utils
+from local_claude.libs import telemetry
+
+
+def test_telemetry_recorder_totals_and_jsonl_export() -> None:
+
+    with directory_utils.temporary_working_directory():
+
+        recorder = telemetry.TelemetryRecorder()
+
+        response = anthropic.types.Message.model_validate(
+            {
+                "id": "msg_fake",
+                "type": "message",
+                "role": "assistant",
+                "model": "claude-3-5-sonnet-20240620",
+                "content": [{"type": "text", "text": "hi"}],
+                "stop_reason": "end_turn",
+                "usage": {
+                    "input_tokens": 10,
+                    "output_tokens": 5,
+                    "cache_read_input_tokens": 100,
+                },
+            }
+        )
+
+        recorder.record(
+            telemetry.ModelCallRecord.from_response(
+                conversation_id="conversation_a",
+                response=response,
+                latency_seconds=1.5,
+            )
+        )
+
+        recorder.record(
+            telemetry.ToolCallRecord.from_tool_result(
+                conversation_id="conversation_a",
+                tool_call=anthropic.types.ToolUseBlock(
+                    type="tool_use",
+                    id="fake_tool_use_id",
+                    name="foo",
+                    input={},
+                ),
+                tool_result={
+                    "type": "tool_result",
+                    "tool_use_id": "fake_tool_use_id",
+                    "content": "a" * 400,
+                    "is_error": False,
+                },
+                wall_time_seconds=0.25,
+            )
+        )
+
+        # other conversations shouldn't affect totals
+        recorder.record(
+            telemetry.ModelCallRecord.from_response(
+                conversation_id="conversation_b",
+                response=response,
+                latency_seconds=3.0,
+            )
+        )
+
+        totals = recorder.get_totals("conversation_a")
+
+        assert totals.model_calls == 1
+        assert totals.model_latency_seconds == 1.5
+        assert totals.input_tokens == 10
+        assert totals.output_tokens == 5
+        assert totals.cache_read_input_tokens == 100
+        assert totals.cache_creation_input_tokens == 0
+        assert totals.tool_calls == 1
+        assert totals.tool_wall_time_seconds == 0.25
+        assert totals.tool_result_bytes == 400
+        assert totals.estimated_tool_result_tokens == 100
+
+        # check everything was exported
+        records = telemetry.read_telemetry_file(telemetry.DEFAULT_TELEMETRY_FILEPATH)
+
+        assert [x["kind"] for x in records] == ["model_call", "tool_call", "model_call"]
+        assert records[1]["tool_name"] == "foo"
+
+
+def test_tool_call_record_measures_text_of_content_blocks() -> None:
+
+    record = telemetry.ToolCallRecord.from_tool_result(
+        conversation_id="conversation_a",
+        tool_call=anthropic.types.ToolUseBlock(
+            type="tool_use",
+            id="fake_tool_use_id",
+            name="foo",
+            input={},
+        ),
+        tool_result={
+            "type": "tool_result",
+            "tool_use_id": "fake_tool_use_id",
+            "content": [
+                {"type": "text", "text": "a" * 200},
+                {
+                    "type": "image",
+                    "source": {"type": "base64", "media_type": "image/png", "data": "b" * 10_000},
+                },
+                {"type": "text", "text": "c" * 200},
+            ],
+            "is_error": False,
+        },
+        wall_time_seconds=0.25,
+    )
+
+    assert record.result_size_bytes == 400
+    assert record.estimated_result_tokens == 100
@@ -0,0 +1,91 @@
+import copy
+
+import anthropic
+import pytest
+
+from local_claude.libs import token_accounting
+
+from benchmarks import fake_messages_api
+
+
+def test_token_counter_counts_each_message_once() -> None:
+
+    token_counter = token_accounting.TokenCounter()
+
+    messages: list[anthropic.types.MessageParam] = [{"role": "user", "content": "Hello"}]
+
+    request_token_counts = []
+
+    for index in range(10):
+
+        messages.extend(
+            fake_messages_api.make_tool_turn_messages(
+                tool_use_id=f"toolu_{index}",
+                tool_result_content="baz" * 100,
+                name="foo",
+                tool_input={"bar": index},
+                text="Let me check",
+            )
+        )
+
+        # note: new dicts each time, like messages loaded from a store on every turn
+        loaded_messages: list[anthropic.types.MessageParam] = copy.deepcopy(messages)
+
+        request_token_counts.append(
+            token_counter.count_request(
+                system="You are a helpful assistant",
+                tools=[],
+                messages_tokens=sum(token_counter.count_conversation_messages(loaded_messages)),
+                max_tokens=1024,
+            )
+        )
+
+    # each message was counted once, no matter how many requests it was in
+    assert token_counter.num_messages_counted == len(messages)
+
+    # and counts are the same as counting from scratch
+    assert (
+        request_token_counts[-1].messages_tokens
+        == token_accounting.TokenCounter().count_messages(messages)
+    )
+
+    messages_tokens = [x.messages_tokens for x in request_token_counts]
+
+    assert messages_tokens == sorted(messages_tokens)
+
+
+def test_token_counter_estimates_images_by_count_not_data_size() -> None:
+
+    token_counter = token_accounting.TokenCounter()
+
+    message: anthropic.types.MessageParam = {
+        "role": "user",
+        "content": [
+            {
+                "type": "image",
+                "source": {"type": "base64", "media_type": "image/png", "data": "a" * 1_000_000},
+            }
+        ],
+    }
+
+    assert token_counter.count_message(message) < 2 * token_accounting.ESTIMATED_IMAGE_TOKENS
+
+
+def test_check_fits_in_context_window() -> None:
+
+    request_token_count = token_accounting.RequestTokenCount(
+        system_tokens=0,
+        tools_tokens=1_000,
+        messages_tokens=8_000,
+        max_output_tokens=1_000,
+    )
+
+    assert request_token_count.get_context_window_fraction(20_000) == 0.5
+
+    token_accounting.check_fits_in_context_window(request_token_count, context_window_tokens=10_000)
+
+    with pytest.raises(token_accounting.ContextWindowExceededError):
+        token_accounting.check_fits_in_context_window(
+            request_token_count,
+            context_window_tokens=9_999,
+        )
@@ -0,0 +1,99 @@
+import functools
+import json
+import pathlib
+import threading
+import time
+
+import pytest
+
+from local_claude.libs import directory_utils
+from local_claude.libs import tool_execution
+from local_claude.libs import tool_options
+
+
+THREAD_OPTIONS = tool_options.ToolOptions(
+    execution_mode=tool_options.ExecutionMode.THREAD,
+    timeout_seconds=0.2,
+)
+
+SUBPROCESS_OPTIONS = tool_options.ToolOptions(
+    execution_mode=tool_options.ExecutionMode.SUBPROCESS,
+    timeout_seconds=10.0,
+)
+
+
+def test_only_inline_coroutine_tools_can_have_timeouts() -> None:
+
+    with pytest.raises(ValueError):
+
+        @tool_options.tool_options(timeout_seconds=1.0)
+        def sync_tool() -> None:
+            pass
+
+    @tool_options.tool_options(timeout_seconds=1.0)
+    async def async_tool() -> None:
+        pass
+
+
+def test_run_tool_in_thread() -> None:
+
+    assert tool_execution.run_tool(lambda value: value + 1, {"value": 1}, THREAD_OPTIONS) == 2
+
+    with pytest.raises(ZeroDivisionError):
+        tool_execution.run_tool(lambda value: value / 0, {"value": 1}, THREAD_OPTIONS)
+
+    is_released = threading.Event()
+
+    start_time = time.perf_counter()
+
+    with pytest.raises(tool_execution.ToolTimeoutError) as exception_info:
+        tool_execution.run_tool(is_released.wait, {"timeout": 10.0}, THREAD_OPTIONS)
+
+    # the caller isn't blocked until the tool finishes
+    assert time.perf_counter() - start_time < 5.0
+
+    assert exception_info.value.to_json_dict()["execution_mode"] == "thread"
+
+    is_released.set()
+
+
+def test_run_tool_in_subprocess() -> None:
+
+    with directory_utils.temporary_working_directory():
+
+        with directory_utils.model_workspace_directory(pathlib.Path("isolated_workspace")):
+
+            # note: tools need to be importable from the child, so using library functions
+            workspace_directory = tool_execution.run_tool(
+                directory_utils.get_current_model_workspace_directory,
+                {},
+                SUBPROCESS_OPTIONS,
+            )
+
+    # child used the caller's workspace
+    assert workspace_directory == pathlib.Path("isolated_workspace")
+
+    # exceptions come back with the child's traceback
+    with pytest.raises(tool_execution.SubprocessToolError) as exception_info:
+        tool_execution.run_tool(json.loads, {"s": "not json"}, SUBPROCESS_OPTIONS)
+
+    assert exception_info.value.to_json_dict()["type"] == "JSONDecodeError"
+    assert "json/decoder.py" in exception_info.value.to_json_dict()["traceback"]
+
+
+def test_run_tool_in_subprocess_kills_on_timeout() -> None:
+
+    start_time = time.perf_counter()
+
+    with pytest.raises(tool_execution.ToolTimeoutError):
+        tool_execution.run_tool(
+            functools.partial(time.sleep, 60.0),
+            {},
+            tool_options.ToolOptions(
+                execution_mode=tool_options.ExecutionMode.SUBPROCESS,
+                timeout_seconds=2.0,
+            ),
+        )
+
+    # killed rather than waited for
+    assert time.perf_counter() - start_time < 30.0
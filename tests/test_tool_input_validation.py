@@ -0,0 +1,44 @@
+import time
+
+import pytest
+
+from local_claude.libs import schemas
+from local_claude.libs import tool_input_validation
+
+
+def get_weather(location: str, days: int = 1) -> str:
+    """
+    Get the weather forecast for a location.
+
+    Args:
+        location (str): The city and state, e.g. San Francisco, CA
+        days (int): Number of days to forecast.
+
+    """
+
+    return f"{location}: sunny for {days} days"
+
+
+def test_compile_tool_input_validator() -> None:
+
+    validate_input = tool_input_validation.compile_tool_input_validator(
+        schemas.generate_json_schema_for_function(get_weather)
+    )
+
+    validate_input({"location": "San Francisco, CA"})
+    validate_input({"location": "San Francisco, CA", "days": 3})
+
+    with pytest.raises(tool_input_validation.ToolInputValidationError) as exception_info:
+        validate_input({"location": "San Francisco, CA", "days": "3"})
+
+    assert str(exception_info.value) == "Invalid input for `get_weather`: input.days must be integer"
+
+    # negligible overhead on valid calls
+    num_calls = 10_000
+
+    start_time = time.perf_counter()
+
+    for _ in range(num_calls):
+        validate_input({"location": "San Francisco, CA", "days": 3})
+
+    assert (time.perf_counter() - start_time) / num_calls < 100e-6
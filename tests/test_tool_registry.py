@@ -0,0 +1,105 @@
+import os
+import pathlib
+import sys
+import textwrap
+
+import anthropic
+import pytest
+
+from local_claude.libs import directory_utils
+from local_claude.libs import schemas
+from local_claude.libs import tool_options
+from local_claude.libs import tool_registry
+from local_claude.libs.function_call_handler import FunctionCallHandler
+
+
+_TOOL_MODULE_SOURCE = textwrap.dedent(
+    '''
+    from local_claude.libs.tool_options import tool_options
+
+
+    @tool_options(cache_ttl_seconds=60.0)
+    def add_one(value: int) -> int:
+        """
+        Add one to the value.
+
+        Args:
+            value (int): The value to add one to.
+
+        """
+
+        return value + 1
+    '''
+)
+
+
+def test_tool_registry_only_imports_tools_when_called(monkeypatch: pytest.MonkeyPatch) -> None:
+
+    with directory_utils.temporary_working_directory():
+
+        # note: a module only this test imports, so whether it's imported is observable
+        pathlib.Path("registry_test_tools.py").write_text(_TOOL_MODULE_SOURCE)
+        monkeypatch.syspath_prepend(os.getcwd())
+
+        tool_references = ["registry_test_tools:add_one"]
+
+        # first registry, with no cache, has to import the tool to get its schema
+        first_registry = tool_registry.ToolRegistry(tool_references)
+
+        assert first_registry.num_tools_imported_for_schemas == 1
+
+        expected_schema = schemas.generate_json_schema_for_function(
+            sys.modules["registry_test_tools"].add_one
+        )
+
+        del sys.modules["registry_test_tools"]
+
+        # next registry reads the schema and options from the cache
+        registry = tool_registry.ToolRegistry(tool_references)
+
+        assert registry.num_tools_imported_for_schemas == 0
+
+        (tool,) = registry.get_tools()
+
+        assert tool.__name__ == "add_one"
+        assert tool.tool_schema == expected_schema
+        assert tool_options.get_tool_options(tool).cache_ttl_seconds == 60.0
+
+        function_call_handler = FunctionCallHandler(functions=registry.get_tools())
+
+        assert function_call_handler.get_schema_for_tools_arg() == [expected_schema]
+        assert "registry_test_tools" not in sys.modules
+
+        # invalid calls are rejected without importing the tool
+        invalid_tool_result = function_call_handler.resolve(
+            anthropic.types.ToolUseBlock(
+                id="toolu_a", name="add_one", input={"value": "one"}, type="tool_use"
+            )
+        )
+
+        assert invalid_tool_result["is_error"]
+        assert "registry_test_tools" not in sys.modules
+
+        tool_result = function_call_handler.resolve(
+            anthropic.types.ToolUseBlock(
+                id="toolu_a", name="add_one", input={"value": 1}, type="tool_use"
+            )
+        )
+
+        assert tool_result["content"] == "2"
+        assert tool.is_loaded()
+
+        # changing the tool's module invalidates its cache entry
+        pathlib.Path("registry_test_tools.py").write_text(
+            _TOOL_MODULE_SOURCE.replace("Add one to the value.", "Increment the value.")
+        )
+        del sys.modules["registry_test_tools"]
+
+        changed_registry = tool_registry.ToolRegistry(tool_references)
+
+        assert changed_registry.num_tools_imported_for_schemas == 1
+        assert changed_registry.get_tools()[0].tool_schema["description"].startswith(
+            "Increment the value."
+        )
+
+        del sys.modules["registry_test_tools"]
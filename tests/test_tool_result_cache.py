@@ -0,0 +1,138 @@
+import pathlib
+
+import anthropic
+
+from local_claude.libs import directory_utils
+from local_claude.libs import tool_result_cache
+from local_claude.libs.function_call_handler import FunctionCallHandler
+from local_claude.libs.tool_options import tool_options
+
+
+_call_count = 0
+
+
+@tool_options(cache_ttl_seconds=60.0)
+def count_calls(query: str, page: int = 1) -> str:
+    """
+    Return the query, counting how many times this was actually called.
+
+    Args:
+        query (str): The query.
+        page (int): The page.
+
+    """
+
+    global _call_count
+    _call_count += 1
+
+    return f"{query}-{page}"
+
+
+def test_make_cache_key_ignores_argument_order() -> None:
+
+    assert tool_result_cache.make_cache_key(
+        "foo", {"a": 1, "b": [1, 2]}
+    ) == tool_result_cache.make_cache_key("foo", {"b": [1, 2], "a": 1})
+
+    assert tool_result_cache.make_cache_key(
+        "foo", {"a": 1}
+    ) != tool_result_cache.make_cache_key("bar", {"a": 1})
+
+    # results may depend on the workspace, so they aren't shared between workspaces
+    assert tool_result_cache.make_cache_key(
+        "foo", {"a": 1}, workspace_directory=pathlib.Path("workspace_a")
+    ) != tool_result_cache.make_cache_key(
+        "foo", {"a": 1}, workspace_directory=pathlib.Path("workspace_b")
+    )
+
+
+def test_tool_result_cache_ttl_and_lru_eviction() -> None:
+
+    now = 1000.0
+
+    cache = tool_result_cache.ToolResultCache(max_entries=2, clock=lambda: now)
+
+    cache.put("a", content="result_a", ttl_seconds=10.0)
+    cache.put("b", content="result_b", ttl_seconds=100.0)
+
+    # touch `a`, so `b` is least recently used and is evicted when adding `c`
+    assert cache.get("a") == "result_a"
+
+    cache.put("c", content="result_c", ttl_seconds=100.0)
+
+    assert cache.get("b") is None
+
+    # `a` expires
+    now = 1011.0
+
+    assert cache.get("a") is None
+    assert cache.get("c") == "result_c"
+
+    stats = cache.get_stats()
+
+    assert (stats.hits, stats.misses, stats.evictions, stats.num_entries) == (2, 2, 1, 1)
+    assert stats.get_hit_rate() == 0.5
+
+
+def test_tool_result_cache_persistent_store() -> None:
+
+    with directory_utils.temporary_working_directory():
+
+        filepath = pathlib.Path("cache") / "tool_results.sqlite3"
+
+        cache = tool_result_cache.ToolResultCache(
+            persistent_store=tool_result_cache.SqliteToolResultStore(filepath)
+        )
+
+        cache.put("a", content="result_a", ttl_seconds=60.0)
+        cache.put("expired", content="result_expired", ttl_seconds=-1.0)
+
+        # a new cache (ex: after a restart) reads from the same store
+        reopened_cache = tool_result_cache.ToolResultCache(
+            persistent_store=tool_result_cache.SqliteToolResultStore(filepath)
+        )
+
+        assert reopened_cache.get("a") == "result_a"
+        assert reopened_cache.get("expired") is None
+
+        assert reopened_cache.get_stats().num_entries == 1
+
+
+def test_function_call_handler_uses_tool_result_cache() -> None:
+
+    global _call_count
+    _call_count = 0
+
+    cache = tool_result_cache.ToolResultCache()
+
+    func_call_handler = FunctionCallHandler(
+        functions=[count_calls],
+        tool_result_cache=cache,
+    )
+
+    def make_tool_call(tool_use_id: str, tool_input: dict) -> anthropic.types.ToolUseBlock:
+        return anthropic.types.ToolUseBlock(
+            type="tool_use",
+            id=tool_use_id,
+            name="count_calls",
+            input=tool_input,
+        )
+
+    results = func_call_handler.resolve_many(
+        tool_calls=[
+            make_tool_call("toolu_1", {"query": "cats", "page": 2}),
+            make_tool_call("toolu_2", {"page": 3, "query": "dogs"}),
+        ]
+    )
+
+    # same arguments in a different order
+    repeated_result = func_call_handler.resolve(
+        tool_call=make_tool_call("toolu_3", {"page": 2, "query": "cats"})
+    )
+
+    assert _call_count == 2
+
+    assert repeated_result["content"] == results[0]["content"] == "cats-2"
+    assert repeated_result["tool_use_id"] == "toolu_3"
+
+    assert cache.get_stats().hits == 1
@@ -0,0 +1,91 @@
+import json
+
+import pytest
+
+from local_claude.libs import directory_utils
+from local_claude.libs import telemetry
+from local_claude.libs import tool_registry
+from local_claude.libs.tool_schema_variants import (
+    CompactToolDescription,
+    ToolSchemaVariant,
+    apply_tool_schema_variant,
+)
+from local_claude.libs.tools import default_tools
+
+
+def test_apply_tool_schema_variant() -> None:
+
+    tool_schema = {
+        "name": "add_one",
+        "description": "Add one to the value, which is a really long way of saying increment.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "value": {"type": "integer", "description": "The value to add one to."}
+            },
+            "required": ["value"],
+        },
+    }
+
+    compact_tool_descriptions = {
+        "add_one": CompactToolDescription(
+            description="Increment.",
+            parameter_descriptions={"value": "Value."},
+        )
+    }
+
+    assert apply_tool_schema_variant(
+        tool_schema, ToolSchemaVariant.FULL, compact_tool_descriptions
+    ) is tool_schema
+
+    compact_tool_schema = apply_tool_schema_variant(
+        tool_schema, ToolSchemaVariant.COMPACT, compact_tool_descriptions
+    )
+
+    assert compact_tool_schema["description"] == "Increment."
+    assert compact_tool_schema["input_schema"]["properties"]["value"] == {
+        "type": "integer",
+        "description": "Value.",
+    }
+
+    # original untouched
+    assert tool_schema["input_schema"]["properties"]["value"]["description"] == (
+        "The value to add one to."
+    )
+
+    # tools without a compact description keep theirs
+    assert apply_tool_schema_variant(tool_schema, ToolSchemaVariant.COMPACT, {}) is tool_schema
+
+    with pytest.raises(ValueError, match="unknown parameter `amount`"):
+        apply_tool_schema_variant(
+            tool_schema,
+            ToolSchemaVariant.COMPACT,
+            {"add_one": CompactToolDescription("Increment.", {"amount": "Amount."})},
+        )
+
+
+def test_default_compact_tool_descriptions_are_smaller() -> None:
+
+    with directory_utils.temporary_working_directory():
+        tool_schemas = [
+            tool_registry.get_tool_schema(x)
+            for x in tool_registry.ToolRegistry(default_tools.DEFAULT_TOOL_REFERENCES).get_tools()
+        ]
+
+    assert set(default_tools.DEFAULT_COMPACT_TOOL_DESCRIPTIONS) <= {x["name"] for x in tool_schemas}
+
+    def count_tokens(variant: ToolSchemaVariant) -> int:
+
+        # note: also checks every compact description only describes real parameters
+        return telemetry.estimate_token_count(
+            json.dumps(
+                [
+                    apply_tool_schema_variant(
+                        x, variant, default_tools.DEFAULT_COMPACT_TOOL_DESCRIPTIONS
+                    )
+                    for x in tool_schemas
+                ]
+            )
+        )
+
+    assert count_tokens(ToolSchemaVariant.COMPACT) < count_tokens(ToolSchemaVariant.FULL) / 2
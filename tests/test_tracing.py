@@ -0,0 +1,135 @@
+import asyncio
+import json
+import os
+import pathlib
+import pstats
+
+from local_claude.libs import directory_utils
+from local_claude.libs import process_pool
+from local_claude.libs import tool_execution
+from local_claude.libs import tool_options
+from local_claude.libs import tracing
+from local_claude.libs.tools import visit_url_using_user_browser
+
+
+def _get_span_events(tracer: tracing.Tracer) -> list[dict]:
+    return [x for x in tracer.get_events() if x["ph"] == "X"]
+
+
+def test_span_is_no_op_when_tracing_disabled() -> None:
+
+    assert tracing.get_current_tracer() is None
+
+    # note: the same shared context manager, so a disabled span doesn't allocate
+    assert tracing.span("a") is tracing.span("b")
+    assert tracing.profile("a") is tracing.span("b")
+
+
+def test_tracer_records_nested_spans_as_chrome_trace() -> None:
+
+    tracer = tracing.Tracer()
+
+    with tracing.tracing_enabled(tracer):
+        with tracing.span("outer", category="test", size=3):
+            with tracing.span("inner", category="test"):
+                pass
+
+    assert tracing.get_current_tracer() is None
+
+    # note: inner finishes first
+    inner, outer = _get_span_events(tracer)
+
+    assert (inner["name"], outer["name"]) == ("inner", "outer")
+    assert outer["args"] == {"size": "3"}
+    assert outer["ts"] <= inner["ts"]
+    assert inner["ts"] + inner["dur"] <= outer["ts"] + outer["dur"]
+
+    trace = json.loads(tracer.to_chrome_trace_json())
+
+    assert {x["ph"] for x in trace["traceEvents"]} == {"M", "X"}
+
+
+def test_traced_gives_each_asyncio_task_its_own_track() -> None:
+
+    @tracing.traced(category="test")
+    async def wait() -> None:
+        await asyncio.sleep(0.01)
+
+    async def wait_concurrently() -> None:
+        await asyncio.gather(wait(), wait())
+
+    tracer = tracing.Tracer()
+
+    with tracing.tracing_enabled(tracer):
+        asyncio.run(wait_concurrently())
+
+    span_events = _get_span_events(tracer)
+
+    assert [x["name"] for x in span_events] == [wait.__qualname__] * 2
+
+    # overlapping, so each needs its own track to be drawn
+    assert len({x["tid"] for x in span_events}) == 2
+
+
+def test_process_pool_sends_back_worker_spans() -> None:
+
+    tracer = tracing.Tracer()
+
+    try:
+        with tracing.tracing_enabled(tracer):
+            clean_html = process_pool.run_in_process_pool(
+                visit_url_using_user_browser._clean_html,
+                "<html> <script>x()</script>\n\n <p>hello</p> </html>",
+            )
+
+    finally:
+        process_pool.shutdown_process_pool()
+
+    assert "script" not in clean_html
+
+    pid_by_name = {x["name"]: x["pid"] for x in _get_span_events(tracer)}
+
+    assert pid_by_name["process_pool:_clean_html"] == os.getpid()
+    assert pid_by_name["_extract_text_content"] != os.getpid()
+    assert pid_by_name["_collapse_whitespace"] != os.getpid()
+
+
+def test_profiling_writes_profile_per_tool_call() -> None:
+
+    options = tool_options.ToolOptions(
+        execution_mode=tool_options.ExecutionMode.THREAD,
+        timeout_seconds=30.0,
+    )
+
+    with directory_utils.temporary_working_directory():
+
+        with tracing.profiling_enabled(pathlib.Path("profiles")):
+            tool_execution.run_tool(json.dumps, {"obj": [3, 1, 2]}, options)
+
+        (profile_filepath,) = pathlib.Path("profiles").glob("*_dumps.prof")
+
+        assert pstats.Stats(str(profile_filepath)).total_calls > 0
+
+
+def test_profiling_skips_blocks_while_another_capture_runs() -> None:
+
+    tracer = tracing.Tracer()
+
+    with directory_utils.temporary_working_directory():
+
+        with tracing.tracing_enabled(tracer), tracing.profiling_enabled(pathlib.Path("profiles")):
+
+            # note: cProfile allows one active profiler per process, so the inner block isn't captured
+            with tracing.profile("outer"):
+                with tracing.profile("inner"):
+                    json.dumps([1, 2, 3])
+
+        assert [x.name.split("_", 1)[1] for x in pathlib.Path("profiles").glob("*.prof")] == [
+            "outer.prof"
+        ]
+
+    (skipped_span,) = [
+        x for x in _get_span_events(tracer) if x["name"] == "profile_skipped:inner"
+    ]
+
+    assert skipped_span["args"]["reason"] == "another capture is running"